@@ -0,0 +1,13 @@
+from .columnar import ANALYTICS_ENGINE_ENABLED, AnalyticsEngine, analytics_engine
+from .sketches import SKETCHES_ENABLED, HyperLogLog, QuantileSketch, SketchStore, sketch_store
+
+__all__ = [
+    "ANALYTICS_ENGINE_ENABLED",
+    "AnalyticsEngine",
+    "analytics_engine",
+    "SKETCHES_ENABLED",
+    "HyperLogLog",
+    "QuantileSketch",
+    "SketchStore",
+    "sketch_store"
+]
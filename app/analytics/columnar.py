@@ -0,0 +1,464 @@
+"""
+In-memory columnar snapshot of the subscriptions table for cost queries
+
+Cost queries are interval arithmetic over (user_id, service_name, start_date,
+end_date, price), so the engine keeps those columns as compact NumPy arrays:
+
+* dates are encoded as integer month indices (see app.utils.periods),
+* service names are dictionary-encoded,
+* rows are sorted by user with an offset index, so a user filter is a slice.
+
+A snapshot is made of a large, immutable main segment and a small delta
+segment holding rows changed since the main segment was built. The delta is
+refreshed incrementally from the subscription change feed (upserts and delete
+tombstones) in a background thread, and the main segment is rebuilt
+periodically to fold the delta back in. Once the engine is warm, cost queries
+are answered from memory without touching Postgres.
+
+Every write through the API marks the worker's engine stale, so its cost
+routes answer from SQL until the next delta refresh has applied the change
+(read-your-writes within a worker). Other workers do not hear of the write:
+they keep answering from their snapshot until their own next refresh, up to
+ANALYTICS_REFRESH_SECONDS later (plus the refresh's duration).
+
+With ANALYTICS_SNAPSHOT_DIR set, one uvicorn worker (whichever holds the build
+lock) writes the main segment as .npy files and every worker maps them with
+mmap, so all workers share a single copy in the page cache.
+
+NumPy is an optional dependency; without it the engine stays disabled and the
+routes fall back to SQL.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import select
+
+from app.database.session import engine as db_engine
+from app.models.subscription import Service, Subscription
+from app.repositories.subscription import CursorExpired, change_cursor, changes_since
+from app.utils.logger import get_logger
+from app.utils.periods import month_index
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+# Load environment variables
+load_dotenv()
+
+# Analytics engine configuration
+ANALYTICS_ENGINE_ENABLED = os.getenv("ANALYTICS_ENGINE_ENABLED", "False").lower() == "true"
+ANALYTICS_SNAPSHOT_DIR = os.getenv("ANALYTICS_SNAPSHOT_DIR", "")
+ANALYTICS_REFRESH_SECONDS = float(os.getenv("ANALYTICS_REFRESH_SECONDS", "5"))
+ANALYTICS_FULL_REFRESH_SECONDS = float(os.getenv("ANALYTICS_FULL_REFRESH_SECONDS", "600"))
+
+LOAD_CHUNK_ROWS = 50000
+CHANGES_PAGE_ROWS = 5000
+
+# Month index used for subscriptions without an end date
+OPEN_END = 2 ** 31 - 1
+
+SEGMENT_ARRAYS = ("user_keys", "offsets", "services", "starts", "ends", "prices", "sorted_ids", "id_positions")
+
+logger = get_logger(__name__)
+
+subscriptions = Subscription.__table__
+services = Service.__table__
+
+_LOAD = select(
+    subscriptions.c.id,
+    subscriptions.c.user_id,
+    services.c.name.label("service_name"),
+    subscriptions.c.start_date,
+    subscriptions.c.end_date,
+    subscriptions.c.price,
+).select_from(subscriptions.join(services, services.c.id == subscriptions.c.service_id))
+
+
+def start_key(start_date: date) -> int:
+    """
+    Month index from which a subscription counts
+
+    The SQL filter is start_date <= first day of the period's last month, so a
+    subscription starting mid-month only counts from the following month.
+    """
+    return month_index(start_date) + (1 if start_date.day > 1 else 0)
+
+
+def end_key(end_date: Optional[date]) -> int:
+    """Last month index in which a subscription counts"""
+    return OPEN_END if end_date is None else month_index(end_date)
+
+
+def _encode_row(row) -> Tuple[bytes, bytes, str, int, int, int]:
+    return (
+        row.id.bytes,
+        row.user_id.bytes,
+        row.service_name,
+        start_key(row.start_date),
+        end_key(row.end_date),
+        row.price,
+    )
+
+
+class Segment:
+    """Column arrays for a set of subscription rows, sorted by user"""
+
+    def __init__(self, arrays: Dict[str, "np.ndarray"], service_names: List[str]):
+        self.arrays = arrays
+        self.service_names = service_names
+        self.size = len(arrays["prices"])
+        for name in SEGMENT_ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def build(cls, chunks: Iterable[List[Tuple[bytes, bytes, str, int, int, int]]]) -> "Segment":
+        """Build a segment from chunks of encoded rows"""
+        service_codes: Dict[str, int] = {}
+        parts: Dict[str, list] = {name: [] for name in ("ids", "users", "services", "starts", "ends", "prices")}
+
+        for chunk in chunks:
+            if not chunk:
+                continue
+            ids, users, names, starts, ends, prices = zip(*chunk)
+            parts["ids"].append(np.array(ids, dtype="S16"))
+            parts["users"].append(np.array(users, dtype="S16"))
+            parts["services"].append(np.array(
+                [service_codes.setdefault(name, len(service_codes)) for name in names], dtype=np.int32
+            ))
+            parts["starts"].append(np.array(starts, dtype=np.int32))
+            parts["ends"].append(np.array(ends, dtype=np.int32))
+            parts["prices"].append(np.array(prices, dtype=np.int64))
+
+        dtypes = {"ids": "S16", "users": "S16", "services": np.int32,
+                  "starts": np.int32, "ends": np.int32, "prices": np.int64}
+        columns = {
+            name: np.concatenate(pieces) if pieces else np.empty(0, dtype=dtypes[name])
+            for name, pieces in parts.items()
+        }
+
+        # Sort rows by user and index each user's slice
+        order = np.argsort(columns["users"], kind="stable")
+        users = columns["users"][order]
+        user_keys, first_rows = np.unique(users, return_index=True)
+
+        ids = columns["ids"][order]
+        id_positions = np.argsort(ids, kind="stable")
+
+        arrays = {
+            "user_keys": user_keys,
+            "offsets": np.append(first_rows, len(users)).astype(np.int64),
+            "services": columns["services"][order],
+            "starts": columns["starts"][order],
+            "ends": columns["ends"][order],
+            "prices": columns["prices"][order],
+            "sorted_ids": ids[id_positions],
+            "id_positions": id_positions.astype(np.int64),
+        }
+        names = sorted(service_codes, key=service_codes.get)
+        return cls(arrays, names)
+
+    def save(self, directory: str, meta: Dict):
+        os.makedirs(directory, exist_ok=True)
+        for name in SEGMENT_ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), self.arrays[name])
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump({**meta, "service_names": self.service_names}, f)
+
+    @classmethod
+    def load(cls, directory: str) -> Tuple["Segment", Dict]:
+        """Map a saved segment read-only into memory"""
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            for name in SEGMENT_ARRAYS
+        }
+        return cls(arrays, meta.pop("service_names")), meta
+
+    def positions_of(self, row_ids: List[bytes]) -> "np.ndarray":
+        """Row positions of the given ids that exist in this segment"""
+        if not row_ids or not self.size:
+            return np.empty(0, dtype=np.int64)
+        keys = np.array(row_ids, dtype="S16")
+        found = np.searchsorted(self.sorted_ids, keys)
+        found = np.minimum(found, self.size - 1)
+        hits = self.sorted_ids[found] == keys
+        return self.id_positions[found[hits]]
+
+    def select(
+        self,
+        start_m: int,
+        end_m: int,
+        user_id: Optional[uuid.UUID],
+        service_name: Optional[str],
+        live: Optional["np.ndarray"] = None
+    ) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+        """Prices, start and end keys of rows overlapping [start_m, end_m]"""
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32))
+        rows = slice(0, self.size)
+        if user_id is not None:
+            key = np.array(user_id.bytes, dtype="S16")
+            pos = int(np.searchsorted(self.user_keys, key))
+            if pos >= len(self.user_keys) or self.user_keys[pos] != key:
+                return empty
+            rows = slice(int(self.offsets[pos]), int(self.offsets[pos + 1]))
+
+        starts, ends = self.starts[rows], self.ends[rows]
+        mask = (starts <= end_m) & (ends >= start_m)
+        if live is not None:
+            mask &= live[rows]
+        if service_name:
+            needle = service_name.lower()
+            codes = [code for code, name in enumerate(self.service_names) if needle in name.lower()]
+            if not codes:
+                return empty
+            mask &= np.isin(self.services[rows], codes)
+
+        return self.prices[rows][mask], starts[mask], ends[mask]
+
+
+class Snapshot:
+    """Main segment, its liveness mask and the delta of rows changed since it was built"""
+
+    def __init__(self, main: Segment, live: "np.ndarray", delta: Segment):
+        self.main = main
+        self.live = live
+        self.delta = delta
+
+    def select(self, start_m, end_m, user_id, service_name):
+        main = self.main.select(start_m, end_m, user_id, service_name, self.live)
+        delta = self.delta.select(start_m, end_m, user_id, service_name)
+        return tuple(np.concatenate(pair) for pair in zip(main, delta))
+
+
+class AnalyticsEngine:
+    """Keeps a columnar snapshot of subscriptions warm and answers cost queries from it"""
+
+    def __init__(
+        self,
+        bind=db_engine,
+        snapshot_dir: str = ANALYTICS_SNAPSHOT_DIR,
+        refresh_seconds: float = ANALYTICS_REFRESH_SECONDS,
+        full_refresh_seconds: float = ANALYTICS_FULL_REFRESH_SECONDS
+    ):
+        self.bind = bind
+        self.snapshot_dir = snapshot_dir
+        self.refresh_seconds = refresh_seconds
+        self.full_refresh_seconds = full_refresh_seconds
+
+        self._snapshot: Optional[Snapshot] = None
+        self._delta_rows: Dict[bytes, Tuple] = {}
+        self._cursor: Tuple[int, int] = (0, 0)
+        self._main_version: Optional[str] = None
+        self._main_built_at = 0.0
+        self._lock_file = None
+        self._stale = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._snapshot is not None and not self._stale.is_set()
+
+    def start(self):
+        """Start keeping the snapshot warm in a background thread"""
+        if np is None:
+            logger.error("Analytics engine requires numpy; falling back to SQL cost queries")
+            return
+        self._thread = threading.Thread(target=self._run, name="analytics-engine", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def mark_stale(self):
+        """Stop answering from the snapshot until the next refresh has run"""
+        self._stale.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Analytics snapshot refresh failed: {str(e)}")
+            self._stop.wait(self.refresh_seconds)
+
+    def refresh(self):
+        """Adopt or rebuild the main segment if due, then apply recent changes"""
+        self._stale.clear()
+        if self.snapshot_dir:
+            self._refresh_shared_main()
+        elif self._snapshot is None or time.monotonic() - self._main_built_at >= self.full_refresh_seconds:
+            segment, cursor = self._build_main()
+            self._adopt_main(segment, cursor)
+        try:
+            self._refresh_delta()
+        except CursorExpired:
+            # Behind the compacted part of the feed: only a rebuild catches up
+            logger.warning("Analytics snapshot is behind the change feed horizon, rebuilding")
+            self._main_built_at = -float("inf")
+            self.mark_stale()
+
+    def _build_main(self) -> Tuple[Segment, Tuple[int, int]]:
+        """Load every row, returning the segment and the change feed cursor to continue from"""
+        started = time.perf_counter()
+        with self.bind.connect() as conn:
+            # One snapshot for the cursor and the rows, so no change falls in between
+            conn = conn.execution_options(isolation_level="REPEATABLE READ", stream_results=True)
+            with conn.begin():
+                cursor = change_cursor(conn)
+                result = conn.execute(_LOAD)
+
+                def chunks():
+                    while True:
+                        rows = result.fetchmany(LOAD_CHUNK_ROWS)
+                        if not rows:
+                            break
+                        yield [_encode_row(row) for row in rows]
+
+                segment = Segment.build(chunks())
+
+        self._main_built_at = time.monotonic()
+        logger.info(f"Built analytics snapshot of {segment.size} rows in {time.perf_counter() - started:.2f}s")
+        return segment, cursor
+
+    def _adopt_main(self, segment: Segment, cursor: Tuple[int, int]):
+        self._delta_rows = {}
+        self._cursor = cursor
+        self._snapshot = Snapshot(segment, np.ones(segment.size, dtype=bool), Segment.build([]))
+
+    def _refresh_shared_main(self):
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        current_file = os.path.join(self.snapshot_dir, "CURRENT")
+
+        due = time.monotonic() - self._main_built_at >= self.full_refresh_seconds
+        if (due or not os.path.exists(current_file)) and self._acquire_build_lock():
+            segment, cursor = self._build_main()
+            version = f"v{int(time.time() * 1000)}"
+            segment.save(os.path.join(self.snapshot_dir, version), {"cursor": list(cursor)})
+
+            # Publish the new version atomically and drop all but the previous one
+            tmp_file = f"{current_file}.tmp"
+            with open(tmp_file, "w") as f:
+                f.write(version)
+            os.replace(tmp_file, current_file)
+            for old in sorted(n for n in os.listdir(self.snapshot_dir) if n.startswith("v"))[:-2]:
+                shutil.rmtree(os.path.join(self.snapshot_dir, old), ignore_errors=True)
+
+        if not os.path.exists(current_file):
+            return
+        with open(current_file) as f:
+            version = f.read().strip()
+        if version != self._main_version:
+            segment, meta = Segment.load(os.path.join(self.snapshot_dir, version))
+            self._main_version = version
+            self._adopt_main(segment, tuple(meta["cursor"]))
+            logger.info(f"Mapped analytics snapshot {version} ({segment.size} rows)")
+
+    def _acquire_build_lock(self) -> bool:
+        """Let only one worker build the shared snapshot"""
+        if fcntl is None:
+            return True
+        if self._lock_file is None:
+            lock_file = open(os.path.join(self.snapshot_dir, "build.lock"), "w")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            self._lock_file = lock_file
+        return True
+
+    def _refresh_delta(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            return
+
+        changed: List[bytes] = []
+        with self.bind.connect() as conn:
+            more = True
+            while more:
+                upserts, deletes, self._cursor, more = changes_since(conn, self._cursor, CHANGES_PAGE_ROWS)
+                for row in upserts:
+                    encoded = _encode_row(row)
+                    if self._delta_rows.get(encoded[0]) != encoded:
+                        self._delta_rows[encoded[0]] = encoded
+                        changed.append(encoded[0])
+                for subscription_id in deletes:
+                    self._delta_rows.pop(subscription_id.bytes, None)
+                    changed.append(subscription_id.bytes)
+
+        if not changed:
+            return
+
+        # Hide superseded or deleted main rows and rebuild the (small) delta segment
+        live = snapshot.live.copy()
+        live[snapshot.main.positions_of(changed)] = False
+        delta = Segment.build([list(self._delta_rows.values())])
+        self._snapshot = Snapshot(snapshot.main, live, delta)
+
+    def total_cost(
+        self,
+        start_m: int,
+        end_m: int,
+        user_id: Optional[uuid.UUID] = None,
+        service_name: Optional[str] = None
+    ) -> Tuple[int, int]:
+        """
+        Sum prices of subscriptions overlapping the months [start_m, end_m]
+
+        Returns:
+            (total cost, number of subscriptions)
+        """
+        prices, _, _ = self._snapshot.select(start_m, end_m, user_id, service_name)
+        return int(prices.sum()), int(len(prices))
+
+    def monthly_cost(
+        self,
+        start_m: int,
+        end_m: int,
+        user_id: Optional[uuid.UUID] = None,
+        service_name: Optional[str] = None
+    ) -> List[Tuple[int, int, int]]:
+        """
+        Per-month cost breakdown of the months [start_m, end_m]
+
+        Returns:
+            List of (month index, total cost, number of subscriptions)
+        """
+        prices, starts, ends = self._snapshot.select(start_m, end_m, user_id, service_name)
+        months = end_m - start_m + 1
+
+        # Each subscription adds its price from its first to its last active month
+        first = np.maximum(starts, start_m) - start_m
+        last = np.minimum(ends, end_m) - start_m + 1
+        cost = np.zeros(months + 1, dtype=np.int64)
+        count = np.zeros(months + 1, dtype=np.int64)
+        np.add.at(cost, first, prices)
+        np.subtract.at(cost, last, prices)
+        np.add.at(count, first, 1)
+        np.subtract.at(count, last, 1)
+
+        cost, count = np.cumsum(cost[:-1]), np.cumsum(count[:-1])
+        return [(start_m + i, int(cost[i]), int(count[i])) for i in range(months)]
+
+
+# Shared engine, started on application startup when enabled
+analytics_engine = AnalyticsEngine()
@@ -0,0 +1,417 @@
+"""
+Approximate distinct users and spend quantiles per service and month
+
+COUNT(DISTINCT user_id) and per-user spend percentiles over the whole table
+are too expensive to run per request, so the store keeps two small mergeable
+sketches for every (service, month) of a trailing window:
+
+* a HyperLogLog of the subscribed users, for distinct subscriber counts,
+* a DDSketch of each user's monthly spend on the service, for quantiles.
+
+Because both merge losslessly, a query over several months (or several
+services matching a name filter) merges the sketches involved and a sharded
+database is rebuilt shard by shard into one store. An aggregate over all
+services (ALL_SERVICES) is kept per month as well, so unfiltered queries merge
+at most one sketch per month and every query takes milliseconds. Its spend
+sketch holds the same samples as the per-service ones, the spend of each user
+on each service, not a user's total spend over all services.
+
+The store is rebuilt from the table in a background thread, only when full
+refreshes are due: the aggregate behind it is the expensive query the store
+exists to avoid. In between, subscriptions created or updated through the API
+are added right away. The values they replace, and deleted subscriptions,
+cannot be taken out of a HyperLogLog, so those writes mark the store stale
+until the next full rebuild, and answers carry that flag. Each uvicorn worker
+keeps its own store and only sees other workers' writes after its next rebuild.
+"""
+import hashlib
+import math
+import os
+import threading
+import time
+import uuid
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.database.sharding import shard_router
+from app.repositories.subscription import user_month_spend
+from app.utils.logger import get_logger
+from app.utils.periods import month_index, month_index_to_date
+
+# Load environment variables
+load_dotenv()
+
+# Sketch store configuration
+SKETCHES_ENABLED = os.getenv("SKETCHES_ENABLED", "False").lower() == "true"
+SKETCH_MONTHS = int(os.getenv("SKETCH_MONTHS", "24"))
+SKETCH_REFRESH_SECONDS = float(os.getenv("SKETCH_REFRESH_SECONDS", "60"))
+SKETCH_FULL_REFRESH_SECONDS = float(os.getenv("SKETCH_FULL_REFRESH_SECONDS", "3600"))
+SKETCH_HLL_PRECISION = int(os.getenv("SKETCH_HLL_PRECISION", "12"))
+SKETCH_QUANTILE_ACCURACY = float(os.getenv("SKETCH_QUANTILE_ACCURACY", "0.01"))
+
+LOAD_CHUNK_ROWS = 50000
+# Merged (name filter, month) sketches kept for repeated queries
+MERGED_CACHE_SIZE = 4096
+
+# Key of the sketches over all services (service names are never None)
+ALL_SERVICES = None
+
+logger = get_logger(__name__)
+
+_INVERSE_POWERS = [2.0 ** -rank for rank in range(65)]
+
+
+def hash_user(user_id: uuid.UUID) -> int:
+    """Unsigned 64-bit hash of a user id (client-chosen ids need not be random)"""
+    return int.from_bytes(hashlib.blake2b(user_id.bytes, digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """
+    HyperLogLog distinct counter over 64-bit hashes
+
+    Registers start sparse, as a dict of the few that are set, and become a
+    bytearray once a sixteenth of them are, so the long tail of small
+    services stays small. The relative standard error is 1.04 / sqrt(2 ** precision).
+    """
+
+    __slots__ = ("precision", "_sparse", "_dense")
+
+    def __init__(self, precision: int = SKETCH_HLL_PRECISION):
+        self.precision = precision
+        self._sparse: Dict[int, int] = {}
+        self._dense: Optional[bytearray] = None
+
+    @property
+    def size(self) -> int:
+        return 1 << self.precision
+
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(self.size)
+
+    def add_hash(self, value: int):
+        width = 64 - self.precision
+        index = value >> width
+        rank = width - (value & ((1 << width) - 1)).bit_length() + 1
+        if self._dense is not None:
+            if self._dense[index] < rank:
+                self._dense[index] = rank
+        elif self._sparse.get(index, 0) < rank:
+            self._sparse[index] = rank
+            if len(self._sparse) > self.size // 16:
+                self._densify()
+
+    def add(self, user_id: uuid.UUID):
+        self.add_hash(hash_user(user_id))
+
+    def _densify(self):
+        dense = bytearray(self.size)
+        for index, rank in self._sparse.items():
+            dense[index] = rank
+        self._dense, self._sparse = dense, {}
+
+    def merge(self, other: "HyperLogLog"):
+        """Add every value counted by other (same precision)"""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLogs of different precision")
+        if other._dense is not None:
+            if self._dense is None:
+                self._densify()
+            self._dense = bytearray(map(max, self._dense, other._dense))
+            return
+        for index, rank in other._sparse.items():
+            if self._dense is not None:
+                if self._dense[index] < rank:
+                    self._dense[index] = rank
+            elif self._sparse.get(index, 0) < rank:
+                self._sparse[index] = rank
+        if self._dense is None and len(self._sparse) > self.size // 16:
+            self._densify()
+
+    def estimate(self) -> float:
+        size = self.size
+        if self._dense is not None:
+            zeros = self._dense.count(0)
+            harmonic = sum(map(_INVERSE_POWERS.__getitem__, self._dense))
+        else:
+            zeros = size - len(self._sparse)
+            harmonic = zeros + sum(map(_INVERSE_POWERS.__getitem__, self._sparse.values()))
+        raw = 0.7213 / (1 + 1.079 / size) * size * size / harmonic
+        if raw <= 2.5 * size and zeros:
+            # Linear counting is more accurate while registers are still empty
+            return size * math.log(size / zeros)
+        return raw
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with relative accuracy (DDSketch)
+
+    Values fall into logarithmic buckets ((gamma ** (k - 1), gamma ** k] for
+    gamma = (1 + a) / (1 - a)), so any quantile comes back within a relative
+    accuracy a of the true value. Merging adds bucket counts.
+    """
+
+    __slots__ = ("relative_accuracy", "_gamma", "_log_gamma", "_bins", "zero_count", "count")
+
+    def __init__(self, relative_accuracy: float = SKETCH_QUANTILE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value: float, count: int = 1):
+        if value <= 0:
+            self.zero_count += count
+        else:
+            key = math.ceil(math.log(value) / self._log_gamma)
+            self._bins[key] = self._bins.get(key, 0) + count
+        self.count += count
+
+    def merge(self, other: "QuantileSketch"):
+        """Add every value counted by other (same accuracy)"""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge quantile sketches of different accuracy")
+        for key, count in other._bins.items():
+            self._bins[key] = self._bins.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantiles(self, qs: List[float]) -> List[Optional[float]]:
+        """Estimates of the given quantiles (None while empty)"""
+        if not self.count:
+            return [None for _ in qs]
+        ranks = sorted((q * (self.count - 1), i) for i, q in enumerate(qs))
+        values: List[Optional[float]] = [None] * len(ranks)
+        seen = self.zero_count
+        keys = iter(sorted(self._bins))
+        key = None
+        for rank, i in ranks:
+            if rank < self.zero_count:
+                values[i] = 0.0
+                continue
+            while seen <= rank:
+                key = next(keys)
+                seen += self._bins[key]
+            values[i] = 2 * self._gamma ** key / (self._gamma + 1)
+        return values
+
+
+class SketchStore:
+    """Keeps distinct user and spend sketches per (service, month) and answers estimates from them"""
+
+    def __init__(
+        self,
+        binds=None,
+        months: int = SKETCH_MONTHS,
+        refresh_seconds: float = SKETCH_REFRESH_SECONDS,
+        full_refresh_seconds: float = SKETCH_FULL_REFRESH_SECONDS,
+        precision: int = SKETCH_HLL_PRECISION,
+        relative_accuracy: float = SKETCH_QUANTILE_ACCURACY
+    ):
+        self.binds = binds
+        self.months = months
+        self.refresh_seconds = refresh_seconds
+        self.full_refresh_seconds = full_refresh_seconds
+        self.precision = precision
+        self.relative_accuracy = relative_accuracy
+
+        # month index -> service name (or ALL_SERVICES) -> sketches
+        self._sketches: Optional[Dict[int, Dict[Optional[str], Tuple[HyperLogLog, QuantileSketch]]]] = None
+        self._window: Tuple[int, int] = (0, -1)
+        self._built_at: Optional[datetime] = None
+        self._built_monotonic = 0.0
+        self._pending: Optional[list] = None
+        # (lowercased name filter, month index) -> sketches merged over the matching services
+        self._merged: Dict[Tuple[str, int], Tuple[HyperLogLog, QuantileSketch]] = {}
+        self._lock = threading.Lock()
+        self._stale = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._sketches is not None
+
+    @property
+    def stale(self) -> bool:
+        return self._stale.is_set()
+
+    @property
+    def built_at(self) -> Optional[datetime]:
+        return self._built_at
+
+    @property
+    def window(self) -> Tuple[int, int]:
+        """(first, last) month index covered by the sketches"""
+        return self._window
+
+    def start(self):
+        """Build the sketches and keep them current in a background thread"""
+        self._thread = threading.Thread(target=self._run, name="sketch-store", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def mark_stale(self):
+        """Note a change the sketches cannot take back out; answers are stale until the next full rebuild"""
+        self._stale.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            # Staleness alone does not trigger a rebuild, or every write would
+            due = time.monotonic() - self._built_monotonic >= self.full_refresh_seconds
+            if not self.ready or due:
+                try:
+                    self.rebuild()
+                except Exception as e:
+                    logger.error(f"Sketch rebuild failed: {str(e)}")
+            self._stop.wait(self.refresh_seconds)
+
+    def _new_sketches(self) -> Tuple[HyperLogLog, QuantileSketch]:
+        return HyperLogLog(self.precision), QuantileSketch(self.relative_accuracy)
+
+    def _add(self, sketches: dict, service_name: str, month: int, user_hash: int, spend: int):
+        by_service = sketches.setdefault(month, {})
+        # Per (user, service) spend samples in both, so ALL_SERVICES answers
+        # the same question as a service filter over every service
+        for key in (service_name, ALL_SERVICES):
+            pair = by_service.get(key)
+            if pair is None:
+                pair = by_service[key] = self._new_sketches()
+            pair[0].add_hash(user_hash)
+            pair[1].add(spend)
+
+    def rebuild(self, today: Optional[date] = None):
+        """Rebuild every sketch of the window ending this month from the table (all shards)"""
+        started = time.perf_counter()
+        last = month_index(today or date.today())
+        first = last - self.months + 1
+        self._stale.clear()
+        with self._lock:
+            self._pending = []
+
+        sketches: dict = {}
+        rows = 0
+        for bind in self.binds if self.binds is not None else shard_router.engines:
+            with bind.connect() as conn:
+                result = user_month_spend(
+                    conn.execution_options(stream_results=True), month_index_to_date(first), month_index_to_date(last)
+                )
+                while True:
+                    chunk = result.fetchmany(LOAD_CHUNK_ROWS)
+                    if not chunk:
+                        break
+                    for service_name, month, user_id, spend in chunk:
+                        self._add(sketches, service_name, month_index(month), hash_user(user_id), int(spend))
+                    rows += len(chunk)
+
+        with self._lock:
+            # Subscriptions created while the table was read may be missing from
+            # it; adding one twice only adds a duplicate spend sample
+            pending, self._pending = self._pending, None
+            self._sketches = sketches
+            self._merged = {}
+            self._window = (first, last)
+            for row in pending:
+                self._record(row)
+            self._built_at = datetime.utcnow()
+            self._built_monotonic = time.monotonic()
+        logger.info(f"Built sketches from {rows} user months in {time.perf_counter() - started:.2f}s")
+
+    def record(self, row):
+        """
+        Add a created or updated subscription (a row with service_name, user_id,
+        price, start_date, end_date); for an update, also call mark_stale()
+        """
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(row)
+            if self._sketches is not None:
+                self._record(row)
+                self._merged = {}
+
+    def _record(self, row):
+        first, last = self._window
+        # Same rule as the cost queries: a mid-month start counts from the next month
+        start = month_index(row.start_date) + (1 if row.start_date.day > 1 else 0)
+        end = last if row.end_date is None else min(month_index(row.end_date), last)
+        user_hash = hash_user(row.user_id)
+        for month in range(max(start, first), end + 1):
+            self._add(self._sketches, row.service_name, month, user_hash, row.price)
+
+    def _month(self, service_name: Optional[str], month: int) -> Optional[Tuple[HyperLogLog, QuantileSketch]]:
+        """Sketches of the services matching the name (like the cost filters) in a month"""
+        by_service = self._sketches.get(month, {})
+        if not service_name:
+            return by_service.get(ALL_SERVICES)
+        key = (service_name.lower(), month)
+        pair = self._merged.get(key)
+        if pair is None:
+            # A broad filter matches hundreds of services; merging them is the
+            # slow part of an estimate, so repeated queries reuse the result
+            if len(self._merged) >= MERGED_CACHE_SIZE:
+                self._merged.clear()
+            pair = self._merged[key] = self._new_sketches()
+            for name, (hll, quantiles) in by_service.items():
+                if name is not ALL_SERVICES and key[0] in name.lower():
+                    pair[0].merge(hll)
+                    pair[1].merge(quantiles)
+        return pair
+
+    def distinct_users(
+        self,
+        start_m: int,
+        end_m: int,
+        service_name: Optional[str] = None
+    ) -> Tuple[HyperLogLog, List[Tuple[int, HyperLogLog]]]:
+        """
+        Distinct users of services matching the name (like the cost filters) in [start_m, end_m]
+
+        Returns:
+            (sketch of the whole period, [(month index, sketch of the month)])
+        """
+        total = HyperLogLog(self.precision)
+        months = []
+        with self._lock:
+            for month in range(start_m, end_m + 1):
+                pair = self._month(service_name, month)
+                sketch = pair[0] if pair is not None else HyperLogLog(self.precision)
+                total.merge(sketch)
+                months.append((month, sketch))
+        return total, months
+
+    def spend(
+        self,
+        start_m: int,
+        end_m: int,
+        service_name: Optional[str] = None
+    ) -> Tuple[QuantileSketch, List[Tuple[int, QuantileSketch]]]:
+        """
+        Monthly spend per user and service of services matching the name in [start_m, end_m]
+
+        Returns:
+            (sketch of the whole period, [(month index, sketch of the month)])
+        """
+        total = QuantileSketch(self.relative_accuracy)
+        months = []
+        with self._lock:
+            for month in range(start_m, end_m + 1):
+                pair = self._month(service_name, month)
+                sketch = pair[1] if pair is not None else QuantileSketch(self.relative_accuracy)
+                total.merge(sketch)
+                months.append((month, sketch))
+        return total, months
+
+
+# Shared sketch store
+sketch_store = SketchStore()
@@ -1,7 +1,13 @@
 from fastapi import APIRouter
 from .routes.subscriptions import router as subscriptions_router
+from .routes.admin import router as admin_router
+from .routes.reports import router as reports_router
+from .routes.analytics import router as analytics_router
 
 router = APIRouter()
 router.include_router(subscriptions_router, prefix="/subscriptions", tags=["subscriptions"])
+router.include_router(reports_router, prefix="/reports", tags=["reports"])
+router.include_router(analytics_router, prefix="/analytics", tags=["analytics"])
+router.include_router(admin_router, prefix="/admin", tags=["admin"])
 
 __all__ = ["router"]
\ No newline at end of file
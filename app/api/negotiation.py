@@ -0,0 +1,205 @@
+"""
+MessagePack content negotiation
+
+Service-to-service clients fetching many subscriptions can ask for
+application/msgpack instead of JSON (Accept) and send request bodies in it
+(Content-Type). The encoding is compact rather than a transliteration of the
+JSON: UUIDs are 16-byte binaries, month periods their integer month index
+(year * 12 + month - 1, see app.utils.periods) and timestamps integer
+microseconds since the Unix epoch (UTC). Objects stay maps keyed by the JSON
+field names.
+
+Request bodies are decoded by MsgPackRoute before FastAPI validates them, so
+the same pydantic schemas check both encodings. Binary UUIDs are accepted as
+they are; integers in month period fields are marked as MonthIndex, the only
+integers the schemas take for a month (JSON bodies still need MM-YYYY).
+
+msgpack is optional: without it Accept: application/msgpack is answered with
+JSON, and MessagePack request bodies with 415.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, FrozenSet, Optional, get_args
+import uuid
+
+from fastapi import Header, HTTPException, Request, Response
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, BeforeValidator
+
+from app.schemas.subscription import MonthIndex, parse_month_period
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+# Names MessagePack goes by in Accept and Content-Type headers
+_MSGPACK_TYPES = {"application/msgpack", "application/x-msgpack", "application/vnd.msgpack"}
+_JSON_TYPES = {"application/json", "application/*", "*/*"}
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _timestamp(value: datetime) -> int:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - _EPOCH) // _MICROSECOND
+
+
+def _encode(value: Any) -> Any:
+    """Compact form of the values msgpack cannot pack by itself"""
+    if isinstance(value, BaseModel):
+        # Field values as validated (month periods are still month indexes);
+        # UUIDs and timestamps are converted right here rather than in one
+        # callback each, which is most of the encoding time of a list page
+        fields = value.__dict__.copy()
+        for name, field in fields.items():
+            if type(field) is uuid.UUID:
+                fields[name] = field.bytes
+            elif type(field) is datetime:
+                fields[name] = _timestamp(field)
+        return fields
+    if isinstance(value, uuid.UUID):
+        return value.bytes
+    if isinstance(value, datetime):
+        return _timestamp(value)
+    raise TypeError(f"Cannot encode {type(value).__name__} as MessagePack")
+
+
+def packb(content: Any) -> bytes:
+    """Encode response content (models, lists of models, plain values)"""
+    return msgpack.packb(content, default=_encode)
+
+
+def unpackb(data: bytes) -> Any:
+    """Decode a request body"""
+    return msgpack.unpackb(data)
+
+
+def _media_type(value: str) -> str:
+    return value.split(";", 1)[0].strip().lower()
+
+
+def is_msgpack(content_type: Optional[str]) -> bool:
+    return content_type is not None and _media_type(content_type) in _MSGPACK_TYPES
+
+
+def accepts_msgpack(accept: Optional[str]) -> bool:
+    """
+    Whether an Accept header prefers MessagePack over JSON
+
+    MessagePack wins ties, since clients only name it when they can read it.
+    """
+    if msgpack is None or not accept:
+        return False
+    msgpack_q = json_q = 0.0
+    for item in accept.split(","):
+        media_type, _, params = item.partition(";")
+        media_type = media_type.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media_type in _MSGPACK_TYPES:
+            msgpack_q = max(msgpack_q, q)
+        elif media_type in _JSON_TYPES:
+            json_q = max(json_q, q)
+    return msgpack_q > 0 and msgpack_q >= json_q
+
+
+class MsgPackResponse(Response):
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def render(self, content: Any) -> bytes:
+        return packb(content)
+
+
+def prefers_msgpack(response: Response, accept: Optional[str] = Header(None, include_in_schema=False)) -> bool:
+    """Dependency: whether to answer in MessagePack (the response then varies by Accept)"""
+    response.headers["Vary"] = "Accept"
+    return accepts_msgpack(accept)
+
+
+def negotiated(content: Any, as_msgpack: bool, response: Response, status_code: int = 200) -> Any:
+    """
+    Content for FastAPI to render as JSON, or the same content as a MessagePack response
+
+    Headers already set on the injected response are carried over.
+    """
+    if not as_msgpack:
+        return content
+    return MsgPackResponse(content, status_code=status_code, headers=response.headers)
+
+
+def _parses_months(metadata) -> bool:
+    return any(isinstance(item, BeforeValidator) and item.func is parse_month_period for item in metadata)
+
+
+def _is_month_period(annotation: Any) -> bool:
+    """Whether a field annotation is a MonthPeriod (possibly Optional)"""
+    if _parses_months(getattr(annotation, "__metadata__", ())):
+        return True
+    return any(_is_month_period(arg) for arg in get_args(annotation))
+
+
+def month_fields(model: Any) -> FrozenSet[str]:
+    """Names (as sent) of the month period fields of a request body model"""
+    if not (isinstance(model, type) and issubclass(model, BaseModel)):
+        return frozenset()
+    return frozenset(
+        field.alias or name
+        for name, field in model.model_fields.items()
+        if _parses_months(field.metadata) or _is_month_period(field.annotation)
+    )
+
+
+def mark_months(body: Any, fields: FrozenSet[str]) -> Any:
+    """Wrap the integers of month period fields of a decoded body in MonthIndex"""
+    if not fields or not isinstance(body, dict):
+        return body
+    return {
+        key: MonthIndex(value) if key in fields and type(value) is int else value
+        for key, value in body.items()
+    }
+
+
+class _MsgPackRequest(Request):
+    """Request whose MessagePack body FastAPI reads as if it were JSON"""
+
+    month_fields: FrozenSet[str] = frozenset()
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = mark_months(unpackb(await self.body()), self.month_fields)
+        return self._json
+
+
+class MsgPackRoute(APIRoute):
+    """
+    Route accepting MessagePack request bodies wherever it accepts JSON
+
+    The request is handed on labelled as JSON, with json() decoding the
+    MessagePack body; a body that fails to decode gets FastAPI's usual 400.
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        months = month_fields(self.body_field.type_) if self.body_field is not None else frozenset()
+
+        async def route_handler(request: Request) -> Response:
+            if is_msgpack(request.headers.get("content-type")):
+                if msgpack is None:
+                    raise HTTPException(status_code=415, detail="MessagePack bodies need the msgpack package")
+                headers = [(name, value) for name, value in request.scope["headers"] if name != b"content-type"]
+                headers.append((b"content-type", b"application/json"))
+                request = _MsgPackRequest({**request.scope, "headers": headers}, request.receive)
+                request.month_fields = months
+            return await handler(request)
+
+        return route_handler
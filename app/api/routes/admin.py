@@ -0,0 +1,41 @@
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import FileResponse
+from typing import Optional
+import hmac
+import os
+
+from app.middleware.profiling import profile_store
+from app.utils.logger import get_logger
+
+router = APIRouter()
+logger = get_logger(__name__)
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """
+    Allow the request only with a valid X-Admin-Token header
+    """
+    if not ADMIN_TOKEN or not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+@router.get("/profiles", dependencies=[Depends(require_admin)])
+def list_profiles():
+    """
+    Список сохраненных профилей запросов
+    """
+    return profile_store.list()
+
+
+@router.get("/profiles/{name}", dependencies=[Depends(require_admin)])
+def download_profile(name: str):
+    """
+    Скачивание профиля запроса
+    """
+    path = profile_store.path(name)
+    if path is None:
+        logger.warning(f"Profile {name} not found")
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/json", filename=name)
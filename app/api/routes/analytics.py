@@ -0,0 +1,117 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.exceptions import RequestValidationError
+from pydantic import Field, ValidationError
+from typing import Annotated, List, Optional
+import math
+
+from app.analytics import sketch_store
+from app.schemas.analytics import (
+    EstimateRequest,
+    CountEstimate,
+    MonthlyDistinctUsers,
+    DistinctUsersResponse,
+    QuantileEstimate,
+    MonthlySpendQuantiles,
+    SpendQuantilesResponse
+)
+from app.utils.logger import get_logger
+from app.utils.periods import format_month_index
+
+router = APIRouter()
+logger = get_logger(__name__)
+
+Quantile = Annotated[float, Field(ge=0, le=1)]
+
+
+def estimate_request_params(
+    start_period: str = Query(..., description="Start period in MM-YYYY format"),
+    end_period: str = Query(..., description="End period in MM-YYYY format"),
+    service_name: Optional[str] = Query(None, description="Filter by service name")
+) -> EstimateRequest:
+    """Read an estimate request from query parameters"""
+    try:
+        return EstimateRequest(start_period=start_period, end_period=end_period, service_name=service_name)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors(include_url=False))
+
+
+def check_window(request: EstimateRequest):
+    """Reject requests the sketches cannot answer"""
+    if not sketch_store.ready:
+        raise HTTPException(status_code=503, detail="Sketches are not built yet", headers={"Retry-After": "30"})
+    first, last = sketch_store.window
+    if request.start_period < first or request.end_period > last:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Estimates cover {format_month_index(first)} to {format_month_index(last)}"
+        )
+
+
+def count_estimate(sketch) -> CountEstimate:
+    """Estimate with bounds two standard errors away"""
+    estimate = sketch.estimate()
+    error = 2 * sketch.relative_error
+    return CountEstimate(
+        estimate=round(estimate),
+        lower=max(0, math.floor(estimate * (1 - error))),
+        upper=math.ceil(estimate * (1 + error))
+    )
+
+
+def quantile_estimates(sketch, qs: List[float]) -> List[QuantileEstimate]:
+    """Quantile values with the range the true quantile lies in"""
+    accuracy = sketch.relative_accuracy
+    return [
+        QuantileEstimate(q=q, value=value, lower=value / (1 + accuracy), upper=value / (1 - accuracy))
+        for q, value in zip(qs, sketch.quantiles(qs))
+        if value is not None
+    ]
+
+
+@router.get("/distinct-users", response_model=DistinctUsersResponse)
+def distinct_users(request: EstimateRequest = Depends(estimate_request_params)):
+    """
+    Оценка числа уникальных подписчиков за период и по месяцам (HyperLogLog)
+    """
+    check_window(request)
+    total, months = sketch_store.distinct_users(request.start_period, request.end_period, request.service_name)
+
+    logger.info(f"Estimated distinct users for period {format_month_index(request.start_period)} to {format_month_index(request.end_period)}")
+
+    return DistinctUsersResponse(
+        period_start=request.start_period,
+        period_end=request.end_period,
+        users=count_estimate(total),
+        months=[MonthlyDistinctUsers(month=month, users=count_estimate(sketch)) for month, sketch in months],
+        relative_error=total.relative_error,
+        stale=sketch_store.stale,
+        built_at=sketch_store.built_at
+    )
+
+
+@router.get("/spend-quantiles", response_model=SpendQuantilesResponse)
+def spend_quantiles(
+    request: EstimateRequest = Depends(estimate_request_params),
+    q: List[Quantile] = Query([0.5, 0.9], description="Quantiles to estimate")
+):
+    """
+    Оценка квантилей месячных трат пользователя на сервис (DDSketch)
+    """
+    check_window(request)
+    total, months = sketch_store.spend(request.start_period, request.end_period, request.service_name)
+
+    logger.info(f"Estimated spend quantiles {q} for period {format_month_index(request.start_period)} to {format_month_index(request.end_period)}")
+
+    return SpendQuantilesResponse(
+        period_start=request.start_period,
+        period_end=request.end_period,
+        samples=total.count,
+        quantiles=quantile_estimates(total, q),
+        months=[
+            MonthlySpendQuantiles(month=month, samples=sketch.count, quantiles=quantile_estimates(sketch, q))
+            for month, sketch in months
+        ],
+        relative_accuracy=total.relative_accuracy,
+        stale=sketch_store.stale,
+        built_at=sketch_store.built_at
+    )
@@ -0,0 +1,68 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+from typing import Any, Dict
+
+from app.jobs import TooManyJobs, report_manager
+from app.schemas.report import ReportCreate, ReportJobResponse
+from app.utils.logger import get_logger
+
+router = APIRouter()
+logger = get_logger(__name__)
+
+
+def to_job_response(job: Dict[str, Any]) -> ReportJobResponse:
+    """Build a response from job metadata, linking the result once it is ready"""
+    result_url = f"/reports/{job['id']}/result" if job["status"] == "completed" else None
+    return ReportJobResponse(result_url=result_url, **job)
+
+
+@router.post("/", response_model=ReportJobResponse, status_code=202)
+def create_report(report: ReportCreate):
+    """
+    Постановка отчета в очередь на фоновое выполнение
+    """
+    params = report.model_dump(mode="json", exclude={"kind"})
+    logger.info(f"Submitting {report.kind} report for period {params['start_period']} to {params['end_period']}")
+    
+    try:
+        job = report_manager.submit(report.kind, params)
+    except TooManyJobs:
+        logger.warning("Report queue is full")
+        raise HTTPException(status_code=503, detail="Too many report jobs, retry later", headers={"Retry-After": "30"})
+    
+    return to_job_response(job)
+
+
+@router.get("/{job_id}", response_model=ReportJobResponse)
+def get_report(job_id: str):
+    """
+    Статус фонового отчета
+    """
+    job = report_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Report not found")
+    return to_job_response(job)
+
+
+@router.get("/{job_id}/result")
+def download_report(job_id: str):
+    """
+    Скачивание готового отчета
+    """
+    path = report_manager.result_path(job_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Report result not found")
+    return FileResponse(path, media_type="application/json", filename=f"report-{job_id}.json")
+
+
+@router.delete("/{job_id}", response_model=ReportJobResponse, status_code=202)
+def cancel_report(job_id: str):
+    """
+    Отмена фонового отчета
+    """
+    job = report_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Report not found")
+    
+    logger.info(f"Cancellation requested for report {job_id}")
+    return to_job_response(job)
@@ -1,260 +1,706 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from dotenv import load_dotenv
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
-from typing import List, Optional
-from datetime import datetime
+from typing import List, Literal, Optional
+from datetime import date
+from itertools import chain
+import heapq
 import uuid
 import logging
+import os
+import time
 
-from app.database import get_db
-from app.models.subscription import Subscription
+from app.analytics import analytics_engine, sketch_store
+from app.api.negotiation import MsgPackRoute, negotiated, prefers_msgpack
+from app.database.batching import GROUP_COMMIT_ENABLED, group_committer
+from app.database.sharding import ShardSessions, get_shards, new_subscription_id
+from app.jobs import archiver
+from app.repositories import subscription_repository
 from app.schemas.subscription import (
     SubscriptionCreate,
     SubscriptionUpdate,
     SubscriptionResponse,
     SubscriptionCostRequest,
-    SubscriptionCostResponse
+    SubscriptionCostResponse,
+    MonthlyCost,
+    SubscriptionMonthlyCostResponse,
+    SubscriptionChangesResponse,
+    SubscriptionPeriodFilter,
+    SubscriptionBulkFilter,
+    SubscriptionBulkResponse,
+    SubscriptionBatchGetRequest,
+    SubscriptionBatchGetResponse
 )
+from app.utils.deadline import DeadlineExceeded
 from app.utils.logger import get_logger
+from app.utils.periods import format_month_index, month_index, month_index_to_date
+from app.utils.singleflight import SingleFlight, flight_key
 
-router = APIRouter()
+# Load environment variables
+load_dotenv()
+
+# Rows changed per transaction by bulk update and delete
+BULK_WRITE_CHUNK_ROWS = int(os.getenv("BULK_WRITE_CHUNK_ROWS", "1000"))
+
+# List totals: broad filters estimated above this many rows are not counted exactly
+TOTAL_COUNT_EXACT_MAX_ROWS = int(os.getenv("TOTAL_COUNT_EXACT_MAX_ROWS", "10000"))
+# An exact count may take as long as the page fetch did, but at least this long
+TOTAL_COUNT_MIN_BUDGET_MS = float(os.getenv("TOTAL_COUNT_MIN_BUDGET_MS", "10"))
+
+# Every route also takes MessagePack request bodies
+router = APIRouter(route_class=MsgPackRoute)
 logger = get_logger(__name__)
 
+# Identical concurrent reads share one query
+list_flight = SingleFlight("list_subscriptions")
+cost_flight = SingleFlight("subscription_cost")
+monthly_cost_flight = SingleFlight("subscription_monthly_cost")
+
+# Whitelisted list sorts: each column ascending, or descending with a "-" prefix
+ListSort = Literal[tuple(chain.from_iterable((column, f"-{column}") for column in subscription_repository.LIST_SORTS))]
+
+
+def parse_cursor(cursor: Optional[str], shard_count: int = 1) -> List[tuple]:
+    """
+    Parse a change feed cursor, empty for the beginning
+
+    A cursor holds one "<txid>.<seq>" position per shard, joined with "_".
+    """
+    if not cursor:
+        return [(0, 0)] * shard_count
+    try:
+        positions = [tuple(map(int, part.split('.'))) for part in cursor.split('_')]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if len(positions) != shard_count or any(len(position) != 2 for position in positions):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return positions
+
+
+def format_cursor(positions: List[tuple]) -> str:
+    """Render a change feed cursor"""
+    return '_'.join(f"{txid}.{seq}" for txid, seq in positions)
+
+
+def format_etag(version: int) -> str:
+    """ETag of a subscription: its row version as a strong entity tag"""
+    return f'"{version}"'
 
-def mm_yyyy_to_date(date_str: str) -> datetime:
-    """Convert MM-YYYY string to datetime object"""
-    month, year = map(int, date_str.split('-'))
-    return datetime(year, month, 1)
 
+def parse_if_match(if_match: Optional[str]) -> Optional[List[int]]:
+    """
+    Versions an If-Match header accepts, or None for any (no header or "*")
+
+    If-Match compares strongly, so weak tags (W/"...") never match, and
+    neither do tags that are not versions: a header naming only such tags
+    gives an empty list, which no row matches.
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+    versions = []
+    for tag in if_match.split(","):
+        tag = tag.strip()
+        if len(tag) > 2 and tag[0] == tag[-1] == '"' and tag[1:-1].isdigit():
+            versions.append(int(tag[1:-1]))
+    return versions
 
-def date_to_mm_yyyy(date_obj: datetime) -> str:
-    """Convert datetime object to MM-YYYY string"""
-    return f"{date_obj.month:02d}-{date_obj.year}"
+
+def precondition_failed(conflict: subscription_repository.VersionConflict) -> HTTPException:
+    """412 for a write whose If-Match no longer names the current version"""
+    logger.warning(f"Subscription {conflict.subscription_id} changed, now at version {conflict.version}")
+    return HTTPException(
+        status_code=412,
+        detail="Subscription was modified",
+        headers={"ETag": format_etag(conflict.version)}
+    )
+
+
+def to_response(row) -> SubscriptionResponse:
+    """Build a response from a subscriptions row (dates are rendered as MM-YYYY)"""
+    return SubscriptionResponse.model_validate(row)
+
+
+def cost_request_params(
+    start_period: str = Query(..., description="Start period in MM-YYYY format"),
+    end_period: str = Query(..., description="End period in MM-YYYY format"),
+    user_id: Optional[uuid.UUID] = Query(None, description="Filter by user ID"),
+    service_name: Optional[str] = Query(None, description="Filter by service name")
+) -> SubscriptionCostRequest:
+    """Read a cost request from query parameters"""
+    try:
+        return SubscriptionCostRequest(
+            start_period=start_period,
+            end_period=end_period,
+            user_id=user_id,
+            service_name=service_name
+        )
+    except ValidationError as e:
+        raise RequestValidationError(e.errors(include_url=False))
+
+
+def period_filter_params(
+    active_from: Optional[str] = Query(None, description="Only subscriptions active at or after MM-YYYY"),
+    active_to: Optional[str] = Query(None, description="Only subscriptions active at or before MM-YYYY"),
+    active_at: Optional[str] = Query(None, description="Only subscriptions active in the month MM-YYYY")
+) -> SubscriptionPeriodFilter:
+    """Read list period filters from query parameters"""
+    try:
+        return SubscriptionPeriodFilter(active_from=active_from, active_to=active_to, active_at=active_at)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors(include_url=False))
+
+
+def bulk_filter_params(
+    user_id: Optional[uuid.UUID] = Query(None, description="Filter by user ID"),
+    service_name: Optional[str] = Query(None, description="Filter by service name"),
+    active_from: Optional[str] = Query(None, description="Only subscriptions active at or after MM-YYYY"),
+    active_to: Optional[str] = Query(None, description="Only subscriptions active at or before MM-YYYY")
+) -> SubscriptionBulkFilter:
+    """Read bulk change filters from query parameters"""
+    try:
+        return SubscriptionBulkFilter(
+            user_id=user_id,
+            service_name=service_name,
+            active_from=active_from,
+            active_to=active_to
+        )
+    except ValidationError as e:
+        raise RequestValidationError(e.errors(include_url=False))
+
+
+def bulk_filter_args(filters: SubscriptionBulkFilter) -> dict:
+    """Repository keyword arguments of bulk change filters"""
+    return dict(
+        user_id=filters.user_id,
+        service_name=filters.service_name,
+        active_from=month_index_to_date(filters.active_from) if filters.active_from is not None else None,
+        active_to=month_index_to_date(filters.active_to) if filters.active_to is not None else None
+    )
+
+
+def cost_flight_key(request: SubscriptionCostRequest) -> tuple:
+    """Single-flight key of a cost request (service names match case-insensitively)"""
+    return flight_key(
+        request.start_period,
+        request.end_period,
+        user_id=request.user_id,
+        service_name=request.service_name.lower() if request.service_name else None
+    )
 
 
 @router.post("/", response_model=SubscriptionResponse, status_code=201)
 def create_subscription(
+    response: Response,
     subscription: SubscriptionCreate,
-    db: Session = Depends(get_db)
+    as_msgpack: bool = Depends(prefers_msgpack),
+    shards: ShardSessions = Depends(get_shards)
 ):
     """
     Создание новой подписки
     """
     logger.info(f"Creating subscription for user {subscription.user_id}")
     
+    db = shards.for_user(subscription.user_id)
     try:
-        # Convert dates from MM-YYYY format
-        start_date = mm_yyyy_to_date(subscription.start_date)
-        end_date = mm_yyyy_to_date(subscription.end_date) if subscription.end_date else None
-        
-        # Create subscription object
-        db_subscription = Subscription(
+        # Periods are already parsed into month indexes; the id routes to the user's shard
+        values = dict(
+            id=new_subscription_id(subscription.user_id),
             service_name=subscription.service_name,
             price=subscription.price,
             user_id=subscription.user_id,
-            start_date=start_date.date(),
-            end_date=end_date.date() if end_date else None
+            start_date=month_index_to_date(subscription.start_date),
+            end_date=month_index_to_date(subscription.end_date) if subscription.end_date is not None else None
         )
         
-        # Save to database
-        db.add(db_subscription)
-        db.commit()
-        db.refresh(db_subscription)
-        
-        logger.info(f"Subscription created successfully: {db_subscription.id}")
+        if GROUP_COMMIT_ENABLED and not shards.router.sharded:
+            # Queue the row and wait for the shared multi-row INSERT to commit
+            row = group_committer.submit(values)
+        else:
+            row = subscription_repository.create(db, values)
         
-        # Convert dates back to MM-YYYY format for response
-        response = SubscriptionResponse.from_orm(db_subscription)
-        response.start_date = subscription.start_date
-        response.end_date = subscription.end_date
+        logger.info(f"Subscription created successfully: {row.id}")
+        # Cost answers must not come from the snapshot until it has caught up
+        analytics_engine.mark_stale()
+        sketch_store.record(row)
         
-        return response
+        response.headers["ETag"] = format_etag(row.version)
+        return negotiated(to_response(row), as_msgpack, response, status_code=201)
         
+    except DeadlineExceeded:
+        db.rollback()
+        raise
     except Exception as e:
         logger.error(f"Error creating subscription: {str(e)}")
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to create subscription: {str(e)}")
 
 
+@router.get("/changes", response_model=SubscriptionChangesResponse)
+def list_subscription_changes(
+    since: Optional[str] = Query(
+        None, description="Cursor returned by the previous call; omit to start from the beginning. Expired cursors get 410"
+    ),
+    limit: int = Query(500, ge=1, le=5000, description="Maximum number of changes to read"),
+    shards: ShardSessions = Depends(get_shards)
+):
+    """
+    Изменения подписок после указанного курсора (для синхронизации)
+    """
+    logger.info(f"Listing subscription changes since {since}")
+    
+    positions = parse_cursor(since, shards.router.count)
+    # Each shard keeps its own feed; the limit is split between them
+    shard_limit = -(-limit // shards.router.count)
+    try:
+        pages = shards.router.map(
+            lambda item: subscription_repository.changes_since(item[0], item[1], shard_limit),
+            list(zip(shards.all(), positions))
+        )
+    except subscription_repository.CursorExpired:
+        logger.warning(f"Change feed cursor {since} has expired")
+        raise HTTPException(
+            status_code=410,
+            detail="Cursor expired: changes before it were compacted, resync from a full list or from the beginning"
+        )
+    
+    upserts = [row for page in pages for row in page[0]]
+    deletes = [subscription_id for page in pages for subscription_id in page[1]]
+    
+    logger.info(f"Retrieved {len(upserts)} upserts and {len(deletes)} deletes")
+    return SubscriptionChangesResponse(
+        upserts=[to_response(row) for row in upserts],
+        deletes=deletes,
+        next_cursor=format_cursor([page[2] for page in pages]),
+        has_more=any(page[3] for page in pages)
+    )
+
+
+@router.patch("/bulk", response_model=SubscriptionBulkResponse)
+def bulk_update_subscriptions(
+    subscription_update: SubscriptionUpdate,
+    filters: SubscriptionBulkFilter = Depends(bulk_filter_params),
+    dry_run: bool = Query(False, description="Only count the subscriptions that would change"),
+    shards: ShardSessions = Depends(get_shards)
+):
+    """
+    Массовое обновление подписок по фильтру
+    """
+    logger.info(f"Bulk updating subscriptions matching {filters} (dry_run={dry_run})")
+    
+    update_data = {
+        field: getattr(subscription_update, field)
+        for field in subscription_update.model_fields_set
+    }
+    if not update_data:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    for field in ('start_date', 'end_date'):
+        if update_data.get(field) is not None:
+            update_data[field] = month_index_to_date(update_data[field])
+    args = bulk_filter_args(filters)
+    
+    def shard_update(db: Session) -> int:
+        if dry_run:
+            return subscription_repository.count_matching(db, **args)
+        return subscription_repository.bulk_update(db, update_data, BULK_WRITE_CHUNK_ROWS, **args)
+    
+    try:
+        affected = sum(shards.scatter(shard_update, filters.user_id))
+    except DeadlineExceeded:
+        shards.rollback()
+        raise
+    except Exception as e:
+        logger.error(f"Error bulk updating subscriptions: {str(e)}")
+        shards.rollback()
+        raise HTTPException(status_code=500, detail=f"Failed to update subscriptions: {str(e)}")
+    
+    if affected and not dry_run:
+        # Cost answers must not come from the snapshot until it has caught up
+        analytics_engine.mark_stale()
+        sketch_store.mark_stale()
+    
+    logger.info(f"Bulk update {'would change' if dry_run else 'changed'} {affected} subscriptions")
+    return SubscriptionBulkResponse(affected=affected, dry_run=dry_run)
+
+
+@router.delete("/bulk", response_model=SubscriptionBulkResponse)
+def bulk_delete_subscriptions(
+    filters: SubscriptionBulkFilter = Depends(bulk_filter_params),
+    dry_run: bool = Query(False, description="Only count the subscriptions that would be deleted"),
+    shards: ShardSessions = Depends(get_shards)
+):
+    """
+    Массовое удаление подписок по фильтру
+    """
+    logger.info(f"Bulk deleting subscriptions matching {filters} (dry_run={dry_run})")
+    
+    args = bulk_filter_args(filters)
+    
+    def shard_delete(db: Session) -> int:
+        if dry_run:
+            return subscription_repository.count_matching(db, **args)
+        return subscription_repository.bulk_delete(db, BULK_WRITE_CHUNK_ROWS, **args)
+    
+    try:
+        affected = sum(shards.scatter(shard_delete, filters.user_id))
+    except DeadlineExceeded:
+        shards.rollback()
+        raise
+    except Exception as e:
+        logger.error(f"Error bulk deleting subscriptions: {str(e)}")
+        shards.rollback()
+        raise HTTPException(status_code=500, detail=f"Failed to delete subscriptions: {str(e)}")
+    
+    if affected and not dry_run:
+        analytics_engine.mark_stale()
+        sketch_store.mark_stale()
+    
+    logger.info(f"Bulk delete {'would remove' if dry_run else 'removed'} {affected} subscriptions")
+    return SubscriptionBulkResponse(affected=affected, dry_run=dry_run)
+
+
+@router.post("/batch-get", response_model=SubscriptionBatchGetResponse)
+def batch_get_subscriptions(
+    response: Response,
+    request: SubscriptionBatchGetRequest,
+    as_msgpack: bool = Depends(prefers_msgpack),
+    shards: ShardSessions = Depends(get_shards)
+):
+    """
+    Получение подписок по списку ID одним запросом (в порядке запроса, null для ненайденных)
+    """
+    subscription_ids = list(dict.fromkeys(request.ids))
+    logger.info(f"Getting {len(subscription_ids)} subscriptions by id")
+    
+    rows = shards.locate_many(subscription_ids, subscription_repository.get_many)
+    found = {row.id: to_response(row) for row in rows}
+    not_found = [subscription_id for subscription_id in subscription_ids if subscription_id not in found]
+    
+    logger.info(f"Batch lookup found {len(found)} subscriptions, {len(not_found)} not found")
+    return negotiated(
+        SubscriptionBatchGetResponse(
+            subscriptions=[found.get(subscription_id) for subscription_id in request.ids],
+            not_found=not_found
+        ),
+        as_msgpack,
+        response
+    )
+
+
 @router.get("/{subscription_id}", response_model=SubscriptionResponse)
 def get_subscription(
+    response: Response,
     subscription_id: uuid.UUID,
-    db: Session = Depends(get_db)
+    as_msgpack: bool = Depends(prefers_msgpack),
+    shards: ShardSessions = Depends(get_shards)
 ):
     """
     Получение подписки по ID
     """
     logger.info(f"Getting subscription {subscription_id}")
     
-    subscription = db.query(Subscription).filter(Subscription.id == subscription_id).first()
+    row = shards.locate(subscription_id, lambda db: subscription_repository.get(db, subscription_id))
     
-    if not subscription:
+    if not row:
         logger.warning(f"Subscription {subscription_id} not found")
         raise HTTPException(status_code=404, detail="Subscription not found")
     
-    # Convert dates to MM-YYYY format for response
-    response = SubscriptionResponse.from_orm(subscription)
-    response.start_date = date_to_mm_yyyy(datetime.combine(subscription.start_date, datetime.min.time()))
-    if subscription.end_date:
-        response.end_date = date_to_mm_yyyy(datetime.combine(subscription.end_date, datetime.min.time()))
-    
     logger.info(f"Subscription {subscription_id} retrieved successfully")
-    return response
+    response.headers["ETag"] = format_etag(row.version)
+    return negotiated(to_response(row), as_msgpack, response)
 
 
 @router.put("/{subscription_id}", response_model=SubscriptionResponse)
 def update_subscription(
+    response: Response,
     subscription_id: uuid.UUID,
     subscription_update: SubscriptionUpdate,
-    db: Session = Depends(get_db)
+    if_match: Optional[str] = Header(None),
+    as_msgpack: bool = Depends(prefers_msgpack),
+    shards: ShardSessions = Depends(get_shards)
 ):
     """
-    Обновление подписки
+    Обновление подписки (с If-Match - только если она не менялась, иначе 412)
     """
     logger.info(f"Updating subscription {subscription_id}")
     
-    db_subscription = db.query(Subscription).filter(Subscription.id == subscription_id).first()
-    
-    if not db_subscription:
-        logger.warning(f"Subscription {subscription_id} not found")
-        raise HTTPException(status_code=404, detail="Subscription not found")
+    # Convert provided month indexes to dates
+    update_data = {
+        field: getattr(subscription_update, field)
+        for field in subscription_update.model_fields_set
+    }
+    for field in ('start_date', 'end_date'):
+        if update_data.get(field) is not None:
+            update_data[field] = month_index_to_date(update_data[field])
     
+    versions = parse_if_match(if_match)
     try:
-        # Update fields if provided
-        update_data = subscription_update.dict(exclude_unset=True)
-        
-        for field, value in update_data.items():
-            if field == 'start_date' and value:
-                setattr(db_subscription, field, mm_yyyy_to_date(value).date())
-            elif field == 'end_date' and value:
-                setattr(db_subscription, field, mm_yyyy_to_date(value).date())
-            else:
-                setattr(db_subscription, field, value)
-        
-        db_subscription.updated_at = datetime.utcnow()
-        
-        db.commit()
-        db.refresh(db_subscription)
-        
-        logger.info(f"Subscription {subscription_id} updated successfully")
-        
-        # Convert dates back to MM-YYYY format for response
-        response = SubscriptionResponse.from_orm(db_subscription)
-        response.start_date = date_to_mm_yyyy(datetime.combine(db_subscription.start_date, datetime.min.time()))
-        if db_subscription.end_date:
-            response.end_date = date_to_mm_yyyy(datetime.combine(db_subscription.end_date, datetime.min.time()))
-        
-        return response
-        
+        row = shards.locate(
+            subscription_id,
+            lambda db: subscription_repository.update_fields(db, subscription_id, update_data, versions)
+        )
+    except subscription_repository.VersionConflict as e:
+        shards.rollback()
+        raise precondition_failed(e)
+    except DeadlineExceeded:
+        shards.rollback()
+        raise
     except Exception as e:
         logger.error(f"Error updating subscription {subscription_id}: {str(e)}")
-        db.rollback()
+        shards.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to update subscription: {str(e)}")
+    
+    if not row:
+        logger.warning(f"Subscription {subscription_id} not found")
+        raise HTTPException(status_code=404, detail="Subscription not found")
+    
+    logger.info(f"Subscription {subscription_id} updated successfully")
+    analytics_engine.mark_stale()
+    # The new values go in now; the old ones stay until the next full rebuild
+    sketch_store.record(row)
+    sketch_store.mark_stale()
+    response.headers["ETag"] = format_etag(row.version)
+    return negotiated(to_response(row), as_msgpack, response)
 
 
 @router.delete("/{subscription_id}", status_code=204)
 def delete_subscription(
     subscription_id: uuid.UUID,
-    db: Session = Depends(get_db)
+    if_match: Optional[str] = Header(None),
+    shards: ShardSessions = Depends(get_shards)
 ):
     """
-    Удаление подписки
+    Удаление подписки (с If-Match - только если она не менялась, иначе 412)
     """
     logger.info(f"Deleting subscription {subscription_id}")
     
-    subscription = db.query(Subscription).filter(Subscription.id == subscription_id).first()
-    
-    if not subscription:
-        logger.warning(f"Subscription {subscription_id} not found")
-        raise HTTPException(status_code=404, detail="Subscription not found")
-    
+    versions = parse_if_match(if_match)
     try:
-        db.delete(subscription)
-        db.commit()
-        logger.info(f"Subscription {subscription_id} deleted successfully")
-        return None
+        deleted = shards.locate(
+            subscription_id, lambda db: subscription_repository.delete_by_id(db, subscription_id, versions)
+        )
+    except subscription_repository.VersionConflict as e:
+        shards.rollback()
+        raise precondition_failed(e)
+    except DeadlineExceeded:
+        shards.rollback()
+        raise
     except Exception as e:
         logger.error(f"Error deleting subscription {subscription_id}: {str(e)}")
-        db.rollback()
+        shards.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to delete subscription: {str(e)}")
+    
+    if not deleted:
+        logger.warning(f"Subscription {subscription_id} not found")
+        raise HTTPException(status_code=404, detail="Subscription not found")
+    
+    logger.info(f"Subscription {subscription_id} deleted successfully")
+    analytics_engine.mark_stale()
+    sketch_store.mark_stale()
+    return None
 
 
 @router.get("/", response_model=List[SubscriptionResponse])
 def list_subscriptions(
+    response: Response,
     skip: int = Query(0, ge=0, description="Number of records to skip"),
     limit: int = Query(100, ge=1, le=1000, description="Maximum number of records to return"),
     user_id: Optional[uuid.UUID] = Query(None, description="Filter by user ID"),
     service_name: Optional[str] = Query(None, description="Filter by service name"),
-    db: Session = Depends(get_db)
+    period: SubscriptionPeriodFilter = Depends(period_filter_params),
+    sort: ListSort = Query("created_at", description="Sort column, prefixed with '-' for descending order"),
+    include_archived: bool = Query(False, description="Also list archived (long expired) subscriptions"),
+    with_total: bool = Query(False, description="Report the total number of matches in X-Total-Count"),
+    as_msgpack: bool = Depends(prefers_msgpack),
+    shards: ShardSessions = Depends(get_shards)
 ):
     """
-    Получение списка подписок с фильтрацией
+    Получение списка подписок с фильтрацией и сортировкой
+    
+    С with_total=true заголовок X-Total-Count содержит общее число подходящих
+    подписок, а X-Total-Count-Type - exact (точное) или estimate (оценка).
     """
-    logger.info(f"Listing subscriptions with filters: user_id={user_id}, service_name={service_name}")
+    logger.info(f"Listing subscriptions with filters: user_id={user_id}, service_name={service_name}, {period}, sort={sort}")
     
-    query = db.query(Subscription)
+    first_month, last_month = period.bounds
+    filters = dict(
+        service_name=service_name,
+        include_archive=include_archived,
+        active_from=month_index_to_date(first_month) if first_month is not None else None,
+        active_to=month_index_to_date(last_month) if last_month is not None else None,
+        sort=sort
+    )
     
-    if user_id:
-        query = query.filter(Subscription.user_id == user_id)
+    def shard_filters(db: Session) -> dict:
+        if include_archived or (first_month is None and last_month is None):
+            return filters
+        # A period reaching back past the archive's boundary lists archived rows too
+        period_start = month_index_to_date(first_month) if first_month is not None else date.min
+        return {**filters, "include_archive": archiver.includes_period(db, period_start)}
     
-    if service_name:
-        query = query.filter(Subscription.service_name.ilike(f"%{service_name}%"))
+    def fetch_rows() -> list:
+        if user_id is None and shards.router.sharded:
+            # Every shard returns its first skip + limit rows in order and the
+            # page is cut from their merge
+            pages = shards.scatter(
+                lambda db: subscription_repository.list_filtered(db, 0, skip + limit, None, **shard_filters(db))
+            )
+            merged = heapq.merge(
+                *pages, key=subscription_repository.list_sort_key(sort), reverse=sort.startswith("-")
+            )
+            return list(merged)[skip:skip + limit]
+        db = shards.for_user(user_id) if user_id is not None else shards[0]
+        return subscription_repository.list_filtered(db, skip, limit, user_id, **shard_filters(db))
     
-    subscriptions = query.offset(skip).limit(limit).all()
+    started = time.perf_counter()
+    rows = list_flight.do(
+        flight_key(
+            skip,
+            limit,
+            user_id=user_id,
+            service_name=service_name.lower() if service_name else None,
+            include_archived=include_archived,
+            active_from=first_month,
+            active_to=last_month,
+            sort=sort
+        ),
+        fetch_rows
+    )
+    response_list = [to_response(row) for row in rows]
     
-    # Convert dates to MM-YYYY format for response
-    response_list = []
-    for subscription in subscriptions:
-        response = SubscriptionResponse.from_orm(subscription)
-        response.start_date = date_to_mm_yyyy(datetime.combine(subscription.start_date, datetime.min.time()))
-        if subscription.end_date:
-            response.end_date = date_to_mm_yyyy(datetime.combine(subscription.end_date, datetime.min.time()))
-        response_list.append(response)
+    if with_total:
+        # Counting gets at most the time the page took
+        budget_ms = max(TOTAL_COUNT_MIN_BUDGET_MS, (time.perf_counter() - started) * 1000)
+        counts = shards.scatter(
+            lambda db: subscription_repository.count_filtered(
+                db,
+                user_id,
+                exact_max_rows=TOTAL_COUNT_EXACT_MAX_ROWS,
+                timeout_ms=budget_ms,
+                **{key: value for key, value in shard_filters(db).items() if key != "sort"}
+            ),
+            user_id
+        )
+        response.headers["X-Total-Count"] = str(sum(count for count, _ in counts))
+        response.headers["X-Total-Count-Type"] = "exact" if all(exact for _, exact in counts) else "estimate"
     
     logger.info(f"Retrieved {len(response_list)} subscriptions")
-    return response_list
+    return negotiated(response_list, as_msgpack, response)
 
 
 @router.get("/cost/", response_model=SubscriptionCostResponse)
 def calculate_subscription_cost(
-    request: SubscriptionCostRequest,
-    db: Session = Depends(get_db)
+    response: Response,
+    request: SubscriptionCostRequest = Depends(cost_request_params),
+    as_msgpack: bool = Depends(prefers_msgpack),
+    shards: ShardSessions = Depends(get_shards)
 ):
     """
     Подсчет суммарной стоимости подписок за выбранный период
     """
-    logger.info(f"Calculating subscription cost for period {request.start_period} to {request.end_period}")
+    start_date = month_index_to_date(request.start_period)
+    end_date = month_index_to_date(request.end_period)
+    
+    logger.info(f"Calculating subscription cost for period {format_month_index(request.start_period)} to {format_month_index(request.end_period)}")
     
-    # Convert period dates
-    start_date = mm_yyyy_to_date(request.start_period)
-    end_date = mm_yyyy_to_date(request.end_period)
+    def shard_cost(db: Session) -> tuple:
+        # The archive only matters for periods reaching back past its boundary
+        include_archive = archiver.includes_period(db, start_date)
+        
+        if analytics_engine.ready and not include_archive:
+            # Answer from the in-memory columnar snapshot (only kept when not sharded)
+            return analytics_engine.total_cost(
+                request.start_period,
+                request.end_period,
+                user_id=request.user_id,
+                service_name=request.service_name
+            )
+        # Sum prices of subscriptions overlapping the period in the database
+        return subscription_repository.total_cost(
+            db,
+            start_date,
+            end_date,
+            user_id=request.user_id,
+            service_name=request.service_name,
+            include_archive=include_archive
+        )
     
-    # Build query
-    query = db.query(Subscription)
+    def total() -> tuple:
+        # One shard for a user, otherwise all shards concurrently
+        partials = shards.scatter(shard_cost, request.user_id)
+        return sum(cost for cost, _ in partials), sum(shard_count for _, shard_count in partials)
     
-    # Apply filters
-    if request.user_id:
-        query = query.filter(Subscription.user_id == request.user_id)
+    total_cost, count = cost_flight.do(cost_flight_key(request), total)
     
-    if request.service_name:
-        query = query.filter(Subscription.service_name.ilike(f"%{request.service_name}%"))
+    logger.info(f"Calculated cost: {total_cost} rubles for {count} subscriptions")
     
-    # Filter by date range (subscription overlaps with period)
-    query = query.filter(
-        Subscription.start_date <= end_date.date()
-    ).filter(
-        (Subscription.end_date >= start_date.date()) | (Subscription.end_date.is_(None))
+    result = SubscriptionCostResponse(
+        total_cost=total_cost,
+        period_start=start_date,
+        period_end=end_date,
+        count=count
     )
+    return negotiated(result, as_msgpack, response)
+
+
+
+@router.get("/cost/monthly/", response_model=SubscriptionMonthlyCostResponse)
+def calculate_monthly_subscription_cost(
+    response: Response,
+    request: SubscriptionCostRequest = Depends(cost_request_params),
+    as_msgpack: bool = Depends(prefers_msgpack),
+    shards: ShardSessions = Depends(get_shards)
+):
+    """
+    Помесячная разбивка стоимости подписок за выбранный период
+    """
+    start_date = month_index_to_date(request.start_period)
+    end_date = month_index_to_date(request.end_period)
+    
+    logger.info(f"Calculating monthly subscription cost for period {format_month_index(request.start_period)} to {format_month_index(request.end_period)}")
     
-    subscriptions = query.all()
+    def shard_months(db: Session) -> list:
+        include_archive = archiver.includes_period(db, start_date)
+        
+        if analytics_engine.ready and not include_archive:
+            return analytics_engine.monthly_cost(
+                request.start_period,
+                request.end_period,
+                user_id=request.user_id,
+                service_name=request.service_name
+            )
+        return [
+            (month_index(month), total, count)
+            for month, total, count in subscription_repository.monthly_cost(
+                db,
+                start_date,
+                end_date,
+                user_id=request.user_id,
+                service_name=request.service_name,
+                include_archive=include_archive
+            )
+        ]
     
-    # Calculate total cost
-    total_cost = sum(sub.price for sub in subscriptions)
+    def breakdown() -> List[MonthlyCost]:
+        # Every shard reports every month of the period, in order
+        partials = shards.scatter(shard_months, request.user_id)
+        return [
+            MonthlyCost(
+                month=shard_rows[0][0],
+                total_cost=sum(total for _, total, _ in shard_rows),
+                count=sum(count for _, _, count in shard_rows)
+            )
+            for shard_rows in zip(*partials)
+        ]
     
-    logger.info(f"Calculated cost: {total_cost} rubles for {len(subscriptions)} subscriptions")
+    months = monthly_cost_flight.do(cost_flight_key(request), breakdown)
     
-    return SubscriptionCostResponse(
-        total_cost=total_cost,
-        period_start=request.start_period,
-        period_end=request.end_period,
-        count=len(subscriptions)
-    )
\ No newline at end of file
+    logger.info(f"Calculated monthly cost for {len(months)} months")
+    
+    result = SubscriptionMonthlyCostResponse(
+        period_start=start_date,
+        period_end=end_date,
+        months=months
+    )
+    return negotiated(result, as_msgpack, response)
@@ -0,0 +1,174 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.database.session import SessionLocal
+from app.repositories import subscription_repository
+from app.utils.logger import get_logger
+
+# Load environment variables
+load_dotenv()
+
+# Group commit configuration
+GROUP_COMMIT_ENABLED = os.getenv("GROUP_COMMIT_ENABLED", "False").lower() == "true"
+GROUP_COMMIT_MAX_DELAY_MS = float(os.getenv("GROUP_COMMIT_MAX_DELAY_MS", "5"))
+GROUP_COMMIT_MAX_ROWS = int(os.getenv("GROUP_COMMIT_MAX_ROWS", "200"))
+# Longest a caller waits for its batch before giving up with TimeoutError
+GROUP_COMMIT_RESULT_TIMEOUT_MS = float(os.getenv("GROUP_COMMIT_RESULT_TIMEOUT_MS", "30000"))
+
+logger = get_logger(__name__)
+
+
+class GroupCommitter:
+    """
+    Queue subscription inserts and flush them as one multi-row INSERT ... RETURNING
+
+    Callers block in submit() until the batch containing their row is committed.
+    A batch is flushed when it reaches max_rows or when the oldest queued row has
+    waited max_delay_ms, whichever comes first. If the multi-row statement fails,
+    the batch is replayed row by row so every caller gets its own result or error.
+    Any other failure (no session, a failed rollback) fails the whole batch; the
+    flusher thread keeps running, and is restarted by the next submit() if it died.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        max_delay_ms: float = GROUP_COMMIT_MAX_DELAY_MS,
+        max_rows: int = GROUP_COMMIT_MAX_ROWS,
+        result_timeout_ms: float = GROUP_COMMIT_RESULT_TIMEOUT_MS
+    ):
+        self.session_factory = session_factory
+        self.max_delay = max_delay_ms / 1000.0
+        self.max_rows = max(1, max_rows)
+        self.result_timeout = result_timeout_ms / 1000.0
+        self._queue: "queue.Queue[Optional[Tuple[Dict[str, Any], Future]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, values: Dict[str, Any]):
+        """
+        Queue a row for insertion and wait for its commit
+
+        Args:
+            values: Column values of the new subscription
+
+        Returns:
+            The inserted row as returned by INSERT ... RETURNING
+
+        Raises:
+            TimeoutError: The batch was not committed within the result timeout
+                (it may still be committed later)
+        """
+        self._ensure_started()
+
+        row = dict(values)
+        row.setdefault("id", uuid.uuid4())
+        now = datetime.utcnow()
+        row.setdefault("created_at", now)
+        row.setdefault("updated_at", now)
+
+        future: Future = Future()
+        self._queue.put((row, future))
+        return future.result(timeout=self.result_timeout)
+
+    def close(self):
+        """Flush queued rows and stop the flusher thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="subscription-group-commit", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._flush(batch)
+
+        # Drain whatever was queued while shutting down
+        leftover = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                leftover.append(item)
+        if leftover:
+            self._flush(leftover)
+
+    def _flush(self, batch: List[Tuple[Dict[str, Any], Future]]):
+        """Flush a batch; whatever fails, every caller in it gets a result or an error"""
+        try:
+            self._flush_batch(batch)
+        except Exception as e:
+            logger.error(f"Group commit of {len(batch)} rows failed: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def _flush_batch(self, batch: List[Tuple[Dict[str, Any], Future]]):
+        rows = [row for row, _ in batch]
+        db = self.session_factory()
+        try:
+            try:
+                result = {r.id: r for r in subscription_repository.create_many(db, rows)}
+                logger.info(f"Group commit flushed {len(batch)} subscriptions")
+            except Exception as e:
+                db.rollback()
+                logger.warning(f"Group commit of {len(batch)} rows failed, retrying row by row: {str(e)}")
+                self._flush_individually(db, batch)
+                return
+        finally:
+            db.close()
+
+        for row, future in batch:
+            future.set_result(result[row["id"]])
+
+    def _flush_individually(self, db, batch: List[Tuple[Dict[str, Any], Future]]):
+        for row, future in batch:
+            try:
+                future.set_result(subscription_repository.create(db, row))
+            except Exception as e:
+                db.rollback()
+                future.set_exception(e)
+
+
+# Shared committer used by the subscription routes when group commit is enabled
+group_committer = GroupCommitter()
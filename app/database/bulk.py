@@ -0,0 +1,358 @@
+"""
+Bulk dump and restore of the subscriptions table
+
+A dump is a directory with a manifest and one file per user id range:
+    manifest.json      format, columns, filters and row counts
+    part-0000.bin      PostgreSQL binary COPY data (format "binary")
+    part-0000.parquet  Parquet file, needs pyarrow (format "parquet")
+
+Parts are written in parallel, each over its own connection, and all of them
+read the same exported snapshot, so the dump is consistent as a whole.
+Restore loads the parts with parallel COPY workers. Secondary indexes are
+dropped before the load and rebuilt in parallel afterwards, and user triggers
+(the change feed) are disabled while loading unless asked otherwise.
+
+Rows carry service ids; the manifest maps them to service names. Restoring
+into a database whose services have other ids loads the parts through a
+temporary table and translates the ids on the way.
+"""
+import io
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app.database.session import engine
+from app.repositories import subscription_repository
+from app.utils.logger import get_logger
+
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover - optional dependency
+    pyarrow = None
+
+logger = get_logger(__name__)
+
+DUMP_FORMATS = ("binary", "parquet")
+MANIFEST = "manifest.json"
+TABLE = "subscriptions"
+PARQUET_BATCH_ROWS = 100_000
+
+
+def _part_name(index: int, fmt: str) -> str:
+    return f"part-{index:04d}.{'bin' if fmt == 'binary' else 'parquet'}"
+
+
+def _copy_source(cursor, query, dialect) -> str:
+    """Render a SQLAlchemy SELECT as literal SQL for COPY (...) TO STDOUT"""
+    compiled = query.compile(dialect=dialect)
+    params = {
+        name: str(value) if isinstance(value, uuid.UUID) else value
+        for name, value in compiled.params.items()
+    }
+    return cursor.mogrify(str(compiled), params).decode()
+
+
+def _parquet_schema():
+    return pyarrow.schema([
+        ("id", pyarrow.string()),
+        ("service_id", pyarrow.int32()),
+        ("price", pyarrow.int32()),
+        ("user_id", pyarrow.string()),
+        ("start_date", pyarrow.date32()),
+        ("end_date", pyarrow.date32()),
+        ("created_at", pyarrow.timestamp("us")),
+        ("updated_at", pyarrow.timestamp("us")),
+        ("version", pyarrow.int32()),
+    ])
+
+
+def _dump_part(bind, snapshot: str, query, path: str, fmt: str) -> int:
+    connection = bind.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+        cursor.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+        sql = _copy_source(cursor, query, bind.dialect)
+
+        if fmt == "binary":
+            with open(path, "wb") as f:
+                cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT binary)", f)
+            return cursor.rowcount
+
+        # Let the server render CSV and pyarrow parse it, then recompress as Parquet
+        csv_path = f"{path}.csv.tmp"
+        try:
+            with open(csv_path, "wb") as f:
+                cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv)", f)
+            rows = cursor.rowcount
+            schema = _parquet_schema()
+            reader = pyarrow.csv.open_csv(
+                csv_path,
+                read_options=pyarrow.csv.ReadOptions(column_names=schema.names, block_size=64 << 20),
+                # COPY quotes values with line breaks; keep them in their row
+                parse_options=pyarrow.csv.ParseOptions(newlines_in_values=True),
+                convert_options=pyarrow.csv.ConvertOptions(
+                    column_types=schema, strings_can_be_null=True, quoted_strings_can_be_null=False
+                )
+            )
+            with pyarrow.parquet.ParquetWriter(path, schema, compression="zstd") as writer:
+                for batch in reader:
+                    writer.write_batch(batch)
+        finally:
+            if os.path.exists(csv_path):
+                os.remove(csv_path)
+        return rows
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+def dump(
+    directory: str,
+    fmt: str = "binary",
+    parts: int = 4,
+    filters: Optional[Dict[str, Any]] = None,
+    bind=engine
+) -> Dict[str, Any]:
+    """
+    Dump subscriptions matching the filters into a directory
+
+    Args:
+        directory: Output directory (created if missing)
+        fmt: "binary" (COPY binary) or "parquet"
+        parts: Number of part files, written in parallel
+        filters: Keyword arguments of subscription_repository.export_query()
+        bind: Engine to read from
+
+    Returns:
+        The manifest written next to the parts
+    """
+    if fmt not in DUMP_FORMATS:
+        raise ValueError(f"Unknown dump format: {fmt}")
+    if fmt == "parquet" and pyarrow is None:
+        raise RuntimeError("Parquet dumps require pyarrow")
+
+    filters = filters or {}
+    os.makedirs(directory, exist_ok=True)
+    started = time.perf_counter()
+
+    # Hold a snapshot open and let every part read from it
+    coordinator = bind.raw_connection()
+    try:
+        cursor = coordinator.cursor()
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+        cursor.execute("SELECT pg_export_snapshot()")
+        snapshot = cursor.fetchone()[0]
+        cursor.execute("SELECT id, name FROM services ORDER BY id")
+        services = {str(service_id): name for service_id, name in cursor.fetchall()}
+
+        ranges = subscription_repository.user_ranges(parts)
+        with ThreadPoolExecutor(max_workers=parts) as pool:
+            futures = [
+                pool.submit(
+                    _dump_part,
+                    bind,
+                    snapshot,
+                    subscription_repository.export_query(user_range=user_range, **filters),
+                    os.path.join(directory, _part_name(index, fmt)),
+                    fmt
+                )
+                for index, user_range in enumerate(ranges)
+            ]
+            counts = [future.result() for future in futures]
+    finally:
+        coordinator.rollback()
+        coordinator.close()
+
+    manifest = {
+        "table": TABLE,
+        "format": fmt,
+        "columns": [column.name for column in subscription_repository.subscriptions.c],
+        "filters": {key: str(value) for key, value in filters.items() if value is not None},
+        "services": services,
+        "created_at": datetime.utcnow().isoformat(),
+        "parts": [{"file": _part_name(index, fmt), "rows": count} for index, count in enumerate(counts)],
+        "rows": sum(counts)
+    }
+    with open(os.path.join(directory, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    logger.info(f"Dumped {manifest['rows']} subscriptions to {directory} in {time.perf_counter() - started:.2f}s")
+    return manifest
+
+
+def _secondary_indexes(cursor) -> List[tuple]:
+    """(name, definition) of indexes on the table that do not back a constraint"""
+    cursor.execute(
+        """
+        SELECT quote_ident(i.relname), pg_get_indexdef(i.oid)
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = %s::regclass
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid)
+        ORDER BY i.relname
+        """,
+        (TABLE,)
+    )
+    return cursor.fetchall()
+
+
+def _execute(bind, sql: str, params=None, maintenance_work_mem: Optional[str] = None):
+    connection = bind.raw_connection()
+    try:
+        cursor = connection.cursor()
+        if maintenance_work_mem:
+            cursor.execute("SET LOCAL maintenance_work_mem = %s", (maintenance_work_mem,))
+        cursor.execute(sql, params)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def _service_ids(bind, services: Dict[str, str]) -> Dict[int, int]:
+    """Add the dump's service names to the target and map dumped ids to its ids"""
+    connection = bind.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(
+            "INSERT INTO services (name) SELECT unnest(%s::text[]) ON CONFLICT (name) DO NOTHING",
+            (list(services.values()),)
+        )
+        cursor.execute("SELECT name, id FROM services WHERE name = ANY(%s)", (list(services.values()),))
+        target = dict(cursor.fetchall())
+        connection.commit()
+    finally:
+        connection.close()
+    return {int(service_id): target[name] for service_id, name in services.items()}
+
+
+def _load_part(bind, path: str, fmt: str, columns: List[str], remap: Optional[Dict[int, int]] = None) -> None:
+    column_list = ", ".join(columns)
+    connection = bind.raw_connection()
+    try:
+        cursor = connection.cursor()
+        target = TABLE
+        if remap:
+            # Load into a scratch table and translate service ids while copying over
+            target = "subscriptions_load"
+            cursor.execute(f"CREATE TEMP TABLE {target} (LIKE {TABLE}) ON COMMIT DROP")
+            cursor.execute("CREATE TEMP TABLE service_remap (old_id integer PRIMARY KEY, new_id integer) ON COMMIT DROP")
+            cursor.execute(
+                "INSERT INTO service_remap SELECT * FROM unnest(%s::integer[], %s::integer[])",
+                (list(remap.keys()), list(remap.values()))
+            )
+
+        if fmt == "binary":
+            with open(path, "rb") as f:
+                cursor.copy_expert(f"COPY {target} ({column_list}) FROM STDIN WITH (FORMAT binary)", f)
+        else:
+            options = pyarrow.csv.WriteOptions(include_header=False)
+            for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=PARQUET_BATCH_ROWS, columns=columns):
+                buffer = io.BytesIO()
+                pyarrow.csv.write_csv(batch, buffer, options)
+                buffer.seek(0)
+                cursor.copy_expert(f"COPY {target} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+        if remap:
+            selected = ", ".join("r.new_id" if column == "service_id" else f"l.{column}" for column in columns)
+            cursor.execute(
+                f"INSERT INTO {TABLE} ({column_list}) SELECT {selected} "
+                f"FROM {target} l JOIN service_remap r ON r.old_id = l.service_id"
+            )
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def restore(
+    directory: str,
+    jobs: int = 4,
+    truncate: bool = False,
+    rebuild_indexes: bool = True,
+    disable_triggers: bool = True,
+    maintenance_work_mem: Optional[str] = None,
+    bind=engine
+) -> Dict[str, Any]:
+    """
+    Load a dump written by dump() with parallel COPY workers
+
+    Args:
+        directory: Dump directory
+        jobs: Number of parallel COPY and CREATE INDEX workers
+        truncate: Empty the table before loading
+        rebuild_indexes: Drop secondary indexes for the load and rebuild them after
+        disable_triggers: Disable user triggers during the load; change feed
+            consumers must then resynchronize from a fresh cursor
+        maintenance_work_mem: maintenance_work_mem for the index builds, e.g. "1GB"
+        bind: Engine to load into
+
+    Returns:
+        Summary with row count and timings
+    """
+    with open(os.path.join(directory, MANIFEST)) as f:
+        manifest = json.load(f)
+    fmt = manifest["format"]
+    if fmt == "parquet" and pyarrow is None:
+        raise RuntimeError("Parquet dumps require pyarrow")
+
+    known = {column.name for column in subscription_repository.subscriptions.c}
+    unknown = [column for column in manifest["columns"] if column not in known]
+    if unknown:
+        raise ValueError(f"Dump has columns missing in the table: {', '.join(unknown)}")
+
+    started = time.perf_counter()
+    remap = _service_ids(bind, manifest.get("services", {}))
+    if all(old == new for old, new in remap.items()):
+        # Same ids in the target: COPY straight into the table
+        remap = None
+    connection = bind.raw_connection()
+    try:
+        cursor = connection.cursor()
+        indexes = _secondary_indexes(cursor) if rebuild_indexes else []
+        if truncate:
+            cursor.execute(f"TRUNCATE {TABLE}")
+        if disable_triggers:
+            cursor.execute(f"ALTER TABLE {TABLE} DISABLE TRIGGER USER")
+        for name, _ in indexes:
+            cursor.execute(f"DROP INDEX IF EXISTS {name}")
+        connection.commit()
+    finally:
+        connection.close()
+
+    logger.info(f"Loading {manifest['rows']} rows with {jobs} workers, rebuilding {len(indexes)} indexes")
+    loaded_at = None
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            list(pool.map(
+                lambda part: _load_part(bind, os.path.join(directory, part["file"]), fmt, manifest["columns"], remap),
+                manifest["parts"]
+            ))
+        loaded_at = time.perf_counter()
+    finally:
+        # Indexes and triggers come back even when the load fails
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            list(pool.map(
+                lambda index: _execute(bind, index[1], maintenance_work_mem=maintenance_work_mem),
+                indexes
+            ))
+        if disable_triggers:
+            _execute(bind, f"ALTER TABLE {TABLE} ENABLE TRIGGER USER")
+
+    _execute(bind, f"ANALYZE {TABLE}")
+    finished_at = time.perf_counter()
+
+    summary = {
+        "rows": manifest["rows"],
+        "load_seconds": round(loaded_at - started, 3),
+        "index_seconds": round(finished_at - loaded_at, 3),
+        "remapped_services": bool(remap),
+        "indexes": [name for name, _ in indexes]
+    }
+    logger.info(f"Restored {summary['rows']} subscriptions in {finished_at - started:.2f}s")
+    return summary
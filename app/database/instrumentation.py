@@ -0,0 +1,237 @@
+"""
+SQL query instrumentation
+
+Engine event hooks count statements and database time for the current
+request, log slow statements with their parameters redacted and warn when a
+request repeats the same statement shape (the N+1 pattern). Per-request stats
+live in a context variable, which FastAPI copies into the threadpool running
+sync routes, so the routes and get_db need no changes. Inside a sampled trace
+every statement is also recorded as a client span.
+
+capture_queries() and assert_query_count() collect statements from every
+thread and are meant for tests that hold endpoints to a statement budget.
+
+Within a request that has a deadline (app.utils.deadline), statements are
+refused once it has passed, each transaction gets a statement_timeout of the
+time left and running statements are registered so they can be cancelled.
+"""
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+from app.utils.deadline import DEADLINE, QUERY_CANCELED, DeadlineExceeded, current_deadline
+from app.utils.logger import get_logger
+from app.utils.tracing import current_span, start_span
+
+# Load environment variables
+load_dotenv()
+
+# Instrumentation configuration
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+
+logger = get_logger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    """Normalize a parameterized statement so identical shapes compare equal"""
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+def redact_parameters(parameters) -> str:
+    """Describe bound parameters without revealing their values"""
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: ?" for key in parameters) + "}"
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return f"<{len(parameters)} parameter sets>"
+        return "(" + ", ".join("?" for _ in parameters) + ")"
+    return "?"
+
+
+class QueryStats:
+    """Statements executed within one request or capture block"""
+
+    def __init__(self, keep_statements: bool = False):
+        self.count = 0
+        self.total_time = 0.0
+        self.shapes: Counter = Counter()
+        self.statements: List[Tuple[str, object]] = []
+        self.keep_statements = keep_statements
+        self._lock = threading.Lock()
+
+    def record(self, statement: str, parameters, elapsed: float):
+        with self._lock:
+            self.count += 1
+            self.total_time += elapsed
+            self.shapes[statement_shape(statement)] += 1
+            if self.keep_statements:
+                self.statements.append((statement, parameters))
+
+    @property
+    def total_ms(self) -> float:
+        return self.total_time * 1000
+
+    def repeated_shapes(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> List[Tuple[str, int]]:
+        """Statement shapes issued at least threshold times"""
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+# Active capture_queries() blocks, fed from every thread
+_collectors: List[QueryStats] = []
+_collectors_lock = threading.Lock()
+
+
+def start_request_stats() -> Tuple[QueryStats, object]:
+    """Begin collecting stats for the current request context"""
+    stats = QueryStats()
+    return stats, _current_stats.set(stats)
+
+
+def finish_request_stats(token, label: str):
+    """Stop collecting stats for the request and report repeated statement shapes"""
+    stats = _current_stats.get()
+    _current_stats.reset(token)
+    if stats is None:
+        return
+    for shape, count in stats.repeated_shapes():
+        logger.warning(f"Possible N+1 in {label}: statement issued {count} times: {shape[:300]}")
+
+
+def _statement_span(conn, statement: str):
+    shape = statement_shape(statement)
+    return start_span(shape.split(" ", 1)[0].upper() or "SQL", "CLIENT", {
+        "db.system": "postgresql",
+        "db.name": conn.engine.url.database,
+        "db.statement": shape[:2000],
+    })
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+    # Only build span attributes inside a sampled trace
+    conn.info.setdefault("query_spans", []).append(_statement_span(conn, statement) if current_span() else None)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    span = conn.info["query_spans"].pop()
+    if span is not None:
+        if cursor.rowcount >= 0:
+            span.set_attribute("db.rows", cursor.rowcount)
+        span.end()
+
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.record(statement, parameters, elapsed)
+    if _collectors:
+        with _collectors_lock:
+            for collector in _collectors:
+                collector.record(statement, parameters, elapsed)
+
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        logger.warning(
+            f"Slow query ({elapsed * 1000:.1f}ms): {statement_shape(statement)} "
+            f"params={redact_parameters(parameters)}"
+        )
+
+
+def _handle_error(exception_context):
+    # Keep the timing stack balanced when a statement fails
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_start_time"):
+        connection.info["query_start_time"].pop()
+        span = connection.info["query_spans"].pop()
+        if span is not None:
+            span.set_error(exception_context.original_exception)
+            span.end()
+
+
+def _deadline_before_execute(conn, cursor, statement, parameters, context, executemany):
+    deadline = current_deadline()
+    if deadline is None:
+        return
+    deadline.check()
+    if conn.info.get("deadline") is not deadline:
+        # SET LOCAL lasts until the transaction ends, so once per transaction
+        # (later statements are still cancelled when the deadline passes)
+        cursor.execute(f"SET LOCAL statement_timeout = {deadline.statement_timeout_ms()}")
+        conn.info["deadline"] = deadline
+    deadline.track(conn.connection.dbapi_connection)
+
+
+def _deadline_after_execute(conn, cursor, statement, parameters, context, executemany):
+    deadline = current_deadline()
+    if deadline is not None:
+        deadline.untrack(conn.connection.dbapi_connection)
+
+
+def _deadline_transaction_end(conn, *args):
+    conn.info.pop("deadline", None)
+
+
+def _deadline_error(exception_context):
+    deadline = current_deadline()
+    if deadline is None:
+        return
+    connection = exception_context.connection
+    if connection is not None and not connection.invalidated:
+        deadline.untrack(connection.connection.dbapi_connection)
+    # A statement cancelled by the deadline (rather than by a shorter timeout
+    # of its own, as in count_filtered()) fails the request
+    if deadline.expired and getattr(exception_context.original_exception, "pgcode", None) == QUERY_CANCELED:
+        raise DeadlineExceeded(deadline.reason or DEADLINE) from exception_context.original_exception
+
+
+def instrument_engine(engine):
+    """Attach the query instrumentation and deadline hooks to an engine"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    event.listen(engine, "before_cursor_execute", _deadline_before_execute)
+    event.listen(engine, "after_cursor_execute", _deadline_after_execute)
+    # Last, since raising from it skips the handlers after it
+    event.listen(engine, "handle_error", _deadline_error)
+    for name in ("commit", "rollback", "rollback_savepoint"):
+        event.listen(engine, name, _deadline_transaction_end)
+
+
+@contextmanager
+def capture_queries():
+    """Collect every statement executed, from any thread, inside the block"""
+    stats = QueryStats(keep_statements=True)
+    with _collectors_lock:
+        _collectors.append(stats)
+    try:
+        yield stats
+    finally:
+        with _collectors_lock:
+            _collectors.remove(stats)
+
+
+@contextmanager
+def assert_query_count(expected: int):
+    """
+    Fail unless exactly the expected number of statements runs inside the block
+
+    Usage:
+        with assert_query_count(1):
+            client.get(f"/subscriptions/{subscription_id}")
+    """
+    with capture_queries() as stats:
+        yield stats
+    if stats.count != expected:
+        issued = "\n".join(statement_shape(statement) for statement, _ in stats.statements)
+        raise AssertionError(f"Expected {expected} queries, got {stats.count}:\n{issued}")
@@ -3,6 +3,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
+from app.database.instrumentation import instrument_engine
 
 # Load environment variables
 load_dotenv()
@@ -17,8 +18,13 @@ DB_PASSWORD = os.getenv("DB_PASSWORD", "postgres")
 # Create database URL
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+# Echo every statement to the log (per-request stats and the slow-query log
+# from app.database.instrumentation are usually enough)
+DB_ECHO = os.getenv("DB_ECHO", "True").lower() == "true"
+
 # Create engine
-engine = create_engine(DATABASE_URL, echo=True)
+engine = create_engine(DATABASE_URL, echo=DB_ECHO)
+instrument_engine(engine)
 
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
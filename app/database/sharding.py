@@ -0,0 +1,284 @@
+"""
+Horizontal sharding of subscriptions by user id
+
+SHARD_URLS lists one database URL per shard, comma separated. Left empty, the
+service runs on the single database from the DB_* settings (shard 0 is the
+regular engine), so unsharded deployments behave exactly as before.
+
+A user lives on shard jump_hash(user_routing_key(user_id), N), where the
+routing key is 16 bits of a hash of the user id. New subscription ids carry
+their user's routing key in the first two bytes, so reads and writes by id go
+straight to one shard. Ids without it (rows created before sharding) miss on
+their routed shard and are then looked up on the other shards.
+
+Jump consistent hashing only moves about 1/N of the users when a shard is
+added; `python subscriptions_cli.py rebalance` moves their rows.
+"""
+import contextvars
+import hashlib
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+from fastapi import Depends
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.database.instrumentation import instrument_engine
+from app.database.session import DB_ECHO, SessionLocal, engine, get_db
+from app.repositories import subscription_repository
+from app.utils.logger import get_logger
+
+# Load environment variables
+load_dotenv()
+
+# Sharding configuration
+SHARD_URLS = [url.strip() for url in os.getenv("SHARD_URLS", "").split(",") if url.strip()]
+SHARD_SCATTER_WORKERS = int(os.getenv("SHARD_SCATTER_WORKERS", "16"))
+SHARD_REBALANCE_BATCH_ROWS = int(os.getenv("SHARD_REBALANCE_BATCH_ROWS", "5000"))
+
+logger = get_logger(__name__)
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash (Lamping & Veach) of a 64-bit key into [0, buckets)"""
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+
+def user_routing_key(user_id: uuid.UUID) -> int:
+    """16-bit routing key of a user"""
+    return int.from_bytes(hashlib.blake2b(user_id.bytes, digest_size=2).digest(), "big")
+
+
+def id_routing_key(subscription_id: uuid.UUID) -> int:
+    """Routing key carried by a subscription id"""
+    return int.from_bytes(subscription_id.bytes[:2], "big")
+
+
+def new_subscription_id(user_id: uuid.UUID) -> uuid.UUID:
+    """Random (version 4) id whose first two bytes are the user's routing key"""
+    return uuid.UUID(bytes=user_routing_key(user_id).to_bytes(2, "big") + uuid.uuid4().bytes[2:])
+
+
+class ShardRouter:
+    """Maps users and subscription ids to shard engines"""
+
+    def __init__(self, urls: Optional[List[str]] = None, scatter_workers: int = SHARD_SCATTER_WORKERS):
+        urls = SHARD_URLS if urls is None else urls
+        if urls:
+            self.engines = [create_engine(url, echo=DB_ECHO) for url in urls]
+            for shard_engine in self.engines:
+                instrument_engine(shard_engine)
+        else:
+            self.engines = [engine]
+        self.session_factories = [
+            SessionLocal if shard_engine is engine
+            else sessionmaker(autocommit=False, autoflush=False, bind=shard_engine)
+            for shard_engine in self.engines
+        ]
+        self.scatter_workers = scatter_workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def count(self) -> int:
+        return len(self.engines)
+
+    @property
+    def sharded(self) -> bool:
+        return self.count > 1
+
+    def shard_for_user(self, user_id: uuid.UUID) -> int:
+        return jump_hash(user_routing_key(user_id), self.count)
+
+    def shard_for_id(self, subscription_id: uuid.UUID) -> int:
+        return jump_hash(id_routing_key(subscription_id), self.count)
+
+    def sessions(self, primary: Optional[Session] = None) -> "ShardSessions":
+        """
+        Lazily opened sessions for one unit of work
+
+        Args:
+            primary: Already open session on the regular engine, reused as shard 0
+                while the service is not sharded
+        """
+        return ShardSessions(self, primary if not self.sharded else None)
+
+    def map(self, fn: Callable, items: list) -> list:
+        """
+        Run fn over items concurrently (in order, on this thread for a single item)
+
+        Each call runs in a copy of the caller's context, so request-scoped
+        state such as query stats and the current trace span carries over.
+        """
+        if len(items) == 1:
+            return [fn(items[0])]
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.scatter_workers, thread_name_prefix="shard-scatter")
+        context = contextvars.copy_context()
+        return list(self._pool.map(lambda item: context.copy().run(fn, item), items))
+
+    def dispose(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        for shard_engine in self.engines:
+            if shard_engine is not engine:
+                shard_engine.dispose()
+
+
+class ShardSessions:
+    """Per-shard sessions of one request, each used by one thread at a time"""
+
+    def __init__(self, router: ShardRouter, primary: Optional[Session] = None):
+        self.router = router
+        self._sessions: Dict[int, Session] = {0: primary} if primary is not None else {}
+        self._owned = set()
+
+    def __getitem__(self, shard: int) -> Session:
+        if shard not in self._sessions:
+            self._sessions[shard] = self.router.session_factories[shard]()
+            self._owned.add(shard)
+        return self._sessions[shard]
+
+    def all(self) -> List[Session]:
+        return [self[shard] for shard in range(self.router.count)]
+
+    def for_user(self, user_id: uuid.UUID) -> Session:
+        return self[self.router.shard_for_user(user_id)]
+
+    def scatter(self, fn: Callable[[Session], Any], user_id: Optional[uuid.UUID] = None) -> list:
+        """
+        Run fn on the user's shard, or on every shard concurrently
+
+        Returns:
+            Per-shard results, in shard order
+        """
+        if user_id is not None:
+            return [fn(self.for_user(user_id))]
+        return self.router.map(fn, self.all())
+
+    def locate(self, subscription_id: uuid.UUID, fn: Callable[[Session], Any]) -> Any:
+        """
+        Run fn on the shard routed to by the id, then on the others until it
+        returns something truthy (ids created before sharding)
+        """
+        home = self.router.shard_for_id(subscription_id)
+        result = fn(self[home])
+        for shard in range(self.router.count):
+            if result or shard == home:
+                continue
+            result = fn(self[shard])
+        return result
+
+    def locate_many(self, subscription_ids: List[uuid.UUID], fn: Callable[[Session, List[uuid.UUID]], list]) -> list:
+        """
+        Run fn(session, ids) on each shard for the ids routed to it, concurrently,
+        then on the other shards for the ids not found (ids created before sharding)
+
+        Returns:
+            Rows returned by fn, which must have an id
+        """
+        homes = {subscription_id: self.router.shard_for_id(subscription_id) for subscription_id in subscription_ids}
+        routed: Dict[int, List[uuid.UUID]] = {}
+        for subscription_id, shard in homes.items():
+            routed.setdefault(shard, []).append(subscription_id)
+        work = [(self[shard], shard_ids) for shard, shard_ids in routed.items()]
+        rows = [row for found in self.router.map(lambda item: fn(*item), work) for row in found]
+
+        if self.router.count > 1 and len(rows) < len(homes):
+            found = {row.id for row in rows}
+            missing = [subscription_id for subscription_id in homes if subscription_id not in found]
+            work = [
+                (self[shard], [subscription_id for subscription_id in missing if homes[subscription_id] != shard])
+                for shard in range(self.router.count)
+            ]
+            work = [(session, shard_ids) for session, shard_ids in work if shard_ids]
+            rows += [row for found in self.router.map(lambda item: fn(*item), work) for row in found]
+        return rows
+
+    def rollback(self):
+        for session in self._sessions.values():
+            session.rollback()
+
+    def close(self):
+        for shard in self._owned:
+            self._sessions[shard].close()
+        self._sessions.clear()
+        self._owned.clear()
+
+
+def rebalance(router: ShardRouter, batch_rows: int = SHARD_REBALANCE_BATCH_ROWS) -> int:
+    """
+    Move every subscription (hot or archived) to the shard of its user
+
+    Each batch is copied into its new shard and committed there before it is
+    deleted from the old one; the old rows stay locked in between, so writes to
+    them wait. Copies skip ids that already exist, which makes an interrupted
+    run safe to repeat. Until a batch is deleted from its old shard, queries
+    fanning out over all shards see it twice.
+
+    Archived rows are copied into the new shard's hot table and are archived
+    there again by the next archiving run.
+
+    Returns:
+        Number of rows moved
+    """
+    moved = 0
+    for source in range(router.count):
+        for archived in (False, True):
+            db = router.session_factories[source]()
+            try:
+                after_id = None
+                while True:
+                    rows = subscription_repository.rows_after(db, after_id, batch_rows, archived)
+                    if not rows:
+                        db.rollback()
+                        break
+                    after_id = rows[-1].id
+
+                    targets: Dict[int, List[Dict[str, Any]]] = {}
+                    for row in rows:
+                        target = router.shard_for_user(row.user_id)
+                        if target != source:
+                            targets.setdefault(target, []).append(row._asdict())
+
+                    for target, target_rows in targets.items():
+                        target_db = router.session_factories[target]()
+                        try:
+                            subscription_repository.copy_in(target_db, target_rows)
+                        finally:
+                            target_db.close()
+
+                    ids = [row["id"] for target_rows in targets.values() for row in target_rows]
+                    # Deleting also releases the batch's row locks
+                    subscription_repository.move_out(db, ids, archived)
+                    moved += len(ids)
+                    if ids:
+                        logger.info(f"Moved {len(ids)} subscriptions off shard {source}")
+            finally:
+                db.close()
+
+    logger.info(f"Rebalanced {moved} subscriptions over {router.count} shards")
+    return moved
+
+
+# Shared router
+shard_router = ShardRouter()
+
+
+def get_shards(db: Session = Depends(get_db)):
+    """
+    Dependency for getting the per-shard sessions of a request
+    """
+    shards = shard_router.sessions(primary=db)
+    try:
+        yield shards
+    finally:
+        shards.close()
@@ -0,0 +1,17 @@
+from .archive import ARCHIVE_ENABLED, Archiver, archive_cutoff, archiver
+from .change_feed import CHANGE_FEED_COMPACTION_ENABLED, ChangeFeedCompactor, change_feed_compactor
+from .reports import REPORT_KINDS, ReportJobManager, TooManyJobs, report_manager
+
+__all__ = [
+    "ARCHIVE_ENABLED",
+    "Archiver",
+    "archive_cutoff",
+    "archiver",
+    "CHANGE_FEED_COMPACTION_ENABLED",
+    "ChangeFeedCompactor",
+    "change_feed_compactor",
+    "REPORT_KINDS",
+    "ReportJobManager",
+    "TooManyJobs",
+    "report_manager"
+]
@@ -0,0 +1,170 @@
+"""
+Archiving of expired subscriptions
+
+Subscriptions whose end_date is older than the retention window are moved in
+batches from the hot subscriptions table into subscriptions_archive, so lists,
+cost queries and their indexes only cover the current working set.
+
+Reads include the archive only when they have to: a point read falls back to
+it on a miss, and cost queries add it when the requested period starts on or
+before the archive boundary (the latest archived end_date, or the current
+retention cutoff while archiving is enabled).
+
+Moving a row to the archive is not recorded in the change feed, and the feed
+keeps reporting archived subscriptions as existing. Deleting an archived
+subscription leaves a tombstone as usual.
+
+With sharding every shard keeps its own archive and boundary.
+"""
+import os
+import threading
+import time
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.database.sharding import shard_router
+from app.repositories import subscription_repository
+from app.utils.logger import get_logger
+from app.utils.periods import month_index, month_index_to_date
+
+# Load environment variables
+load_dotenv()
+
+# Archiving configuration
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "False").lower() == "true"
+ARCHIVE_RETENTION_MONTHS = int(os.getenv("ARCHIVE_RETENTION_MONTHS", "24"))
+ARCHIVE_BATCH_ROWS = int(os.getenv("ARCHIVE_BATCH_ROWS", "5000"))
+ARCHIVE_BATCH_PAUSE_MS = float(os.getenv("ARCHIVE_BATCH_PAUSE_MS", "50"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+# How long a worker trusts its cached archive boundary
+ARCHIVE_BOUNDARY_TTL_SECONDS = float(os.getenv("ARCHIVE_BOUNDARY_TTL_SECONDS", "60"))
+
+# pg_advisory_lock key making sure only one worker archives at a time
+ARCHIVE_LOCK_KEY = 7_361_203_036
+
+logger = get_logger(__name__)
+
+
+def archive_cutoff(retention_months: int = ARCHIVE_RETENTION_MONTHS, today: Optional[date] = None) -> date:
+    """
+    First day of the oldest month still kept in the hot table
+
+    Args:
+        retention_months: Months of ended subscriptions to keep hot
+        today: Reference date, defaults to today
+
+    Returns:
+        Subscriptions that ended before this date are archived
+    """
+    return month_index_to_date(month_index(today or date.today()) - retention_months)
+
+
+class Archiver:
+    """Periodically moves expired subscriptions into the archive table"""
+
+    def __init__(
+        self,
+        binds: Optional[List] = None,
+        enabled: bool = ARCHIVE_ENABLED,
+        retention_months: int = ARCHIVE_RETENTION_MONTHS,
+        batch_rows: int = ARCHIVE_BATCH_ROWS,
+        batch_pause_ms: float = ARCHIVE_BATCH_PAUSE_MS,
+        interval_seconds: float = ARCHIVE_INTERVAL_SECONDS,
+        boundary_ttl_seconds: float = ARCHIVE_BOUNDARY_TTL_SECONDS
+    ):
+        # One engine per shard
+        self.binds = binds if binds is not None else shard_router.engines
+        self.enabled = enabled
+        self.retention_months = retention_months
+        self.batch_rows = batch_rows
+        self.batch_pause = batch_pause_ms / 1000.0
+        self.interval = interval_seconds
+        self.boundary_ttl = boundary_ttl_seconds
+        # Cached (boundary, checked at) per database
+        self._boundaries: Dict[str, Tuple[Optional[date], float]] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="subscription-archiver", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Archiving failed: {str(e)}")
+            self._stop.wait(self.interval)
+
+    def run_once(self) -> int:
+        """
+        Archive everything past the retention window, batch by batch
+
+        Returns:
+            Number of rows moved (0 if another worker is archiving)
+        """
+        cutoff = archive_cutoff(self.retention_months)
+        started = time.perf_counter()
+        moved = sum(self._archive(bind, cutoff) for bind in self.binds)
+        self._boundaries.clear()
+        logger.info(f"Archived {moved} subscriptions ended before {cutoff} in {time.perf_counter() - started:.2f}s")
+        return moved
+
+    def _archive(self, bind, cutoff: date) -> int:
+        moved = 0
+        with bind.connect() as conn:
+            if not conn.execute(select(func.pg_try_advisory_lock(ARCHIVE_LOCK_KEY))).scalar():
+                conn.rollback()
+                logger.info(f"Archiving of {bind.url.database} already running in another worker")
+                return 0
+            conn.commit()
+            try:
+                while not self._stop.is_set():
+                    count = subscription_repository.archive_expired(conn, cutoff, self.batch_rows)
+                    moved += count
+                    if count < self.batch_rows:
+                        break
+                    # Let regular traffic through between batches
+                    time.sleep(self.batch_pause)
+            finally:
+                conn.execute(select(func.pg_advisory_unlock(ARCHIVE_LOCK_KEY)))
+                conn.commit()
+        return moved
+
+    def includes_period(self, db, period_start: date) -> bool:
+        """
+        Whether archived subscriptions may overlap a period starting at period_start
+
+        Args:
+            db: Session or connection of the database (shard) being queried,
+                used to refresh its cached boundary
+            period_start: First day of the requested period
+        """
+        key = str((db.get_bind() if isinstance(db, Session) else db.engine).url)
+        now = time.monotonic()
+        cached = self._boundaries.get(key)
+        if cached is None or now - cached[1] > self.boundary_ttl:
+            cached = self._boundaries[key] = (subscription_repository.archive_max_end_date(db), now)
+
+        boundary = cached[0]
+        if boundary is not None and period_start <= boundary:
+            return True
+        # Rows archived since the boundary was cached ended before the cutoff
+        return self.enabled and period_start < archive_cutoff(self.retention_months)
+
+
+# Shared archiver
+archiver = Archiver()
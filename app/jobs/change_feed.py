@@ -0,0 +1,126 @@
+"""
+Change feed retention
+
+Every write appends to subscription_changes, so the feed grows without bound
+unless it is compacted. Once entries are older than the retention period:
+
+- an entry followed by a later one of the same subscription is deleted; the
+  feed returns current rows, so every cursor still sees the subscription
+  through the later entry,
+- tombstones are deleted. A cursor from before a deleted tombstone would miss
+  that delete, so the newest deleted tombstone becomes the feed's horizon and
+  changes_since() refuses older cursors (GET /subscriptions/changes answers
+  410). Such a client resyncs from a full list, or from the beginning of the
+  feed, which never expires.
+
+What remains is about one entry per existing subscription plus the recent
+history. Each shard compacts its own feed.
+"""
+import os
+import threading
+import time
+from datetime import timedelta
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import func, select
+
+from app.database.sharding import shard_router
+from app.repositories import subscription_repository
+from app.utils.logger import get_logger
+
+# Load environment variables
+load_dotenv()
+
+# Change feed retention configuration
+CHANGE_FEED_COMPACTION_ENABLED = os.getenv("CHANGE_FEED_COMPACTION_ENABLED", "False").lower() == "true"
+CHANGE_FEED_RETENTION_DAYS = float(os.getenv("CHANGE_FEED_RETENTION_DAYS", "30"))
+CHANGE_FEED_COMPACTION_BATCH_ROWS = int(os.getenv("CHANGE_FEED_COMPACTION_BATCH_ROWS", "5000"))
+CHANGE_FEED_COMPACTION_BATCH_PAUSE_MS = float(os.getenv("CHANGE_FEED_COMPACTION_BATCH_PAUSE_MS", "50"))
+CHANGE_FEED_COMPACTION_INTERVAL_SECONDS = float(os.getenv("CHANGE_FEED_COMPACTION_INTERVAL_SECONDS", "3600"))
+
+# pg_advisory_lock key making sure only one worker compacts at a time
+CHANGE_FEED_LOCK_KEY = 7_361_203_037
+
+logger = get_logger(__name__)
+
+
+class ChangeFeedCompactor:
+    """Periodically deletes superseded and expired entries of the change feed"""
+
+    def __init__(
+        self,
+        binds: Optional[List] = None,
+        retention_days: float = CHANGE_FEED_RETENTION_DAYS,
+        batch_rows: int = CHANGE_FEED_COMPACTION_BATCH_ROWS,
+        batch_pause_ms: float = CHANGE_FEED_COMPACTION_BATCH_PAUSE_MS,
+        interval_seconds: float = CHANGE_FEED_COMPACTION_INTERVAL_SECONDS
+    ):
+        # One engine per shard
+        self.binds = binds if binds is not None else shard_router.engines
+        self.retention = timedelta(days=retention_days)
+        self.batch_rows = batch_rows
+        self.batch_pause = batch_pause_ms / 1000.0
+        self.interval = interval_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="change-feed-compactor", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Change feed compaction failed: {str(e)}")
+            self._stop.wait(self.interval)
+
+    def run_once(self) -> int:
+        """
+        Compact every shard's feed up to the retention cutoff, batch by batch
+
+        Returns:
+            Number of entries deleted (0 if another worker is compacting)
+        """
+        started = time.perf_counter()
+        removed = sum(self._compact(bind) for bind in self.binds)
+        logger.info(f"Compacted {removed} change feed entries in {time.perf_counter() - started:.2f}s")
+        return removed
+
+    def _compact(self, bind) -> int:
+        removed = 0
+        with bind.connect() as conn:
+            # changed_at is the database's local time of the change
+            cutoff = conn.execute(select(func.localtimestamp() - self.retention)).scalar()
+            if not conn.execute(select(func.pg_try_advisory_lock(CHANGE_FEED_LOCK_KEY))).scalar():
+                conn.rollback()
+                logger.info(f"Change feed compaction of {bind.url.database} already running in another worker")
+                return 0
+            conn.commit()
+            try:
+                after_seq = 0
+                while not self._stop.is_set():
+                    count, after_seq = subscription_repository.compact_changes(conn, cutoff, after_seq, self.batch_rows)
+                    removed += count
+                    if after_seq is None:
+                        break
+                    # Let regular traffic through between batches
+                    time.sleep(self.batch_pause)
+            finally:
+                conn.execute(select(func.pg_advisory_unlock(CHANGE_FEED_LOCK_KEY)))
+                conn.commit()
+        return removed
+
+
+# Shared change feed compactor
+change_feed_compactor = ChangeFeedCompactor()
@@ -0,0 +1,407 @@
+"""
+Background report jobs
+
+Long cost reports are submitted as jobs and computed outside the request
+cycle. A job is split into shards by user id range; shards run in a process
+pool (one database connection per worker process and database shard) and their partial results
+are additive, so the coordinator only has to sum them up.
+
+Job state lives in REPORTS_DIR as plain files, so any API worker can answer
+status and download requests:
+    <id>.json         job metadata and status
+    <id>.result.json  finished report
+    <id>.cancel       cancellation marker, checked between shards
+
+Files of jobs finished more than REPORT_RETENTION_HOURS ago are deleted by a
+sweep that submit() runs at most once per SWEEP_INTERVAL_SECONDS.
+"""
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.repositories import subscription_repository
+from app.schemas.subscription import parse_month_period
+from app.utils.logger import get_logger
+from app.utils.periods import month_index_to_date
+
+# Load environment variables
+load_dotenv()
+
+# Report job configuration
+REPORTS_DIR = os.getenv("REPORTS_DIR", "reports")
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", str(os.cpu_count() or 2)))
+REPORT_MAX_RUNNING_JOBS = int(os.getenv("REPORT_MAX_RUNNING_JOBS", "2"))
+REPORT_MAX_QUEUED_JOBS = int(os.getenv("REPORT_MAX_QUEUED_JOBS", "20"))
+REPORT_SHARDS_PER_WORKER = int(os.getenv("REPORT_SHARDS_PER_WORKER", "4"))
+REPORT_RETENTION_HOURS = float(os.getenv("REPORT_RETENTION_HOURS", "168"))
+
+SWEEP_INTERVAL_SECONDS = 3600
+
+REPORT_KINDS = ("cost", "services")
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+logger = get_logger(__name__)
+
+
+class TooManyJobs(Exception):
+    """Raised when the job queue is full"""
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once its cancellation marker is seen"""
+
+
+def _period_dates(params: Dict[str, Any]) -> Tuple[date, date]:
+    """First days of the job's start and end months (params hold the request's MM-YYYY periods)"""
+    return (
+        month_index_to_date(parse_month_period(params["start_period"])),
+        month_index_to_date(parse_month_period(params["end_period"]))
+    )
+
+
+def _partial(kind: str, db, start_date: date, end_date: date, user_id, service_name, user_range) -> Dict[str, Any]:
+    """Partial report of one user id range in one database"""
+    from app.jobs.archive import archiver
+
+    include_archive = archiver.includes_period(db, start_date)
+    if kind == "cost":
+        total, count = subscription_repository.total_cost(
+            db, start_date, end_date, user_id, service_name, user_range, include_archive
+        )
+        months = subscription_repository.monthly_cost(
+            db, start_date, end_date, user_id, service_name, user_range, include_archive
+        )
+        return {
+            "total_cost": total,
+            "count": count,
+            "months": {month.isoformat(): [cost, month_count] for month, cost, month_count in months}
+        }
+    rows = subscription_repository.service_cost(
+        db, start_date, end_date, service_name, user_range, include_archive
+    )
+    return {"services": {name: [cost, count, users] for name, cost, count, users in rows}}
+
+
+def run_shard(kind: str, params: Dict[str, Any], user_range, cancel_path: str) -> Dict[str, Any]:
+    """
+    Compute the partial report for one user id range (runs in a worker process)
+
+    The range is read from every database shard (or only the user's shard).
+    """
+    if os.path.exists(cancel_path):
+        raise JobCancelled()
+
+    # Imported here so the worker process opens its own engines and pools
+    from app.database.sharding import shard_router
+
+    start_date, end_date = _period_dates(params)
+    user_id = uuid.UUID(params["user_id"]) if params.get("user_id") else None
+    service_name = params.get("service_name")
+
+    sessions = shard_router.sessions()
+    try:
+        databases = [sessions.for_user(user_id)] if user_id else sessions.all()
+        return _combine(kind, [
+            _partial(kind, db, start_date, end_date, user_id, service_name, user_range)
+            for db in databases
+        ])
+    finally:
+        sessions.close()
+
+
+def _add(target: Dict[str, list], source: Dict[str, list]):
+    for key, values in source.items():
+        current = target.setdefault(key, [0] * len(values))
+        target[key] = [a + b for a, b in zip(current, values)]
+
+
+def _combine(kind: str, partials: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Sum partial results into one partial (they never share a user)"""
+    if kind == "cost":
+        months: Dict[str, list] = {}
+        for partial in partials:
+            _add(months, partial["months"])
+        return {
+            "total_cost": sum(partial["total_cost"] for partial in partials),
+            "count": sum(partial["count"] for partial in partials),
+            "months": months
+        }
+
+    services: Dict[str, list] = {}
+    for partial in partials:
+        _add(services, partial["services"])
+    return {"services": services}
+
+
+def _merge(kind: str, partials: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Sum partial shard results into the final report"""
+    combined = _combine(kind, partials)
+    if kind == "cost":
+        return {
+            "total_cost": combined["total_cost"],
+            "count": combined["count"],
+            "months": [
+                {"month": f"{month[5:7]}-{month[:4]}", "total_cost": cost, "count": count}
+                for month, (cost, count) in sorted(combined["months"].items())
+            ]
+        }
+
+    services = combined["services"]
+    return {
+        "services": [
+            {"service_name": name, "total_cost": cost, "count": count, "users": users}
+            for name, (cost, count, users) in sorted(services.items(), key=lambda item: -item[1][0])
+        ]
+    }
+
+
+class ReportJobManager:
+    """
+    Queue of report jobs executed with bounded concurrency
+
+    At most max_running jobs are coordinated at once; the rest wait in the
+    coordinator queue, which is capped at max_queued jobs.
+    """
+
+    def __init__(
+        self,
+        directory: str = REPORTS_DIR,
+        workers: int = REPORT_WORKERS,
+        max_running: int = REPORT_MAX_RUNNING_JOBS,
+        max_queued: int = REPORT_MAX_QUEUED_JOBS,
+        shards_per_worker: int = REPORT_SHARDS_PER_WORKER,
+        retention_hours: float = REPORT_RETENTION_HOURS
+    ):
+        self.directory = directory
+        self.workers = workers
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.shards = max(1, workers * shards_per_worker)
+        self.retention_seconds = retention_hours * 3600
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._coordinators: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+        self._swept_at = -float("inf")
+        self._lock = threading.Lock()
+
+    def _path(self, job_id: str, suffix: str = ".json") -> str:
+        return os.path.join(self.directory, f"{job_id}{suffix}")
+
+    @staticmethod
+    def _write_json(path: str, data: Dict[str, Any]):
+        # Write and rename so readers never see a partial file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _write_job(self, job: Dict[str, Any]):
+        self._write_json(self._path(job["id"]), job)
+
+    def _executors(self) -> Tuple[ProcessPoolExecutor, ThreadPoolExecutor]:
+        with self._lock:
+            if self._pool is None:
+                # spawn: workers must not inherit the parent's DB connections and threads
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            if self._coordinators is None:
+                self._coordinators = ThreadPoolExecutor(
+                    max_workers=self.max_running, thread_name_prefix="report-job"
+                )
+            return self._pool, self._coordinators
+
+    def submit(self, kind: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Register a job and queue it for execution
+
+        Raises:
+            TooManyJobs: The queue already holds max_queued jobs
+        """
+        with self._lock:
+            if self._pending >= self.max_queued:
+                raise TooManyJobs()
+            self._pending += 1
+
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "params": params,
+            "status": "queued",
+            "progress": 0.0,
+            "error": None,
+            "created_at": datetime.utcnow().isoformat(),
+            "started_at": None,
+            "finished_at": None
+        }
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self._write_job(job)
+            _, coordinators = self._executors()
+            coordinators.submit(self._run, job)
+        except BaseException:
+            # The job will never run (disk full, pools shut down): free its
+            # place in the queue and drop its file
+            with self._lock:
+                self._pending -= 1
+            try:
+                os.remove(self._path(job["id"]))
+            except OSError:
+                pass
+            raise
+        logger.info(f"Report job {job['id']} ({kind}) queued")
+        self._sweep_if_due()
+        return job
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """
+        Delete the files of jobs finished more than the retention period ago
+
+        Returns:
+            Number of jobs deleted
+        """
+        cutoff = (time.time() if now is None else now) - self.retention_seconds
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return 0
+
+        removed = 0
+        for name in names:
+            if not name.endswith(".json") or name.endswith(".result.json"):
+                continue
+            job_id = name[:-len(".json")]
+            try:
+                # A job's file is rewritten when it finishes, so its mtime is
+                # no older than the finish time
+                if os.path.getmtime(self._path(job_id)) >= cutoff:
+                    continue
+                job = self.get(job_id)
+            except (OSError, ValueError):
+                continue
+            if job is None or job["status"] not in FINISHED_STATUSES:
+                continue
+            for suffix in (".result.json", ".cancel", ".json"):
+                try:
+                    os.remove(self._path(job_id, suffix))
+                except FileNotFoundError:
+                    pass
+            removed += 1
+        return removed
+
+    def _sweep_if_due(self):
+        with self._lock:
+            if time.monotonic() - self._swept_at < SWEEP_INTERVAL_SECONDS:
+                return
+            self._swept_at = time.monotonic()
+        try:
+            removed = self.sweep()
+        except OSError as e:
+            logger.warning(f"Report sweep failed: {str(e)}")
+            return
+        if removed:
+            logger.info(f"Deleted {removed} finished report jobs older than {self.retention_seconds / 3600:g}h")
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Read job metadata, None for unknown ids"""
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._path(job_id)) as f:
+                job = json.load(f)
+        except FileNotFoundError:
+            return None
+        if job["status"] not in FINISHED_STATUSES and os.path.exists(self._path(job_id, ".cancel")):
+            job["status"] = "cancelling"
+        return job
+
+    def result_path(self, job_id: str) -> Optional[str]:
+        """Path of a finished report file"""
+        path = self._path(job_id, ".result.json")
+        return path if job_id.isalnum() and os.path.exists(path) else None
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Request cancellation; the job stops before its next shard"""
+        job = self.get(job_id)
+        if job is not None and job["status"] not in FINISHED_STATUSES:
+            open(self._path(job_id, ".cancel"), "w").close()
+            job["status"] = "cancelling"
+        return job
+
+    def _run(self, job: Dict[str, Any]):
+        cancel_path = self._path(job["id"], ".cancel")
+        try:
+            if os.path.exists(cancel_path):
+                raise JobCancelled()
+            job.update(status="running", started_at=datetime.utcnow().isoformat())
+            self._write_job(job)
+
+            result = self._execute(job, cancel_path)
+
+            report = {"id": job["id"], "kind": job["kind"], "params": job["params"], **result}
+            self._write_json(self._path(job["id"], ".result.json"), report)
+            job.update(status="completed", progress=1.0)
+            logger.info(f"Report job {job['id']} completed")
+        except JobCancelled:
+            job["status"] = "cancelled"
+            logger.info(f"Report job {job['id']} cancelled")
+        except Exception as e:
+            job.update(status="failed", error=str(e))
+            logger.error(f"Report job {job['id']} failed: {str(e)}")
+        finally:
+            job["finished_at"] = datetime.utcnow().isoformat()
+            self._write_job(job)
+            with self._lock:
+                self._pending -= 1
+
+    def _execute(self, job: Dict[str, Any], cancel_path: str) -> Dict[str, Any]:
+        pool, _ = self._executors()
+        ranges = subscription_repository.user_ranges(self.shards)
+        futures = {
+            pool.submit(run_shard, job["kind"], job["params"], user_range, cancel_path)
+            for user_range in ranges
+        }
+        partials = []
+        try:
+            while futures:
+                done, futures = wait(futures, timeout=1.0, return_when=FIRST_COMPLETED)
+                if os.path.exists(cancel_path):
+                    raise JobCancelled()
+                try:
+                    partials.extend(future.result() for future in done)
+                except BrokenProcessPool:
+                    # A worker died: start a fresh pool for the next job
+                    with self._lock:
+                        if self._pool is pool:
+                            self._pool = None
+                    raise
+                if done:
+                    job["progress"] = round(len(partials) / len(ranges), 3)
+                    self._write_job(job)
+        finally:
+            for future in futures:
+                future.cancel()
+        return _merge(job["kind"], partials)
+
+    def close(self):
+        """Stop accepting work and shut the pools down"""
+        with self._lock:
+            pool, coordinators = self._pool, self._coordinators
+            self._pool = self._coordinators = None
+        if coordinators is not None:
+            coordinators.shutdown(wait=False, cancel_futures=True)
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Shared job manager
+report_manager = ReportJobManager()
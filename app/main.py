@@ -1,14 +1,28 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.api import router
+from app.analytics import ANALYTICS_ENGINE_ENABLED, SKETCHES_ENABLED, analytics_engine, sketch_store
 from app.database import engine, Base
+from app.database.batching import group_committer
+from app.database.sharding import shard_router
+from app.jobs import ARCHIVE_ENABLED, CHANGE_FEED_COMPACTION_ENABLED, archiver, change_feed_compactor, report_manager
 from app.utils.logger import get_logger
 from app.security import license_manager
+from app.middleware.profiling import PROFILING_ENABLED, ProfilingMiddleware
+from app.middleware.query_stats import QueryStatsMiddleware
+from app.middleware.admission import ADMISSION_CONTROL_ENABLED, AdmissionControlMiddleware
+from app.middleware.deadline import DeadlineMiddleware
+from app.middleware.tracing import TracingMiddleware
+from app.utils.deadline import DEADLINES_ENABLED
+from app.utils.tracing import TRACING_ENABLED, span_exporter
+from app.utils.metrics import metrics
 import uvicorn
 import os
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+# Create tables (on every shard)
+for shard_engine in shard_router.engines:
+    Base.metadata.create_all(bind=shard_engine)
 
 # Initialize logger
 logger = get_logger(__name__)
@@ -29,8 +43,30 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Total-Count-Type", "ETag"],
 )
 
+# Count SQL statements and database time per request
+app.add_middleware(QueryStatsMiddleware)
+
+# Profile requests on demand (not installed at all when disabled)
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
+# Shed load per route class before requests reach the threadpool and DB pool
+if ADMISSION_CONTROL_ENABLED:
+    app.add_middleware(AdmissionControlMiddleware)
+
+# Deadline per request, counted from arrival (so outside admission control);
+# past it statements are cancelled and the request gets 504
+if DEADLINES_ENABLED:
+    app.add_middleware(DeadlineMiddleware)
+
+# Root span per request (added last so it is the outermost middleware and
+# shed requests are traced too)
+if TRACING_ENABLED:
+    app.add_middleware(TracingMiddleware)
+
 # Include API router
 app.include_router(router)
 
@@ -50,11 +86,42 @@ async def startup_event():
         logger.error("Commercial use requires paid license")
         # Можно добавить graceful degradation вместо остановки
     
-    logger.info(f"Database connected: {engine.url}")
+    if shard_router.sharded:
+        logger.info(f"Database sharded over {shard_router.count} shards: {', '.join(str(e.url) for e in shard_router.engines)}")
+    else:
+        logger.info(f"Database connected: {engine.url}")
+    
+    # Keep the columnar snapshot for cost queries warm
+    if ANALYTICS_ENGINE_ENABLED and shard_router.sharded:
+        logger.warning("Analytics engine is not available with sharding, cost queries go to the shards")
+    elif ANALYTICS_ENGINE_ENABLED:
+        analytics_engine.start()
+    
+    # Distinct user and spend sketches for the approximate analytics endpoints
+    if SKETCHES_ENABLED:
+        sketch_store.start()
+    
+    # Move expired subscriptions out of the hot table on a schedule
+    if ARCHIVE_ENABLED:
+        archiver.start()
+    
+    # Drop superseded and expired change feed entries on a schedule
+    if CHANGE_FEED_COMPACTION_ENABLED:
+        change_feed_compactor.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Shutting down Subscription Service...")
+    
+    # Flush subscriptions still waiting for a group commit
+    group_committer.close()
+    analytics_engine.stop()
+    sketch_store.stop()
+    report_manager.close()
+    archiver.stop()
+    change_feed_compactor.stop()
+    shard_router.dispose()
+    span_exporter.close()
 
 @app.get("/")
 async def root():
@@ -64,6 +131,11 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Метрики сервиса в формате Prometheus"""
+    return metrics.render()
+
 @app.get("/license-info")
 async def license_info():
     """Получение информации о лицензии"""
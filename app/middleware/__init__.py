@@ -0,0 +1,7 @@
+from .admission import AdmissionControlMiddleware
+from .deadline import DeadlineMiddleware
+from .profiling import ProfilingMiddleware, profile_store
+from .query_stats import QueryStatsMiddleware
+from .tracing import TracingMiddleware
+
+__all__ = ["AdmissionControlMiddleware", "DeadlineMiddleware", "ProfilingMiddleware", "profile_store", "QueryStatsMiddleware", "TracingMiddleware"]
@@ -0,0 +1,193 @@
+"""
+Admission control and load shedding
+
+Every request is assigned a route class and each class has its own concurrency
+budget and bounded wait queue, so a storm of expensive cost queries cannot take
+all pool connections and threadpool workers away from cheap point reads.
+When a class is saturated and its queue is full, or a request has waited too
+long in the queue, the request is rejected right away with 503 and a
+Retry-After header instead of piling up behind the database pool.
+
+Route classes:
+    analytics - cost, report and analytics endpoints
+    read      - other GET/HEAD requests (point reads and lists)
+    write     - POST/PUT/PATCH/DELETE requests
+Health, metrics and documentation endpoints are never limited.
+"""
+import asyncio
+import os
+from collections import deque
+from typing import Dict, Tuple
+
+from dotenv import load_dotenv
+from starlette.responses import JSONResponse
+
+from app.utils.deadline import DEADLINE, DeadlineExceeded, current_deadline
+from app.utils.logger import get_logger
+from app.utils.metrics import metrics
+
+# Load environment variables
+load_dotenv()
+
+# Admission control configuration
+ADMISSION_CONTROL_ENABLED = os.getenv("ADMISSION_CONTROL_ENABLED", "False").lower() == "true"
+# class=concurrency:queue pairs
+ADMISSION_LIMITS = os.getenv("ADMISSION_LIMITS", "analytics=4:16,read=16:128,write=8:64")
+ADMISSION_QUEUE_TIMEOUT_MS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "1000"))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "1"))
+
+ANALYTICS_PATH_MARKERS = ("/cost", "/reports", "/analytics")
+UNLIMITED_PATHS = ("/", "/health", "/metrics", "/docs", "/redoc", "/openapi.json")
+# POST routes that only read (the request body carries their arguments)
+READ_POST_PATHS = ("/subscriptions/batch-get",)
+
+logger = get_logger(__name__)
+
+rejected_requests = metrics.counter(
+    "admission_rejected_total", "Requests rejected by admission control", ("route_class", "reason")
+)
+in_flight_requests = metrics.gauge(
+    "admission_in_flight", "Requests currently admitted", ("route_class",)
+)
+queued_requests = metrics.gauge(
+    "admission_queued", "Requests waiting for admission", ("route_class",)
+)
+
+
+def parse_limits(spec: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Parse "class=concurrency:queue,..." into {class: (concurrency, queue)}
+    """
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        route_class, values = item.split("=")
+        concurrency, queue = values.split(":")
+        limits[route_class.strip()] = (int(concurrency), int(queue))
+    return limits
+
+
+def route_class(method: str, path: str) -> str:
+    """Assign a request to a route class"""
+    if path in UNLIMITED_PATHS:
+        return "unlimited"
+    if any(marker in path for marker in ANALYTICS_PATH_MARKERS):
+        return "analytics"
+    if method in ("GET", "HEAD") or path in READ_POST_PATHS:
+        return "read"
+    return "write"
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be admitted"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class ConcurrencyLimiter:
+    """Concurrency limit with a bounded FIFO wait queue and queue timeout"""
+
+    def __init__(self, name: str, limit: int, queue_size: int, timeout: float):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self._waiters: deque = deque()
+
+    async def acquire(self):
+        """
+        Take a slot, waiting in the queue for at most the queue timeout, or
+        the time left to the request's deadline (DeadlineExceeded) if sooner
+        """
+        deadline = current_deadline()
+        if deadline is not None:
+            deadline.check()
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        if len(self._waiters) >= self.queue_size:
+            raise Overloaded("queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        queued_requests.set(len(self._waiters), route_class=self.name)
+        try:
+            # The releasing request hands its slot over by resolving the future
+            timeout = self.timeout if deadline is None else min(self.timeout, max(0.0, deadline.remaining()))
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except BaseException as e:
+            # Timed out, or the request was cancelled while queued (client
+            # gone, deadline passed): a waiter left behind would take a slot
+            # nobody releases
+            if waiter.done():
+                # Slot was handed over just as the wait ended: give it back
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                if deadline is not None and deadline.expired:
+                    raise DeadlineExceeded(deadline.reason or DEADLINE)
+                raise Overloaded("timeout")
+            raise
+        finally:
+            queued_requests.set(len(self._waiters), route_class=self.name)
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class AdmissionControlMiddleware:
+    """ASGI middleware enforcing per-route-class concurrency budgets"""
+
+    def __init__(
+        self,
+        app,
+        limits: str = ADMISSION_LIMITS,
+        queue_timeout_ms: float = ADMISSION_QUEUE_TIMEOUT_MS,
+        retry_after: int = ADMISSION_RETRY_AFTER_SECONDS
+    ):
+        self.app = app
+        self.retry_after = retry_after
+        self.limiters = {
+            name: ConcurrencyLimiter(name, concurrency, queue, queue_timeout_ms / 1000.0)
+            for name, (concurrency, queue) in parse_limits(limits).items()
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        name = route_class(scope["method"], scope["path"])
+        limiter = self.limiters.get(name)
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await limiter.acquire()
+        except Overloaded as e:
+            rejected_requests.inc(route_class=name, reason=e.reason)
+            logger.warning(f"Shedding {scope['method']} {scope['path']} ({name}: {e.reason})")
+            response = JSONResponse(
+                {"detail": "Service is overloaded, retry later"},
+                status_code=503,
+                headers={"Retry-After": str(self.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+
+        in_flight_requests.inc(route_class=name)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            in_flight_requests.dec(route_class=name)
+            limiter.release()
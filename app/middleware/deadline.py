@@ -0,0 +1,111 @@
+"""
+Per-request deadlines
+
+Starts each request's deadline (see app.utils.deadline) and ends the request
+with 504 when it passes. The deadline counts from arrival, so time spent
+waiting for admission counts too. Client disconnects are noticed while the
+request runs: its statements are cancelled rather than left to finish for
+nobody.
+"""
+import asyncio
+import time
+from typing import Optional
+
+from starlette.responses import JSONResponse
+
+from app.middleware.admission import route_class
+from app.utils.deadline import (
+    CLIENT_DISCONNECT,
+    DEADLINE,
+    REQUEST_DEADLINES,
+    Deadline,
+    DeadlineExceeded,
+    parse_deadlines,
+    parse_request_timeout,
+    reset_deadline,
+    set_deadline,
+    timed_out_requests
+)
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class DeadlineMiddleware:
+    """ASGI middleware enforcing request deadlines per route class"""
+
+    def __init__(self, app, deadlines: str = REQUEST_DEADLINES):
+        self.app = app
+        self.deadlines = parse_deadlines(deadlines)
+
+    def timeout_for(self, name: str, requested: Optional[float]) -> Optional[float]:
+        """Seconds the request may take: the client may shorten its class deadline, not extend it"""
+        configured = self.deadlines.get(name)
+        if requested is None:
+            return configured
+        return requested if configured is None else min(configured, requested)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        name = route_class(scope["method"], scope["path"])
+        header = next((value for key, value in scope["headers"] if key == b"x-request-timeout"), None)
+        timeout = self.timeout_for(name, parse_request_timeout(header.decode("latin-1") if header else None))
+        if name == "unlimited" or timeout is None:
+            await self.app(scope, receive, send)
+            return
+
+        deadline = Deadline(timeout)
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        response_started = False
+        response_finished = False
+
+        def cancel(reason: str):
+            # cancel() waits on the database, so it runs off the event loop
+            return loop.run_in_executor(None, deadline.cancel, reason)
+
+        timer = loop.call_later(timeout, cancel, DEADLINE)
+
+        # Read request messages ahead of the app, so a disconnect is seen
+        # while the route is still busy
+        messages: asyncio.Queue = asyncio.Queue()
+
+        async def listen():
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    if not response_finished:
+                        await cancel(CLIENT_DISCONNECT)
+                    return
+
+        async def send_wrapper(message):
+            nonlocal response_started, response_finished
+            if message["type"] == "http.response.start":
+                response_started = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_finished = True
+            await send(message)
+
+        listener = asyncio.ensure_future(listen())
+        token = set_deadline(deadline)
+        try:
+            await self.app(scope, messages.get, send_wrapper)
+        except DeadlineExceeded as e:
+            reason = deadline.reason or e.reason
+            timed_out_requests.inc(route_class=name, reason=reason)
+            logger.warning(
+                f"{scope['method']} {scope['path']} ended after {(time.perf_counter() - started) * 1000:.0f}ms "
+                f"({reason}, deadline {timeout * 1000:.0f}ms)"
+            )
+            if response_started:
+                raise
+            response = JSONResponse({"detail": "Request deadline exceeded"}, status_code=504)
+            await response(scope, receive, send)
+        finally:
+            reset_deadline(token)
+            timer.cancel()
+            listener.cancel()
@@ -0,0 +1,270 @@
+"""
+On-demand request profiling
+
+A request is profiled when it carries the X-Profile header with the configured
+secret, or when it is picked by the sampling rate. While it runs, a sampler
+thread records the Python stacks of every thread serving requests (sync routes
+run in the threadpool, not on the event loop thread), and the result is stored
+as a JSON profile in a bounded directory that keeps only the newest files.
+
+Each profile contains the time split across validation, SQLAlchemy,
+serialization and logging, the hottest functions, and collapsed stacks that
+can be loaded into speedscope or flamegraph.pl. Requests that run concurrently
+with a profiled one show up in its samples as well, so profiles are most
+useful when taken on a quiet instance or for an isolated slow request.
+
+The middleware is only installed when PROFILING_ENABLED is true, so there is
+no overhead when it is off.
+"""
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
+
+from app.utils.logger import get_logger
+
+# Load environment variables
+load_dotenv()
+
+# Profiling configuration
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "False").lower() == "true"
+PROFILING_SECRET = os.getenv("PROFILING_SECRET", "")
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", "1"))
+PROFILING_DIR = os.getenv("PROFILING_DIR", "profiles")
+PROFILING_MAX_FILES = int(os.getenv("PROFILING_MAX_FILES", "50"))
+
+PROFILE_HEADER = b"x-profile"
+
+logger = get_logger(__name__)
+
+# Path fragments identifying which layer a frame belongs to
+_CATEGORY_MARKERS = (
+    ("logging", ("/logging/",)),
+    ("sqlalchemy", ("/sqlalchemy/", "/psycopg2/")),
+    ("serialization", ("/fastapi/encoders.py", "/json/", "/starlette/responses.py")),
+    ("validation", ("/pydantic/", "/pydantic_core/", "/fastapi/dependencies/")),
+)
+
+# Stacks without any of these frames belong to idle threads
+_REQUEST_MARKERS = ("/starlette/", "/fastapi/", "/app/")
+
+# Stacks whose innermost frame is here are blocked waiting, not doing work
+_IDLE_LEAF_FILES = ("/threading.py", "/selectors.py", "/queue.py")
+
+_SAFE_NAME = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _categorize(filenames: List[str], functions: List[str]) -> str:
+    """Attribute a sample (leaf first) to the innermost layer it is running in"""
+    if "serialize_response" in functions:
+        # pydantic frames under serialize_response are response serialization
+        for filename in filenames:
+            if "/logging/" in filename:
+                return "logging"
+            if "/sqlalchemy/" in filename:
+                return "sqlalchemy"
+        return "serialization"
+
+    for filename in filenames:
+        for category, markers in _CATEGORY_MARKERS:
+            if any(marker in filename for marker in markers):
+                return category
+    return "other"
+
+
+class StackSampler:
+    """Periodically sample the stacks of all threads that are serving requests"""
+
+    def __init__(self, interval_ms: float = PROFILING_INTERVAL_MS):
+        self.interval = interval_ms / 1000.0
+        self.stacks: Counter = Counter()
+        self.categories: Counter = Counter()
+        self.self_samples: Counter = Counter()
+        self.total = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self._record(frame)
+
+    def _record(self, frame):
+        labels, filenames, functions = [], [], []
+        while frame is not None:
+            labels.append(_frame_label(frame))
+            filenames.append(frame.f_code.co_filename.replace(os.sep, "/"))
+            functions.append(frame.f_code.co_name)
+            frame = frame.f_back
+
+        if filenames[0].endswith(_IDLE_LEAF_FILES):
+            return
+        if not any(marker in f for f in filenames for marker in _REQUEST_MARKERS):
+            return
+
+        self.total += 1
+        self.stacks[";".join(reversed(labels))] += 1
+        self.self_samples[labels[0]] += 1
+        self.categories[_categorize(filenames, functions)] += 1
+
+
+class ProfileStore:
+    """Bounded on-disk ring buffer of request profiles"""
+
+    def __init__(self, directory: str = PROFILING_DIR, max_files: int = PROFILING_MAX_FILES):
+        self.directory = directory
+        self.max_files = max(1, max_files)
+        self._lock = threading.Lock()
+
+    def new_name(self, method: str, path: str) -> str:
+        slug = _SAFE_NAME.sub("_", path.strip("/")) or "root"
+        # The random part keeps profiles of the same path in the same millisecond apart
+        return f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}-{method.lower()}-{slug[:60]}.json"
+
+    def save(self, name: str, profile: Dict):
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, name), "w") as f:
+                json.dump(profile, f)
+
+            # Drop the oldest profiles beyond the ring size
+            names = sorted(self._names())
+            for old in names[:-self.max_files]:
+                os.remove(os.path.join(self.directory, old))
+
+    def list(self) -> List[Dict]:
+        profiles = []
+        for name in sorted(self._names(), reverse=True):
+            full_path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(full_path)
+            except FileNotFoundError:
+                continue
+            profiles.append({"name": name, "size": stat.st_size})
+        return profiles
+
+    def path(self, name: str) -> Optional[str]:
+        """Resolve a profile name to its file, refusing anything outside the store"""
+        if name != os.path.basename(name) or name not in self._names():
+            return None
+        return os.path.join(self.directory, name)
+
+    def _names(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return [n for n in os.listdir(self.directory) if n.endswith(".json")]
+
+
+profile_store = ProfileStore()
+
+
+def build_profile(sampler: StackSampler, meta: Dict, top: int = 30) -> Dict:
+    """Turn raw samples into the stored profile document"""
+    interval_ms = sampler.interval * 1000
+    total = sampler.total or 1
+
+    categories = {
+        category: {
+            "samples": count,
+            "ms": round(count * interval_ms, 2),
+            "percent": round(100.0 * count / total, 1)
+        }
+        for category, count in sampler.categories.most_common()
+    }
+    hottest = [
+        {"function": label, "samples": count, "percent": round(100.0 * count / total, 1)}
+        for label, count in sampler.self_samples.most_common(top)
+    ]
+
+    return {
+        **meta,
+        "interval_ms": interval_ms,
+        "samples": sampler.total,
+        "categories": categories,
+        "hottest": hottest,
+        "collapsed": [f"{stack} {count}" for stack, count in sampler.stacks.most_common()]
+    }
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling requests selected by header or sampling rate"""
+
+    def __init__(
+        self,
+        app,
+        secret: str = PROFILING_SECRET,
+        sample_rate: float = PROFILING_SAMPLE_RATE,
+        store: ProfileStore = profile_store
+    ):
+        self.app = app
+        self.secret = secret.encode()
+        self.sample_rate = sample_rate
+        self.store = store
+
+    def _selected(self, scope) -> bool:
+        if self.secret:
+            for key, value in scope.get("headers", []):
+                if key == PROFILE_HEADER and hmac.compare_digest(value, self.secret):
+                    return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._selected(scope):
+            await self.app(scope, receive, send)
+            return
+
+        name = self.store.new_name(scope["method"], scope["path"])
+        status: List[int] = []
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", name.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        sampler = StackSampler()
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Joining the sampler thread would block the event loop
+            await run_in_threadpool(sampler.stop)
+            duration_ms = (time.perf_counter() - started) * 1000
+            profile = build_profile(sampler, {
+                "method": scope["method"],
+                "path": scope["path"],
+                "query": scope.get("query_string", b"").decode(errors="replace"),
+                "status": status[0] if status else None,
+                "duration_ms": round(duration_ms, 2),
+                "created_at": time.time()
+            })
+            await run_in_threadpool(self.store.save, name, profile)
+            logger.info(f"Profiled {scope['method']} {scope['path']} in {duration_ms:.1f}ms: {name}")
@@ -0,0 +1,43 @@
+import os
+
+from dotenv import load_dotenv
+
+from app.database.instrumentation import finish_request_stats, start_request_stats
+
+# Load environment variables
+load_dotenv()
+
+# Expose per-request query stats as response headers in debug mode
+QUERY_STATS_HEADERS = os.getenv("DEBUG", "True").lower() == "true"
+
+
+class QueryStatsMiddleware:
+    """
+    ASGI middleware collecting SQL statement counts and database time per request
+
+    With headers enabled, responses carry X-DB-Query-Count and X-DB-Time-Ms.
+    """
+
+    def __init__(self, app, headers: bool = QUERY_STATS_HEADERS):
+        self.app = app
+        self.headers = headers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats, token = start_request_stats()
+
+        async def send_wrapper(message):
+            if self.headers and message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-db-query-count", str(stats.count).encode()))
+                headers.append((b"x-db-time-ms", f"{stats.total_ms:.2f}".encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            finish_request_stats(token, f"{scope['method']} {scope['path']}")
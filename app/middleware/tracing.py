@@ -0,0 +1,112 @@
+"""
+Request tracing middleware
+
+Every request gets a root span, continuing the trace of an incoming W3C
+traceparent header; the response carries a traceparent naming that span so
+callers can find it. instrument_request_phases() adds child spans for the
+phases FastAPI runs for each route: request validation (dependency solving,
+including body and query parsing by pydantic), the handler itself and
+response serialization. SQL statements get their spans from the engine hooks
+in app.database.instrumentation.
+
+The middleware is only installed when TRACING_ENABLED is true.
+"""
+from typing import Optional
+
+import fastapi.routing
+
+from app.utils.tracing import (
+    SpanExporter,
+    TRACING_SAMPLE_RATE,
+    activate,
+    deactivate,
+    span,
+    start_root_span
+)
+
+TRACEPARENT_HEADER = b"traceparent"
+
+_instrumented = False
+
+
+def _traced(name: str, call):
+    async def wrapper(*args, **kwargs):
+        with span(name):
+            return await call(*args, **kwargs)
+    return wrapper
+
+
+def instrument_request_phases():
+    """
+    Wrap FastAPI's per-request phases in spans
+
+    The request handler looks these functions up in fastapi.routing on every
+    call, so replacing them there covers every route. Outside a sampled trace
+    the wrappers only cost a context variable lookup.
+    """
+    global _instrumented
+    if _instrumented:
+        return
+    fastapi.routing.solve_dependencies = _traced("validate request", fastapi.routing.solve_dependencies)
+    fastapi.routing.run_endpoint_function = _traced("handler", fastapi.routing.run_endpoint_function)
+    fastapi.routing.serialize_response = _traced("serialize response", fastapi.routing.serialize_response)
+    _instrumented = True
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware starting the root span of each request
+
+    Args:
+        sample_rate: Share of requests without a traceparent that are traced
+        exporter: Where finished spans go (the shared exporter by default)
+    """
+
+    def __init__(self, app, sample_rate: float = TRACING_SAMPLE_RATE, exporter: Optional[SpanExporter] = None):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+        instrument_request_phases()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope.get("headers", [])).get(TRACEPARENT_HEADER)
+        root, traceparent = start_root_span(
+            f"{scope['method']} {scope['path']}",
+            incoming.decode("latin-1") if incoming else None,
+            self.sample_rate,
+            {"http.method": scope["method"], "http.target": scope["path"], "http.scheme": scope.get("scheme", "http")},
+            self.exporter
+        )
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                if root is not None:
+                    root.set_attribute("http.status_code", message["status"])
+                    if message["status"] >= 500:
+                        root.set_error(f"HTTP {message['status']}")
+                headers = list(message.get("headers", []))
+                headers.append((TRACEPARENT_HEADER, traceparent.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        if root is None:
+            await self.app(scope, receive, send_wrapper)
+            return
+
+        token = activate(root)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            root.set_error(e)
+            raise
+        finally:
+            deactivate(token)
+            route = scope.get("route")
+            if route is not None and hasattr(route, "path"):
+                root.name = f"{scope['method']} {route.path}"
+                root.set_attribute("http.route", route.path)
+            root.end()
@@ -1,3 +1,3 @@
-from .subscription import Subscription
+from .subscription import ChangeFeedHorizon, Service, Subscription, SubscriptionArchive, SubscriptionChange
 
-__all__ = ["Subscription"]
\ No newline at end of file
+__all__ = ["ChangeFeedHorizon", "Service", "Subscription", "SubscriptionArchive", "SubscriptionChange"]
@@ -1,26 +1,146 @@
-from sqlalchemy import Column, Integer, String, Date, DateTime, Index
+from sqlalchemy import BigInteger, Column, DDL, ForeignKey, Integer, String, Date, DateTime, Index, event, func
 from sqlalchemy.dialects.postgresql import UUID
 from datetime import datetime
 from app.database.session import Base
 import uuid
 
 
+class Service(Base):
+    """
+    Dimension table of service names
+
+    Subscriptions reference services by integer id; the API still speaks names
+    and the repository maps between the two.
+    """
+    __tablename__ = "services"
+    
+    id = Column(Integer, primary_key=True)
+    name = Column(String(255), nullable=False, unique=True)
+
+
 class Subscription(Base):
     __tablename__ = "subscriptions"
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    service_name = Column(String(255), nullable=False, index=True)
+    service_id = Column(Integer, ForeignKey("services.id"), nullable=False)
     price = Column(Integer, nullable=False)  # Цена в рублях
-    user_id = Column(UUID(as_uuid=True), nullable=False, index=True)
+    user_id = Column(UUID(as_uuid=True), nullable=False)
     start_date = Column(Date, nullable=False)  # Формат MM-YYYY будет преобразован в Date
     end_date = Column(Date, nullable=True)  # Опциональная дата окончания
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = Column(Integer, nullable=False, server_default="1")  # Растет при каждом изменении (ETag)
+    
+    # Индексы для оптимизации запросов: каждая сортировка списка (см.
+    # LIST_SORTS в репозитории) отдается индексом (колонка, id), а с фильтром
+    # по пользователю - индексом (user_id, колонка, id), без сортировки в памяти
+    __table_args__ = (
+        Index('idx_subscriptions_user_created_at', 'user_id', 'created_at', 'id'),
+        Index('idx_subscriptions_user_start_date', 'user_id', 'start_date', 'id'),
+        Index('idx_subscriptions_user_end_date', 'user_id', 'end_date', 'id'),
+        Index('idx_subscriptions_service_id', 'service_id'),
+        Index('idx_subscriptions_created_at', 'created_at', 'id'),
+        Index('idx_subscriptions_start_date_id', 'start_date', 'id'),
+        Index('idx_subscriptions_end_date_id', 'end_date', 'id'),
+        Index('idx_subscriptions_updated_at', 'updated_at'),
+    )
+
+
+class SubscriptionArchive(Base):
+    """
+    Cold storage for subscriptions that ended before the retention window
+
+    Same columns as subscriptions; rows are moved here in batches by
+    app.jobs.archive and read only by queries reaching back that far.
+    """
+    __tablename__ = "subscriptions_archive"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True)
+    service_id = Column(Integer, ForeignKey("services.id"), nullable=False)
+    price = Column(Integer, nullable=False)
+    user_id = Column(UUID(as_uuid=True), nullable=False)
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date, nullable=False)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    version = Column(Integer, nullable=False, server_default="1")
+    archived_at = Column(DateTime, nullable=False, server_default=func.now())
+    
+    __table_args__ = (
+        Index('idx_subscriptions_archive_user_id', 'user_id'),
+        Index('idx_subscriptions_archive_end_date', 'end_date'),
+    )
+
+
+class SubscriptionChange(Base):
+    """
+    Change log of the subscriptions table, maintained by a trigger
+
+    Every insert and update leaves an 'upsert' entry and every delete a
+    'delete' tombstone. txid is the writing transaction's id; reading changes
+    in (txid, seq) order only up to the oldest running transaction guarantees
+    that no change can later appear behind a consumer's cursor.
+    """
+    __tablename__ = "subscription_changes"
+    
+    seq = Column(BigInteger, primary_key=True, autoincrement=True)
+    txid = Column(BigInteger, nullable=False)
+    subscription_id = Column(UUID(as_uuid=True), nullable=False)
+    operation = Column(String(6), nullable=False)  # upsert | delete
+    changed_at = Column(DateTime, nullable=False, server_default=func.now())
     
-    # Индексы для оптимизации запросов
     __table_args__ = (
-        Index('idx_subscriptions_user_id', 'user_id'),
-        Index('idx_subscriptions_service_name', 'service_name'),
-        Index('idx_subscriptions_start_date', 'start_date'),
-        Index('idx_subscriptions_end_date', 'end_date'),
-    )
\ No newline at end of file
+        Index('idx_subscription_changes_cursor', 'txid', 'seq'),
+        # Finds later entries of a subscription when the feed is compacted
+        Index('idx_subscription_changes_subscription', 'subscription_id', 'txid', 'seq'),
+    )
+
+
+class ChangeFeedHorizon(Base):
+    """
+    Oldest change feed position a cursor may still read from (a single row)
+
+    Compaction (app.jobs.change_feed) deletes tombstones older than the
+    retention period; a cursor before the newest deleted one could miss a
+    delete, so reading from it is refused.
+    """
+    __tablename__ = "subscription_changes_horizon"
+    
+    id = Column(Integer, primary_key=True)  # Всегда 1
+    txid = Column(BigInteger, nullable=False)
+    seq = Column(BigInteger, nullable=False)
+
+
+# Trigger feeding subscription_changes (see migrations/004_create_subscription_changes.sql
+# and 005_create_subscriptions_archive.sql)
+event.listen(Subscription.__table__, "after_create", DDL("""
+CREATE OR REPLACE FUNCTION record_subscription_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- Set by the archiving job: moving rows to the archive is not a change
+    IF current_setting('app.skip_change_feed', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO subscription_changes (txid, subscription_id, operation)
+        VALUES (pg_current_xact_id()::text::bigint, OLD.id, 'delete');
+    ELSE
+        INSERT INTO subscription_changes (txid, subscription_id, operation)
+        VALUES (pg_current_xact_id()::text::bigint, NEW.id, 'upsert');
+    END IF;
+    RETURN NULL;
+END;
+$$ language 'plpgsql'
+"""))
+event.listen(Subscription.__table__, "after_create", DDL("""
+CREATE TRIGGER subscriptions_change_feed
+    AFTER INSERT OR UPDATE OR DELETE ON subscriptions
+    FOR EACH ROW
+    EXECUTE FUNCTION record_subscription_change()
+"""))
+event.listen(SubscriptionArchive.__table__, "after_create", DDL("""
+CREATE TRIGGER subscriptions_archive_change_feed
+    AFTER DELETE ON subscriptions_archive
+    FOR EACH ROW
+    EXECUTE FUNCTION record_subscription_change()
+"""))
@@ -0,0 +1,3 @@
+from . import subscription as subscription_repository
+
+__all__ = ["subscription_repository"]
@@ -0,0 +1,990 @@
+"""
+Subscription repository
+
+All SQL touching the subscriptions table (and its archive) lives here. Writes are single
+INSERT/UPDATE/DELETE ... RETURNING statements, so every CRUD call costs one
+round trip and no follow-up SELECT or refresh. Statements are built once from
+bind parameters and reused, which lets SQLAlchemy serve them from its compiled
+statement cache.
+
+Every update increments a row's version, so a writer that read version v can
+make its write conditional on the row still being at v (optimistic
+concurrency): a conflicting write is detected by the UPDATE itself and no row
+lock is held between the read and the write.
+
+Rows store an integer service_id referencing the services dimension table,
+while callers read and write service names: reads join the name in, writes
+look the id up inside the INSERT/UPDATE itself.
+"""
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+import uuid
+
+from sqlalchemy import (
+    and_,
+    any_,
+    bindparam,
+    delete,
+    exists,
+    func,
+    insert,
+    Integer,
+    String,
+    literal_column,
+    or_,
+    select,
+    tuple_,
+    union_all,
+    update
+)
+from sqlalchemy.dialects.postgresql import ARRAY, UUID, insert as pg_insert
+from sqlalchemy.engine import Row
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+
+from app.models.subscription import ChangeFeedHorizon, Service, Subscription, SubscriptionArchive, SubscriptionChange
+
+subscriptions = Subscription.__table__
+archive = SubscriptionArchive.__table__
+changes = SubscriptionChange.__table__
+horizons = ChangeFeedHorizon.__table__
+services = Service.__table__
+
+# Archive columns in the order of the subscriptions table
+_ARCHIVE_ROW = [archive.c[column.name] for column in subscriptions.c]
+_COLUMN_NAMES = [column.name for column in subscriptions.c]
+
+# Hot and archived rows together, for reads reaching back past the archive boundary
+_ALL = union_all(select(*subscriptions.c), select(*_ARCHIVE_ROW)).subquery("subscriptions_all")
+
+# Columns that may be changed through update_fields()
+UPDATABLE_FIELDS = ("service_name", "price", "start_date", "end_date")
+
+# Sort columns of list_filtered() ("-column" for descending order). Each has
+# indexes on (column, id) and (user_id, column, id), so lists come out of an
+# index scan in order whatever the filters.
+LIST_SORTS = ("created_at", "start_date", "end_date")
+
+_SERVICE_NAME = services.c.name.label("service_name")
+
+
+class VersionConflict(Exception):
+    """Raised when a conditional write finds the row at a different version"""
+
+    def __init__(self, subscription_id: uuid.UUID, version: int):
+        super().__init__(f"Subscription {subscription_id} is at version {version}")
+        self.subscription_id = subscription_id
+        self.version = version
+
+
+class CursorExpired(Exception):
+    """Raised when a change feed cursor is older than what compaction has kept"""
+
+    def __init__(self, horizon: Tuple[int, int]):
+        super().__init__(f"Change feed cursor is before the horizon {horizon[0]}.{horizon[1]}")
+        self.horizon = horizon
+
+
+def _row_columns(source, service_name) -> list:
+    """Columns of a subscriptions-shaped source with service_id replaced by the name"""
+    return [service_name if name == "service_id" else source.c[name] for name in _COLUMN_NAMES]
+
+
+def _named_rows(source):
+    """SELECT of whole rows with the service name joined in"""
+    return select(*_row_columns(source, _SERVICE_NAME)).select_from(
+        source.join(services, services.c.id == source.c.service_id)
+    )
+
+
+def _service_id(name_param: str):
+    """Id of the service named by a bind parameter (NULL if it does not exist)"""
+    return select(services.c.id).where(services.c.name == bindparam(name_param)).scalar_subquery()
+
+
+# RETURNING cannot join, so written rows look their service name up (spelled
+# out because SQLAlchemy does not correlate subqueries in INSERT ... RETURNING)
+_RETURNED = _row_columns(
+    subscriptions,
+    literal_column(
+        "(SELECT services.name FROM services WHERE services.id = subscriptions.service_id)"
+    ).label("service_name")
+)
+
+_ENSURE_SERVICES = (
+    pg_insert(services)
+    .from_select(["name"], select(func.unnest(bindparam("names", type_=ARRAY(String)))))
+    .on_conflict_do_nothing(index_elements=["name"])
+)
+
+# SQLSTATE of the error a write naming an unknown service fails with
+NOT_NULL_VIOLATION = "23502"
+
+# Service names known to exist, per database; writes naming only these skip _ENSURE_SERVICES
+_known_services: Dict[str, set] = {}
+
+_INSERT = insert(subscriptions).values(service_id=_service_id("service_name")).returning(*_RETURNED)
+
+_COPY_IN = (
+    pg_insert(subscriptions)
+    .values(service_id=_service_id("service_name"))
+    .on_conflict_do_nothing(index_elements=["id"])
+)
+
+_GET = _named_rows(subscriptions).where(subscriptions.c.id == bindparam("subscription_id"))
+
+_DELETE = (
+    delete(subscriptions)
+    .where(subscriptions.c.id == bindparam("subscription_id"))
+    .returning(subscriptions.c.id)
+)
+
+_VERSION = select(subscriptions.c.version).where(subscriptions.c.id == bindparam("subscription_id"))
+
+_GET_ARCHIVED = _named_rows(archive).where(archive.c.id == bindparam("subscription_id"))
+
+_DELETE_ARCHIVED = (
+    delete(archive)
+    .where(archive.c.id == bindparam("subscription_id"))
+    .returning(archive.c.id)
+)
+
+# Point lookups of many ids bind one array parameter: a single statement
+# (and a single cached plan) however many ids there are
+_IDS = bindparam("subscription_ids", type_=ARRAY(UUID(as_uuid=True)))
+_GET_MANY = _named_rows(subscriptions).where(subscriptions.c.id == any_(_IDS))
+_GET_MANY_ARCHIVED = _named_rows(archive).where(archive.c.id == any_(_IDS))
+
+_ARCHIVED_VERSION = select(archive.c.version).where(archive.c.id == bindparam("subscription_id"))
+
+# Conditional deletes: only while the row is at one of the expected versions
+_VERSIONS = bindparam("versions", type_=ARRAY(Integer))
+_DELETE_IF_VERSION = _DELETE.where(subscriptions.c.version == any_(_VERSIONS))
+_DELETE_ARCHIVED_IF_VERSION = _DELETE_ARCHIVED.where(archive.c.version == any_(_VERSIONS))
+
+# Move one archived row back into the hot table
+_UNARCHIVED = (
+    delete(archive)
+    .where(archive.c.id == bindparam("subscription_id"))
+    .returning(*_ARCHIVE_ROW)
+    .cte("unarchived")
+)
+_UNARCHIVE = (
+    insert(subscriptions)
+    .from_select(_COLUMN_NAMES, select(*_UNARCHIVED.c))
+    .add_cte(_UNARCHIVED)
+    .returning(subscriptions.c.id)
+)
+
+
+# Transactions below this id have all finished, so their changes are final
+_SNAPSHOT_XMIN = literal_column("pg_snapshot_xmin(pg_current_snapshot())::text::bigint")
+
+# Archived subscriptions still exist, so they are looked up in the archive too
+_CHANGES = (
+    select(changes.c.txid, changes.c.seq, changes.c.subscription_id, *_row_columns(_ALL, _SERVICE_NAME))
+    .select_from(
+        changes
+        .outerjoin(_ALL, _ALL.c.id == changes.c.subscription_id)
+        .outerjoin(services, services.c.id == _ALL.c.service_id)
+    )
+    .where(tuple_(changes.c.txid, changes.c.seq) > tuple_(bindparam("txid"), bindparam("seq")))
+    .where(changes.c.txid < _SNAPSHOT_XMIN)
+    .order_by(changes.c.txid, changes.c.seq)
+    .limit(bindparam("limit"))
+)
+
+
+_HORIZON = select(horizons.c.txid, horizons.c.seq).where(horizons.c.id == 1)
+
+_CHANGE_WINDOW = (
+    select(changes.c.seq, changes.c.changed_at)
+    .where(changes.c.seq > bindparam("after_seq"))
+    .order_by(changes.c.seq)
+    .limit(bindparam("batch_rows"))
+)
+
+# The feed returns current rows, so an entry followed by a later one of the
+# same subscription adds nothing; tombstones go once they are old enough
+_later = changes.alias("later")
+_COMPACT_CHANGES = (
+    delete(changes)
+    .where(changes.c.seq > bindparam("after_seq"), changes.c.seq <= bindparam("last_seq"))
+    .where(changes.c.changed_at < bindparam("cutoff"))
+    .where(or_(
+        changes.c.operation == "delete",
+        exists().where(
+            _later.c.subscription_id == changes.c.subscription_id,
+            tuple_(_later.c.txid, _later.c.seq) > tuple_(changes.c.txid, changes.c.seq)
+        )
+    ))
+    .returning(changes.c.txid, changes.c.seq, changes.c.operation)
+)
+
+_raise_horizon = pg_insert(horizons).values(id=1, txid=bindparam("txid"), seq=bindparam("seq"))
+_RAISE_HORIZON = _raise_horizon.on_conflict_do_update(
+    index_elements=[horizons.c.id],
+    set_={"txid": _raise_horizon.excluded.txid, "seq": _raise_horizon.excluded.seq},
+    where=tuple_(horizons.c.txid, horizons.c.seq) < tuple_(_raise_horizon.excluded.txid, _raise_horizon.excluded.seq)
+)
+
+
+def _new_values(fields: Tuple[str, ...]) -> Dict[str, Any]:
+    """SET clause of an update of the given columns, bumping the row version"""
+    values = {
+        field: bindparam(f"new_{field}") for field in fields if field != "service_name"
+    }
+    if "service_name" in fields:
+        values["service_id"] = _service_id("new_service_name")
+    values["version"] = subscriptions.c.version + 1
+    return values
+
+
+@lru_cache(maxsize=None)
+def _update_statement(fields: Tuple[str, ...], conditional: bool = False):
+    """
+    Build (once per set of changed columns) an UPDATE ... RETURNING statement
+
+    A conditional statement only matches the row while its version is one of
+    the "versions" parameter.
+    """
+    statement = (
+        update(subscriptions)
+        .where(subscriptions.c.id == bindparam("subscription_id"))
+        .values(_new_values(fields))
+        .returning(*_RETURNED)
+    )
+    if conditional:
+        statement = statement.where(subscriptions.c.version == any_(_VERSIONS))
+    return statement
+
+
+UserRange = Tuple[Optional[uuid.UUID], Optional[uuid.UUID]]
+
+
+def _source(include_archive: bool):
+    """Rows to read from: the hot table, or the hot table plus the archive"""
+    return _ALL if include_archive else subscriptions
+
+
+def _contains(name: str) -> str:
+    """ILIKE pattern matching name as a literal substring (its %, _ and \\ escaped)"""
+    escaped = name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _filter_conditions(
+    source,
+    user_id: Optional[uuid.UUID],
+    service_name: Optional[str],
+    user_range: Optional[UserRange] = None
+) -> list:
+    conditions = []
+    if user_id:
+        conditions.append(source.c.user_id == user_id)
+    if service_name:
+        # Match names in the small services table, then filter rows by integer id
+        conditions.append(source.c.service_id.in_(
+            select(services.c.id).where(services.c.name.ilike(_contains(service_name), escape="\\"))
+        ))
+    if user_range:
+        # Half-open [low, high) range of user ids, None meaning unbounded
+        low, high = user_range
+        if low is not None:
+            conditions.append(source.c.user_id >= low)
+        if high is not None:
+            conditions.append(source.c.user_id < high)
+    return conditions
+
+
+def _apply_filters(
+    query,
+    source,
+    user_id: Optional[uuid.UUID],
+    service_name: Optional[str],
+    user_range: Optional[UserRange] = None
+):
+    conditions = _filter_conditions(source, user_id, service_name, user_range)
+    return query.where(*conditions) if conditions else query
+
+
+def user_ranges(shards: int) -> List[UserRange]:
+    """
+    Split the UUID space into equal half-open ranges
+
+    PostgreSQL orders uuid values bytewise, which matches the order of their
+    128-bit integer values.
+    """
+    bounds = [uuid.UUID(int=(i << 128) // shards) for i in range(1, shards)]
+    lows = [None] + bounds
+    highs = bounds + [None]
+    return list(zip(lows, highs))
+
+
+def _active_conditions(source, active_from: Optional[date], active_to: Optional[date]) -> list:
+    """Subscriptions overlapping [active_from, active_to], either bound optional"""
+    conditions = []
+    if active_from:
+        conditions.append(or_(source.c.end_date >= active_from, source.c.end_date.is_(None)))
+    if active_to:
+        conditions.append(source.c.start_date <= active_to)
+    return conditions
+
+
+def _overlaps(source, start_date: date, end_date: date):
+    return and_(
+        source.c.start_date <= end_date,
+        or_(source.c.end_date >= start_date, source.c.end_date.is_(None))
+    )
+
+
+def _is_missing_service(error: IntegrityError) -> bool:
+    """Whether a write failed on a NULL service_id, i.e. on a service name that does not exist"""
+    orig = error.orig
+    diag = getattr(orig, "diag", None)
+    return getattr(orig, "pgcode", None) == NOT_NULL_VIOLATION and getattr(diag, "column_name", None) == "service_id"
+
+
+def _write(db: Session, names, run):
+    """
+    Run a write naming services and commit it
+
+    Names not known to exist are added to services first (usually a no-op
+    INSERT ... ON CONFLICT). A name wrongly believed to exist, because the
+    services table was emptied, maps to NULL and fails the write, which is
+    then retried once after adding every name. Other integrity errors (a
+    duplicate id, a check constraint) are raised right away.
+    """
+    known = _known_services.setdefault(str(db.get_bind().url), set())
+    names = set(names)
+    if names - known:
+        db.execute(_ENSURE_SERVICES, {"names": sorted(names - known)})
+    try:
+        result = run()
+    except IntegrityError as e:
+        db.rollback()
+        if not names or not _is_missing_service(e):
+            raise
+        known.clear()
+        db.execute(_ENSURE_SERVICES, {"names": sorted(names)})
+        result = run()
+    db.commit()
+    known.update(names)
+    return result
+
+
+def create(db: Session, values: Dict[str, Any]) -> Row:
+    """Insert a subscription and return the stored row"""
+    return _write(db, [values["service_name"]], lambda: db.execute(_INSERT, values).one())
+
+
+def create_many(db: Session, rows: List[Dict[str, Any]]) -> List[Row]:
+    """Insert several subscriptions in one multi-row INSERT ... RETURNING"""
+    return _write(db, [row["service_name"] for row in rows], lambda: db.execute(_INSERT, rows).all())
+
+
+def get(db: Session, subscription_id: uuid.UUID) -> Optional[Row]:
+    """Fetch a subscription by id, looking into the archive only on a miss"""
+    params = {"subscription_id": subscription_id}
+    row = db.execute(_GET, params).one_or_none()
+    if row is None:
+        row = db.execute(_GET_ARCHIVED, params).one_or_none()
+    return row
+
+
+def get_many(db: Session, subscription_ids: List[uuid.UUID]) -> List[Row]:
+    """
+    Fetch the subscriptions with the given ids, in no particular order
+
+    Ids not in the hot table are looked up in the archive with a second
+    query, made only when some are missing.
+    """
+    rows = db.execute(_GET_MANY, {"subscription_ids": subscription_ids}).all()
+    if len(rows) < len(set(subscription_ids)):
+        found = {row.id for row in rows}
+        missing = [subscription_id for subscription_id in subscription_ids if subscription_id not in found]
+        rows += db.execute(_GET_MANY_ARCHIVED, {"subscription_ids": missing}).all()
+    return rows
+
+
+def _check_version(db: Session, subscription_id: uuid.UUID, versions: List[int]) -> None:
+    """
+    Explain why a conditional write matched no row
+
+    Raises VersionConflict if the subscription exists (at another version);
+    returns quietly if it does not.
+    """
+    params = {"subscription_id": subscription_id}
+    version = db.execute(_VERSION, params).scalar_one_or_none()
+    if version is None:
+        version = db.execute(_ARCHIVED_VERSION, params).scalar_one_or_none()
+    if version is not None and version not in versions:
+        raise VersionConflict(subscription_id, version)
+
+
+def update_fields(
+    db: Session,
+    subscription_id: uuid.UUID,
+    values: Dict[str, Any],
+    versions: Optional[List[int]] = None
+) -> Optional[Row]:
+    """
+    Update the given columns and return the new row, or None if it does not exist
+
+    updated_at is maintained by the column's onupdate default, so it is not
+    passed here; version is incremented by the UPDATE itself.
+
+    Args:
+        versions: Only update while the row is at one of these versions (as
+            sent in If-Match); raises VersionConflict otherwise
+
+    The check and the write are one statement, so nothing is locked beyond
+    the UPDATE's own row lock.
+    """
+    fields = tuple(sorted(field for field in values if field in UPDATABLE_FIELDS))
+    if not fields:
+        row = get(db, subscription_id)
+        if row is not None and versions is not None and row.version not in versions:
+            raise VersionConflict(subscription_id, row.version)
+        return row
+
+    conditional = versions is not None
+    statement = _update_statement(fields, conditional)
+    params = {f"new_{field}": values[field] for field in fields}
+    params["subscription_id"] = subscription_id
+    if conditional:
+        params["versions"] = list(versions)
+
+    def run():
+        row = db.execute(statement, params).one_or_none()
+        if row is None and db.execute(_UNARCHIVE, {"subscription_id": subscription_id}).one_or_none():
+            # An archived subscription that changes becomes hot again
+            row = db.execute(statement, params).one_or_none()
+        if row is None and conditional:
+            _check_version(db, subscription_id, versions)
+        return row
+
+    return _write(db, [values["service_name"]] if "service_name" in fields else [], run)
+
+
+def delete_by_id(db: Session, subscription_id: uuid.UUID, versions: Optional[List[int]] = None) -> bool:
+    """
+    Delete a subscription, returning False if it did not exist
+
+    Args:
+        versions: Only delete while the row is at one of these versions;
+            raises VersionConflict otherwise
+    """
+    params = {"subscription_id": subscription_id}
+    if versions is None:
+        deleted = db.execute(_DELETE, params).one_or_none()
+        if deleted is None:
+            deleted = db.execute(_DELETE_ARCHIVED, params).one_or_none()
+    else:
+        params["versions"] = list(versions)
+        deleted = db.execute(_DELETE_IF_VERSION, params).one_or_none()
+        if deleted is None:
+            deleted = db.execute(_DELETE_ARCHIVED_IF_VERSION, params).one_or_none()
+        if deleted is None:
+            _check_version(db, subscription_id, versions)
+    db.commit()
+    return deleted is not None
+
+
+def list_sort_key(sort: str):
+    """
+    Python sort key matching the ORDER BY of list_filtered() for sort
+
+    Sorted ascending, it places NULLs last like PostgreSQL; with reverse=True
+    it matches the descending order (NULLs first).
+    """
+    column = sort.lstrip("-")
+    return lambda row: (getattr(row, column) is None, getattr(row, column) or 0, row.id)
+
+
+def list_filtered(
+    db: Session,
+    skip: int,
+    limit: int,
+    user_id: Optional[uuid.UUID] = None,
+    service_name: Optional[str] = None,
+    include_archive: bool = False,
+    active_from: Optional[date] = None,
+    active_to: Optional[date] = None,
+    sort: str = "created_at"
+) -> List[Row]:
+    """
+    List subscriptions matching the optional filters, ordered by sort then id
+
+    active_from/active_to keep subscriptions overlapping that period (either
+    bound may be omitted). Lists including the archive are sorted after the
+    union of both tables rather than read in index order.
+    """
+    column = sort.lstrip("-")
+    if column not in LIST_SORTS:
+        raise ValueError(f"Unknown sort {sort!r}")
+    source = _source(include_archive)
+    query = _apply_filters(_named_rows(source), source, user_id, service_name)
+    query = query.where(*_active_conditions(source, active_from, active_to))
+    order = [source.c[column], source.c.id]
+    query = query.order_by(*([key.desc() for key in order] if sort.startswith("-") else order))
+    return db.execute(query.offset(skip).limit(limit)).all()
+
+
+def _estimate_rows(db: Session, query) -> int:
+    """Planner estimate of the number of rows a query returns (no rows are read)"""
+    compiled = query.compile(dialect=db.get_bind().dialect)
+    params = {key: str(value) if isinstance(value, uuid.UUID) else value for key, value in compiled.params.items()}
+    plan = db.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", params).scalar()
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def count_filtered(
+    db: Session,
+    user_id: Optional[uuid.UUID] = None,
+    service_name: Optional[str] = None,
+    include_archive: bool = False,
+    active_from: Optional[date] = None,
+    active_to: Optional[date] = None,
+    exact_max_rows: int = 10000,
+    timeout_ms: float = 50
+) -> Tuple[int, bool]:
+    """
+    Total number of subscriptions a list_filtered() call pages through
+
+    A user's subscriptions are counted exactly. Other filters are first
+    estimated from planner statistics, and counted exactly only when the
+    estimate is at most exact_max_rows. An exact count runs under a
+    statement timeout of timeout_ms (in a savepoint), and falls back to the
+    estimate when it takes longer.
+
+    Returns:
+        (count, whether it is exact)
+    """
+    source = _source(include_archive)
+    conditions = (
+        _filter_conditions(source, user_id, service_name)
+        + _active_conditions(source, active_from, active_to)
+    )
+    rows = select(source.c.id).where(*conditions)
+
+    estimate = None
+    if user_id is None:
+        estimate = _estimate_rows(db, rows)
+        if estimate > exact_max_rows:
+            return estimate, False
+
+    try:
+        with db.begin_nested():
+            previous = db.execute(select(func.current_setting("statement_timeout"))).scalar()
+            db.execute(select(func.set_config("statement_timeout", str(max(1, int(timeout_ms))), True)))
+            count = db.execute(select(func.count()).select_from(source).where(*conditions)).scalar()
+            db.execute(select(func.set_config("statement_timeout", previous, True)))
+        return count, True
+    except OperationalError as e:
+        # 57014: canceled by the statement timeout
+        if getattr(e.orig, "pgcode", None) != "57014":
+            raise
+    return (estimate if estimate is not None else _estimate_rows(db, rows)), False
+
+
+def export_query(
+    user_id: Optional[uuid.UUID] = None,
+    service_name: Optional[str] = None,
+    user_range: Optional[UserRange] = None,
+    active_from: Optional[date] = None,
+    active_to: Optional[date] = None,
+    updated_since: Optional[datetime] = None
+):
+    """
+    SELECT of whole subscription rows for bulk export
+
+    active_from/active_to keep subscriptions overlapping that period (either
+    bound may be omitted), updated_since keeps rows changed at or after it.
+    """
+    query = _apply_filters(select(*subscriptions.c), subscriptions, user_id, service_name, user_range)
+    query = query.where(*_active_conditions(subscriptions, active_from, active_to))
+    if updated_since:
+        query = query.where(subscriptions.c.updated_at >= updated_since)
+    return query
+
+
+def _bulk_conditions(
+    user_id: Optional[uuid.UUID],
+    service_name: Optional[str],
+    active_from: Optional[date],
+    active_to: Optional[date]
+) -> list:
+    return (
+        _filter_conditions(subscriptions, user_id, service_name)
+        + _active_conditions(subscriptions, active_from, active_to)
+    )
+
+
+def count_matching(
+    db: Session,
+    user_id: Optional[uuid.UUID] = None,
+    service_name: Optional[str] = None,
+    active_from: Optional[date] = None,
+    active_to: Optional[date] = None
+) -> int:
+    """Number of (hot) subscriptions a bulk update or delete with these filters would touch"""
+    conditions = _bulk_conditions(user_id, service_name, active_from, active_to)
+    return db.execute(select(func.count()).select_from(subscriptions).where(*conditions)).scalar()
+
+
+def bulk_update(
+    db: Session,
+    values: Dict[str, Any],
+    chunk_rows: int,
+    user_id: Optional[uuid.UUID] = None,
+    service_name: Optional[str] = None,
+    active_from: Optional[date] = None,
+    active_to: Optional[date] = None
+) -> int:
+    """
+    Set the given columns on every hot subscription matching the filters
+
+    Rows are updated chunk_rows at a time, in id order, each chunk a single
+    UPDATE ... WHERE id IN (SELECT ... FOR UPDATE) committed on its own, so
+    locks are held briefly and no row is updated twice even when the change
+    makes it stop (or start) matching. Archived subscriptions are left alone.
+
+    Returns:
+        Number of rows updated
+    """
+    fields = tuple(sorted(field for field in values if field in UPDATABLE_FIELDS))
+    if not fields:
+        return 0
+    new_values = _new_values(fields)
+    params = {f"new_{field}": values[field] for field in fields}
+
+    chunk = (
+        select(subscriptions.c.id)
+        .where(*_bulk_conditions(user_id, service_name, active_from, active_to))
+        .where(subscriptions.c.id > bindparam("after_id"))
+        .order_by(subscriptions.c.id)
+        .limit(chunk_rows)
+        .with_for_update()
+    )
+    statement = (
+        update(subscriptions)
+        .where(subscriptions.c.id.in_(chunk.scalar_subquery()))
+        .values(new_values)
+        .returning(subscriptions.c.id)
+    )
+    names = [values["service_name"]] if "service_name" in fields else []
+
+    updated = 0
+    after_id = uuid.UUID(int=0)
+    while True:
+        ids = _write(db, names, lambda: db.execute(statement, {**params, "after_id": after_id}).scalars().all())
+        updated += len(ids)
+        if len(ids) < chunk_rows:
+            return updated
+        after_id = max(ids)
+
+
+def bulk_delete(
+    db: Session,
+    chunk_rows: int,
+    user_id: Optional[uuid.UUID] = None,
+    service_name: Optional[str] = None,
+    active_from: Optional[date] = None,
+    active_to: Optional[date] = None
+) -> int:
+    """
+    Delete every hot subscription matching the filters, chunk_rows per transaction
+
+    Each deleted row leaves a change feed tombstone as with delete_by_id().
+
+    Returns:
+        Number of rows deleted
+    """
+    chunk = (
+        select(subscriptions.c.id)
+        .where(*_bulk_conditions(user_id, service_name, active_from, active_to))
+        .limit(chunk_rows)
+        .with_for_update()
+    )
+    statement = delete(subscriptions).where(subscriptions.c.id.in_(chunk.scalar_subquery()))
+
+    deleted = 0
+    while True:
+        count = db.execute(statement).rowcount
+        db.commit()
+        deleted += count
+        if count < chunk_rows:
+            return deleted
+
+
+def total_cost(
+    db: Session,
+    start_date: date,
+    end_date: date,
+    user_id: Optional[uuid.UUID] = None,
+    service_name: Optional[str] = None,
+    user_range: Optional[UserRange] = None,
+    include_archive: bool = False
+) -> Tuple[int, int]:
+    """
+    Sum prices of subscriptions overlapping [start_date, end_date]
+
+    Returns:
+        (total cost, number of subscriptions)
+    """
+    source = _source(include_archive)
+    query = select(
+        func.coalesce(func.sum(source.c.price), 0),
+        func.count()
+    ).where(_overlaps(source, start_date, end_date))
+    query = _apply_filters(query, source, user_id, service_name, user_range)
+    total, count = db.execute(query).one()
+    return int(total), count
+
+
+def service_cost(
+    db: Session,
+    start_date: date,
+    end_date: date,
+    service_name: Optional[str] = None,
+    user_range: Optional[UserRange] = None,
+    include_archive: bool = False
+) -> List[Tuple[str, int, int, int]]:
+    """
+    Cost of subscriptions overlapping [start_date, end_date] per service
+
+    Returns:
+        List of (service name, total cost, number of subscriptions, number of users)
+    """
+    source = _source(include_archive)
+    query = select(
+        services.c.name,
+        func.sum(source.c.price),
+        func.count(),
+        func.count(source.c.user_id.distinct())
+    ).select_from(
+        source.join(services, services.c.id == source.c.service_id)
+    ).where(_overlaps(source, start_date, end_date))
+    query = _apply_filters(query, source, None, service_name, user_range)
+    query = query.group_by(services.c.id).order_by(services.c.name)
+    return [(name, int(total), count, users) for name, total, count, users in db.execute(query)]
+
+
+def monthly_cost(
+    db: Session,
+    start_date: date,
+    end_date: date,
+    user_id: Optional[uuid.UUID] = None,
+    service_name: Optional[str] = None,
+    user_range: Optional[UserRange] = None,
+    include_archive: bool = False
+) -> List[Tuple[date, int, int]]:
+    """
+    Per-month cost of subscriptions for every month from start_date to end_date
+
+    A month counts a subscription under the same rule as total_cost() for that
+    single month.
+
+    Returns:
+        List of (first day of month, total cost, number of subscriptions)
+    """
+    months = func.generate_series(
+        start_date, end_date, literal_column("interval '1 month'")
+    ).table_valued("month").render_derived()
+
+    source = _source(include_archive)
+    condition = and_(
+        source.c.start_date <= months.c.month,
+        or_(source.c.end_date >= months.c.month, source.c.end_date.is_(None)),
+        *_filter_conditions(source, user_id, service_name, user_range)
+    )
+
+    query = select(
+        months.c.month,
+        func.coalesce(func.sum(source.c.price), 0),
+        func.count(source.c.id)
+    ).select_from(
+        months.outerjoin(source, condition)
+    ).group_by(months.c.month).order_by(months.c.month)
+
+    return [(month.date(), int(total), count) for month, total, count in db.execute(query)]
+
+
+def user_month_spend(db: Session, start_date: date, end_date: date):
+    """
+    Spend of every user on every service in each month from start_date to end_date
+
+    A month counts a subscription under the same rule as monthly_cost(). Rows
+    come out unordered and are meant to be streamed (stream_results).
+
+    Returns:
+        Result of (service name, first day of month, user id, spend)
+    """
+    months = func.generate_series(
+        start_date, end_date, literal_column("interval '1 month'")
+    ).table_valued("month").render_derived()
+
+    query = select(
+        services.c.name,
+        months.c.month,
+        subscriptions.c.user_id,
+        func.sum(subscriptions.c.price)
+    ).select_from(
+        months
+        .join(subscriptions, and_(
+            subscriptions.c.start_date <= months.c.month,
+            or_(subscriptions.c.end_date >= months.c.month, subscriptions.c.end_date.is_(None))
+        ))
+        .join(services, services.c.id == subscriptions.c.service_id)
+    ).group_by(services.c.name, months.c.month, subscriptions.c.user_id)
+    return db.execute(query)
+
+
+def change_cursor(db: Session) -> Tuple[int, int]:
+    """
+    Change feed cursor for the current snapshot
+
+    Reading changes from this cursor replays everything that the current
+    transaction's snapshot may not include yet.
+    """
+    return db.execute(select(_SNAPSHOT_XMIN)).scalar(), 0
+
+
+def changes_since(
+    db: Session,
+    cursor: Tuple[int, int],
+    limit: int
+) -> Tuple[List[Row], List[uuid.UUID], Tuple[int, int], bool]:
+    """
+    Read a page of the change feed after the given cursor
+
+    Changes are collapsed per subscription: a subscription that still exists is
+    returned with its current row, one that no longer exists as a tombstone.
+
+    Returns:
+        (upserted rows, deleted ids, next cursor, whether more changes follow)
+
+    Raises:
+        CursorExpired: Tombstones after the cursor have been compacted away;
+            the beginning (0, 0) never expires, it needs no tombstones
+    """
+    txid, seq = cursor
+    page = db.execute(_CHANGES, {"txid": txid, "seq": seq, "limit": limit}).all()
+    if (txid, seq) != (0, 0):
+        # Checked after the read, so a compaction committed before it is seen
+        horizon = db.execute(_HORIZON).one_or_none()
+        if horizon is not None and (txid, seq) < tuple(horizon):
+            raise CursorExpired(tuple(horizon))
+
+    latest: Dict[uuid.UUID, Row] = {}
+    for row in page:
+        latest.pop(row.subscription_id, None)
+        latest[row.subscription_id] = row
+
+    upserts = [row for row in latest.values() if row.id is not None]
+    deletes = [subscription_id for subscription_id, row in latest.items() if row.id is None]
+    next_cursor = (page[-1].txid, page[-1].seq) if page else cursor
+    return upserts, deletes, next_cursor, len(page) == limit
+
+
+def compact_changes(db, cutoff: datetime, after_seq: int, batch_rows: int) -> Tuple[int, Optional[int]]:
+    """
+    Compact the next batch_rows change feed entries after after_seq
+
+    Of the entries changed before cutoff, those followed by a later entry of
+    the same subscription are deleted, and so are tombstones. Deleting a
+    tombstone moves the horizon past it, which expires older cursors. Commits.
+
+    Returns:
+        (entries deleted, seq to continue after, or None once past cutoff)
+    """
+    window = db.execute(_CHANGE_WINDOW, {"after_seq": after_seq, "batch_rows": batch_rows}).all()
+    if not window:
+        return 0, None
+
+    last_seq = window[-1].seq
+    removed = db.execute(_COMPACT_CHANGES, {"after_seq": after_seq, "last_seq": last_seq, "cutoff": cutoff}).all()
+    tombstones = [(row.txid, row.seq) for row in removed if row.operation == "delete"]
+    if tombstones:
+        txid, seq = max(tombstones)
+        db.execute(_RAISE_HORIZON, {"txid": txid, "seq": seq})
+    db.commit()
+
+    done = len(window) < batch_rows or window[-1].changed_at >= cutoff
+    return len(removed), None if done else last_seq
+
+
+def archive_expired(db: Session, cutoff: date, batch_rows: int) -> int:
+    """
+    Move up to batch_rows subscriptions that ended before cutoff into the archive
+
+    The move is a single DELETE ... RETURNING feeding an INSERT, and it is
+    hidden from the change feed: the subscriptions still exist. Rows locked
+    by other transactions are skipped.
+
+    Returns:
+        Number of rows moved
+    """
+    expired = (
+        select(subscriptions.c.id)
+        .where(subscriptions.c.end_date < cutoff)
+        .order_by(subscriptions.c.end_date)
+        .limit(batch_rows)
+        .with_for_update(skip_locked=True)
+    )
+    moved = (
+        delete(subscriptions)
+        .where(subscriptions.c.id.in_(expired.scalar_subquery()))
+        .returning(*subscriptions.c)
+        .cte("moved")
+    )
+    statement = insert(archive).from_select(_COLUMN_NAMES, select(*moved.c)).add_cte(moved)
+
+    db.execute(select(func.set_config("app.skip_change_feed", "on", True)))
+    count = db.execute(statement).rowcount
+    db.commit()
+    return count
+
+
+def archive_max_end_date(db: Session) -> Optional[date]:
+    """Latest end_date in the archive, None while it is empty"""
+    return db.execute(select(func.max(archive.c.end_date))).scalar()
+
+
+def rows_after(db: Session, after_id: Optional[uuid.UUID], limit: int, archived: bool = False) -> List[Row]:
+    """
+    Next batch of whole rows in id order, locked until the transaction ends
+
+    Args:
+        after_id: Last id of the previous batch, None to start from the beginning
+        archived: Read the archive instead of the hot table
+    """
+    table = archive if archived else subscriptions
+    query = _named_rows(table).order_by(table.c.id).limit(limit).with_for_update(of=table)
+    if after_id is not None:
+        query = query.where(table.c.id > after_id)
+    return db.execute(query).all()
+
+
+def copy_in(db: Session, rows: List[Dict[str, Any]]) -> None:
+    """Insert whole rows (ids included) into the hot table, skipping existing ids"""
+    _write(db, [row["service_name"] for row in rows], lambda: db.execute(_COPY_IN, rows))
+
+
+def move_out(db: Session, subscription_ids: List[uuid.UUID], archived: bool = False) -> int:
+    """
+    Delete rows that now live on another shard, together with their change log
+
+    The subscriptions still exist, so no tombstones are written, and their
+    older change entries go too: the new shard reports them from now on.
+    """
+    count = 0
+    if subscription_ids:
+        table = archive if archived else subscriptions
+        db.execute(select(func.set_config("app.skip_change_feed", "on", True)))
+        count = db.execute(delete(table).where(table.c.id.in_(subscription_ids))).rowcount
+        db.execute(delete(changes).where(changes.c.subscription_id.in_(subscription_ids)))
+    db.commit()
+    return count
@@ -3,7 +3,25 @@ from .subscription import (
     SubscriptionUpdate,
     SubscriptionResponse,
     SubscriptionCostRequest,
-    SubscriptionCostResponse
+    SubscriptionCostResponse,
+    MonthlyCost,
+    SubscriptionMonthlyCostResponse,
+    SubscriptionChangesResponse,
+    SubscriptionPeriodFilter,
+    SubscriptionBulkFilter,
+    SubscriptionBulkResponse,
+    SubscriptionBatchGetRequest,
+    SubscriptionBatchGetResponse
+)
+from .report import ReportCreate, ReportJobResponse
+from .analytics import (
+    EstimateRequest,
+    CountEstimate,
+    MonthlyDistinctUsers,
+    DistinctUsersResponse,
+    QuantileEstimate,
+    MonthlySpendQuantiles,
+    SpendQuantilesResponse
 )
 
 __all__ = [
@@ -11,5 +29,22 @@ __all__ = [
     "SubscriptionUpdate", 
     "SubscriptionResponse",
     "SubscriptionCostRequest",
-    "SubscriptionCostResponse"
+    "SubscriptionCostResponse",
+    "MonthlyCost",
+    "SubscriptionMonthlyCostResponse",
+    "SubscriptionChangesResponse",
+    "SubscriptionPeriodFilter",
+    "SubscriptionBulkFilter",
+    "SubscriptionBulkResponse",
+    "SubscriptionBatchGetRequest",
+    "SubscriptionBatchGetResponse",
+    "ReportCreate",
+    "ReportJobResponse",
+    "EstimateRequest",
+    "CountEstimate",
+    "MonthlyDistinctUsers",
+    "DistinctUsersResponse",
+    "QuantileEstimate",
+    "MonthlySpendQuantiles",
+    "SpendQuantilesResponse"
 ]
\ No newline at end of file
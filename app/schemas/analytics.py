@@ -0,0 +1,62 @@
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Optional
+from datetime import datetime
+
+from app.schemas.subscription import MonthPeriod, ResponseMonthPeriod
+
+
+class EstimateRequest(BaseModel):
+    start_period: MonthPeriod = Field(..., description="Start period in MM-YYYY format")
+    end_period: MonthPeriod = Field(..., description="End period in MM-YYYY format")
+    service_name: Optional[str] = Field(None, description="Filter by service name")
+    
+    @model_validator(mode='after')
+    def end_period_must_be_after_start(self):
+        if self.end_period < self.start_period:
+            raise ValueError('End period must be after or equal to start period')
+        return self
+
+
+class CountEstimate(BaseModel):
+    estimate: int = Field(..., description="Estimated count")
+    lower: int = Field(..., description="Lower bound (two standard errors)")
+    upper: int = Field(..., description="Upper bound (two standard errors)")
+
+
+class MonthlyDistinctUsers(BaseModel):
+    month: ResponseMonthPeriod = Field(..., description="Month in MM-YYYY format")
+    users: CountEstimate
+
+
+class DistinctUsersResponse(BaseModel):
+    period_start: ResponseMonthPeriod = Field(..., description="Start period in MM-YYYY format")
+    period_end: ResponseMonthPeriod = Field(..., description="End period in MM-YYYY format")
+    users: CountEstimate = Field(..., description="Distinct users subscribed at any time in the period")
+    months: List[MonthlyDistinctUsers] = Field(..., description="Distinct users by month")
+    relative_error: float = Field(..., description="Relative standard error of the estimates")
+    stale: bool = Field(..., description="Whether updates or deletes are not reflected yet")
+    built_at: datetime = Field(..., description="When the sketches were last rebuilt from the table")
+
+
+class QuantileEstimate(BaseModel):
+    q: float = Field(..., description="Quantile")
+    value: float = Field(..., description="Estimated spend in rubles")
+    lower: float = Field(..., description="Lower bound of the true quantile")
+    upper: float = Field(..., description="Upper bound of the true quantile")
+
+
+class MonthlySpendQuantiles(BaseModel):
+    month: ResponseMonthPeriod = Field(..., description="Month in MM-YYYY format")
+    samples: int = Field(..., description="Number of users' spends on a service in the month")
+    quantiles: List[QuantileEstimate]
+
+
+class SpendQuantilesResponse(BaseModel):
+    period_start: ResponseMonthPeriod = Field(..., description="Start period in MM-YYYY format")
+    period_end: ResponseMonthPeriod = Field(..., description="End period in MM-YYYY format")
+    samples: int = Field(..., description="Number of monthly spends of a user on a service in the period")
+    quantiles: List[QuantileEstimate] = Field(..., description="Quantiles of monthly spend per user and service")
+    months: List[MonthlySpendQuantiles] = Field(..., description="Quantiles by month")
+    relative_accuracy: float = Field(..., description="Relative accuracy of the quantile values")
+    stale: bool = Field(..., description="Whether updates or deletes are not reflected yet")
+    built_at: datetime = Field(..., description="When the sketches were last rebuilt from the table")
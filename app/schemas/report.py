@@ -0,0 +1,21 @@
+from pydantic import BaseModel, Field
+from typing import Any, Dict, Literal, Optional
+
+from app.schemas.subscription import SubscriptionCostRequest
+
+
+class ReportCreate(SubscriptionCostRequest):
+    kind: Literal["cost", "services"] = Field(..., description="cost: total and monthly cost; services: cost per service")
+
+
+class ReportJobResponse(BaseModel):
+    id: str
+    kind: str
+    status: str = Field(..., description="queued, running, cancelling, completed, failed or cancelled")
+    progress: float = Field(..., description="Share of finished shards")
+    params: Dict[str, Any]
+    error: Optional[str] = None
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    result_url: Optional[str] = Field(None, description="Download URL of the finished report")
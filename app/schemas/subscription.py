@@ -1,98 +1,232 @@
-from pydantic import BaseModel, Field, validator
-from typing import Optional, Union
-from datetime import datetime
+from pydantic import (
+    BaseModel,
+    BeforeValidator,
+    ConfigDict,
+    Field,
+    PlainSerializer,
+    WithJsonSchema,
+    field_validator,
+    model_validator
+)
+from typing import Annotated, List, Optional
+from datetime import date, datetime
 import uuid
 import re
 
+from app.utils.periods import format_month_index, month_index
 
-class MMYYYYDate(str):
-    """Custom type for MM-YYYY date format validation"""
-    @classmethod
-    def __get_validators__(cls):
-        yield cls.validate
+_MM_YYYY = re.compile(r"(\d{2})-(\d{4})")
+_FIRST_MONTH, _LAST_MONTH = 1900 * 12, 2100 * 12 + 11
+
+# Most IDs a single batch lookup may ask for
+BATCH_GET_MAX_IDS = 5000
+
+
+class MonthIndex(int):
+    """
+    Month index read from a MessagePack request body
+
+    MsgPackRoute wraps the integers of month period fields in it; plain
+    integers (as in JSON bodies) are not accepted as month periods.
+    """
+
+
+def parse_month_period(v) -> int:
+    """
+    Parse an MM-YYYY string (or a date) into a month index
+
+    Args:
+        v: MM-YYYY string, a date coming from the database, or a MonthIndex
+            as sent by MessagePack clients
+
+    Returns:
+        Month index as returned by app.utils.periods.month_index()
+    """
+    if isinstance(v, date):
+        return month_index(v)
+    if isinstance(v, MonthIndex):
+        if not (_FIRST_MONTH <= v <= _LAST_MONTH):
+            raise ValueError('Month index must be between 01-1900 and 12-2100')
+        return int(v)
+    if not isinstance(v, str):
+        raise ValueError('Date must be a string')
     
-    @classmethod
-    def validate(cls, v):
-        if not isinstance(v, str):
-            raise ValueError('Date must be a string')
-        
-        if not re.match(r'^\d{2}-\d{4}$', v):
-            raise ValueError('Date must be in MM-YYYY format')
+    match = _MM_YYYY.fullmatch(v)
+    if not match:
+        raise ValueError('Date must be in MM-YYYY format')
+    
+    month, year = int(match.group(1)), int(match.group(2))
+    
+    if not (1 <= month <= 12):
+        raise ValueError('Month must be between 01 and 12')
         
-        month, year = v.split('-')
-        month, year = int(month), int(year)
+    if year < 1900 or year > 2100:
+        raise ValueError('Year must be between 1900 and 2100')
         
-        if not (1 <= month <= 12):
-            raise ValueError('Month must be between 01 and 12')
-            
-        if year < 1900 or year > 2100:
-            raise ValueError('Year must be between 1900 and 2100')
-            
+    return year * 12 + month - 1
+
+
+def parse_response_month(v) -> int:
+    """Month period of a response, which the service may also give as a month index"""
+    if type(v) is int:
         return v
+    return parse_month_period(v)
+
+
+_MONTH_SCHEMA = WithJsonSchema({"type": "string", "pattern": r"^\d{2}-\d{4}$", "examples": ["01-2025"]})
+
+# Month in MM-YYYY format, parsed once into a month index and rendered back
+# as MM-YYYY on output
+MonthPeriod = Annotated[
+    int,
+    BeforeValidator(parse_month_period),
+    PlainSerializer(format_month_index, return_type=str),
+    _MONTH_SCHEMA
+]
+
+# Month period of a response model, built from month indexes computed by the
+# service as well
+ResponseMonthPeriod = Annotated[
+    int,
+    BeforeValidator(parse_response_month),
+    PlainSerializer(format_month_index, return_type=str),
+    _MONTH_SCHEMA
+]
+
+
+def _strip_service_name(v: Optional[str]) -> Optional[str]:
+    if v is not None and not v.strip():
+        raise ValueError('Service name cannot be empty')
+    return v.strip() if v else None
 
 
 class SubscriptionBase(BaseModel):
     service_name: str = Field(..., min_length=1, max_length=255)
     price: int = Field(..., gt=0, description="Price in rubles")
     user_id: uuid.UUID = Field(...)
-    start_date: MMYYYYDate = Field(..., description="Start date in MM-YYYY format")
+    start_date: MonthPeriod = Field(..., description="Start date in MM-YYYY format")
     
-    @validator('service_name')
+    @field_validator('service_name')
+    @classmethod
     def service_name_must_not_be_empty(cls, v):
-        if not v.strip():
-            raise ValueError('Service name cannot be empty')
-        return v.strip()
+        return _strip_service_name(v)
 
 
 class SubscriptionCreate(SubscriptionBase):
-    end_date: Optional[MMYYYYDate] = Field(None, description="End date in MM-YYYY format")
+    end_date: Optional[MonthPeriod] = Field(None, description="End date in MM-YYYY format")
 
 
 class SubscriptionUpdate(BaseModel):
     service_name: Optional[str] = Field(None, min_length=1, max_length=255)
     price: Optional[int] = Field(None, gt=0)
-    start_date: Optional[MMYYYYDate] = None
-    end_date: Optional[MMYYYYDate] = None
+    start_date: Optional[MonthPeriod] = None
+    end_date: Optional[MonthPeriod] = None
     
-    @validator('service_name')
+    @field_validator('service_name')
+    @classmethod
     def service_name_must_not_be_empty(cls, v):
-        if v is not None and not v.strip():
-            raise ValueError('Service name cannot be empty')
-        return v.strip() if v else None
+        return _strip_service_name(v)
 
 
 class SubscriptionResponse(SubscriptionBase):
+    model_config = ConfigDict(from_attributes=True)
+    
     id: uuid.UUID
-    end_date: Optional[MMYYYYDate] = None
+    start_date: ResponseMonthPeriod = Field(..., description="Start date in MM-YYYY format")
+    end_date: Optional[ResponseMonthPeriod] = None
     created_at: datetime
     updated_at: datetime
-    
-    class Config:
-        orm_mode = True
+    version: int = Field(1, description="Row version, incremented by every change; sent as the ETag")
 
 
 class SubscriptionCostRequest(BaseModel):
-    start_period: MMYYYYDate = Field(..., description="Start period in MM-YYYY format")
-    end_period: MMYYYYDate = Field(..., description="End period in MM-YYYY format")
+    start_period: MonthPeriod = Field(..., description="Start period in MM-YYYY format")
+    end_period: MonthPeriod = Field(..., description="End period in MM-YYYY format")
     user_id: Optional[uuid.UUID] = Field(None, description="Filter by user ID")
     service_name: Optional[str] = Field(None, description="Filter by service name")
     
-    @validator('end_period')
-    def end_period_must_be_after_start(cls, v, values):
-        if 'start_period' in values:
-            start_month, start_year = map(int, values['start_period'].split('-'))
-            end_month, end_year = map(int, v.split('-'))
-            
-            start_total = start_year * 12 + start_month
-            end_total = end_year * 12 + end_month
-            
-            if end_total < start_total:
-                raise ValueError('End period must be after or equal to start period')
-        return v
+    @model_validator(mode='after')
+    def end_period_must_be_after_start(self):
+        if self.end_period < self.start_period:
+            raise ValueError('End period must be after or equal to start period')
+        return self
 
 
 class SubscriptionCostResponse(BaseModel):
     total_cost: int = Field(..., description="Total cost in rubles")
-    period_start: str = Field(..., description="Start period in MM-YYYY format")
-    period_end: str = Field(..., description="End period in MM-YYYY format")
-    count: int = Field(..., description="Number of subscriptions in calculation")
\ No newline at end of file
+    period_start: ResponseMonthPeriod = Field(..., description="Start period in MM-YYYY format")
+    period_end: ResponseMonthPeriod = Field(..., description="End period in MM-YYYY format")
+    count: int = Field(..., description="Number of subscriptions in calculation")
+
+
+class MonthlyCost(BaseModel):
+    month: ResponseMonthPeriod = Field(..., description="Month in MM-YYYY format")
+    total_cost: int = Field(..., description="Total cost in rubles")
+    count: int = Field(..., description="Number of subscriptions active in the month")
+
+
+class SubscriptionMonthlyCostResponse(BaseModel):
+    period_start: ResponseMonthPeriod = Field(..., description="Start period in MM-YYYY format")
+    period_end: ResponseMonthPeriod = Field(..., description="End period in MM-YYYY format")
+    months: List[MonthlyCost] = Field(..., description="Cost breakdown by month")
+
+
+class SubscriptionChangesResponse(BaseModel):
+    upserts: List[SubscriptionResponse] = Field(..., description="Current state of subscriptions created or changed since the cursor")
+    deletes: List[uuid.UUID] = Field(..., description="IDs of subscriptions deleted since the cursor")
+    next_cursor: str = Field(..., description="Cursor to pass as 'since' for the next page")
+    has_more: bool = Field(..., description="Whether more changes are available right away")
+
+
+class SubscriptionPeriodFilter(BaseModel):
+    active_from: Optional[MonthPeriod] = Field(None, description="Only subscriptions active at or after MM-YYYY")
+    active_to: Optional[MonthPeriod] = Field(None, description="Only subscriptions active at or before MM-YYYY")
+    active_at: Optional[MonthPeriod] = Field(None, description="Only subscriptions active in the month MM-YYYY")
+    
+    @model_validator(mode='after')
+    def period_must_be_consistent(self):
+        if self.active_at is not None and (self.active_from is not None or self.active_to is not None):
+            raise ValueError('active_at cannot be combined with active_from or active_to')
+        if self.active_from is not None and self.active_to is not None and self.active_to < self.active_from:
+            raise ValueError('active_to must be after or equal to active_from')
+        return self
+    
+    @property
+    def bounds(self) -> tuple:
+        """(first month, last month) of the period, either of them None when open"""
+        if self.active_at is not None:
+            return self.active_at, self.active_at
+        return self.active_from, self.active_to
+
+
+class SubscriptionBulkFilter(BaseModel):
+    user_id: Optional[uuid.UUID] = Field(None, description="Filter by user ID")
+    service_name: Optional[str] = Field(None, description="Filter by service name")
+    active_from: Optional[MonthPeriod] = Field(None, description="Only subscriptions active at or after MM-YYYY")
+    active_to: Optional[MonthPeriod] = Field(None, description="Only subscriptions active at or before MM-YYYY")
+    
+    @model_validator(mode='after')
+    def filter_must_be_given(self):
+        if self.user_id is None and not self.service_name and self.active_from is None and self.active_to is None:
+            raise ValueError('At least one filter is required for bulk changes')
+        if self.active_from is not None and self.active_to is not None and self.active_to < self.active_from:
+            raise ValueError('active_to must be after or equal to active_from')
+        return self
+
+
+class SubscriptionBulkResponse(BaseModel):
+    affected: int = Field(..., description="Number of subscriptions changed, or that would be changed in a dry run")
+    dry_run: bool = Field(..., description="Whether nothing was actually changed")
+
+
+class SubscriptionBatchGetRequest(BaseModel):
+    ids: List[uuid.UUID] = Field(
+        ..., min_length=1, max_length=BATCH_GET_MAX_IDS, description="Subscription IDs to fetch (duplicates allowed)"
+    )
+
+
+class SubscriptionBatchGetResponse(BaseModel):
+    subscriptions: List[Optional[SubscriptionResponse]] = Field(
+        ..., description="One entry per requested ID, in request order; null where the subscription was not found"
+    )
+    not_found: List[uuid.UUID] = Field(..., description="Requested IDs that were not found, in request order, without duplicates")
@@ -9,6 +9,8 @@ from datetime import datetime, timedelta
 from typing import Dict, Optional, Tuple
 import logging
 
+from app.utils.tracing import span
+
 logger = logging.getLogger(__name__)
 
 class LicenseManager:
@@ -53,6 +55,15 @@ class LicenseManager:
     
     def validate_usage(self) -> Tuple[bool, str]:
         """Валидация использования - основная точка защиты"""
+        with span("license.validate") as current:
+            is_valid, reason = self._validate_usage()
+            if current is not None:
+                current.set_attribute("license.valid", is_valid)
+                current.set_attribute("license.reason", reason)
+            return is_valid, reason
+    
+    def _validate_usage(self) -> Tuple[bool, str]:
+        """Проверка условий использования"""
         # В режиме разработки разрешаем использование
         if self.is_development:
             logger.info("Development mode detected - usage allowed")
@@ -0,0 +1,160 @@
+"""
+Request deadlines
+
+A request may carry a deadline: the timeout configured for its route class
+(see app.middleware.admission.route_class), optionally shortened by the
+client with an X-Request-Timeout header in seconds. The deadline lives in a
+context variable, which FastAPI copies into the threadpool running sync
+routes and the shard router into its scatter threads, so the engine hooks in
+app.database.instrumentation see it on every statement:
+
+- each transaction gets SET LOCAL statement_timeout to the time left,
+- no statement starts once the deadline has passed,
+- statements still running when it passes, or when the client disconnects,
+  are cancelled on the server (psycopg2 connection.cancel()).
+
+Either way the request fails with DeadlineExceeded, which
+app.middleware.deadline answers with 504.
+"""
+import math
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+from app.utils.logger import get_logger
+from app.utils.metrics import metrics
+
+# Load environment variables
+load_dotenv()
+
+# Deadline configuration
+DEADLINES_ENABLED = os.getenv("DEADLINES_ENABLED", "False").lower() == "true"
+# class=milliseconds pairs; classes left out have no deadline unless the client sets one
+REQUEST_DEADLINES = os.getenv("REQUEST_DEADLINES", "analytics=30000,read=5000,write=10000")
+
+logger = get_logger(__name__)
+
+timed_out_requests = metrics.counter(
+    "deadline_exceeded_total", "Requests ended by their deadline or by the client disconnecting", ("route_class", "reason")
+)
+cancelled_statements = metrics.counter(
+    "deadline_cancelled_statements_total", "In-flight statements cancelled on the server", ("reason",)
+)
+
+# Reasons a deadline ends a request
+DEADLINE = "deadline"
+CLIENT_DISCONNECT = "client_disconnect"
+
+# SQLSTATE query_canceled, raised by statement_timeout and by cancel()
+QUERY_CANCELED = "57014"
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's deadline has passed or its client has gone"""
+
+    def __init__(self, reason: str = DEADLINE):
+        super().__init__(f"Request deadline exceeded ({reason})")
+        self.reason = reason
+
+
+class Deadline:
+    """Point in time a request must be done by, and the statements to cancel at it"""
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+        # Set once the request is cancelled (DEADLINE or CLIENT_DISCONNECT)
+        self.reason: Optional[str] = None
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def remaining(self) -> float:
+        """Seconds left (negative once passed)"""
+        return self.expires_at - time.monotonic()
+
+    def statement_timeout_ms(self) -> int:
+        """Time left as a statement_timeout, rounded up so it never fires early"""
+        return max(1, math.ceil(self.remaining() * 1000))
+
+    @property
+    def expired(self) -> bool:
+        return self.reason is not None or self.remaining() <= 0
+
+    def check(self):
+        """Raise DeadlineExceeded if no more work should start"""
+        if self.reason is not None:
+            raise DeadlineExceeded(self.reason)
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(DEADLINE)
+
+    def track(self, dbapi_connection):
+        """Note a connection running a statement for this request"""
+        with self._lock:
+            self._running.add(dbapi_connection)
+
+    def untrack(self, dbapi_connection):
+        # Waits for a cancel in progress, so the connection is never cancelled
+        # after it has gone back to the pool
+        with self._lock:
+            self._running.discard(dbapi_connection)
+
+    def cancel(self, reason: str) -> bool:
+        """
+        End the request: refuse further statements and cancel running ones
+
+        Blocks for a network round trip per running statement. Returns False
+        if the request was already cancelled.
+        """
+        with self._lock:
+            if self.reason is not None:
+                return False
+            self.reason = reason
+            for dbapi_connection in self._running:
+                try:
+                    dbapi_connection.cancel()
+                    cancelled_statements.inc(reason=reason)
+                except Exception as e:
+                    logger.warning(f"Failed to cancel a statement: {str(e)}")
+        return True
+
+
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar("deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+def set_deadline(deadline: Optional[Deadline]):
+    """Make deadline the current one; returns a token for reset_deadline()"""
+    return _current_deadline.set(deadline)
+
+
+def reset_deadline(token):
+    _current_deadline.reset(token)
+
+
+def parse_deadlines(spec: str) -> Dict[str, float]:
+    """
+    Parse "class=milliseconds,..." into {class: seconds}
+    """
+    deadlines = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        route_class, milliseconds = item.split("=")
+        deadlines[route_class.strip()] = float(milliseconds) / 1000
+    return deadlines
+
+
+def parse_request_timeout(value: Optional[str]) -> Optional[float]:
+    """Seconds from an X-Request-Timeout header (None if missing or invalid)"""
+    if not value:
+        return None
+    try:
+        timeout = float(value)
+    except ValueError:
+        return None
+    return timeout if 0 < timeout < math.inf else None
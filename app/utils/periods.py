@@ -0,0 +1,42 @@
+from datetime import date
+
+
+def month_index(value: date) -> int:
+    """
+    Convert a date to a month index (months since year 0)
+
+    Args:
+        value: Date or datetime
+
+    Returns:
+        year * 12 + month - 1
+    """
+    return value.year * 12 + value.month - 1
+
+
+def month_index_to_date(index: int) -> date:
+    """
+    Convert a month index back to the first day of that month
+
+    Args:
+        index: Month index as returned by month_index()
+
+    Returns:
+        Date of the first day of the month
+    """
+    year, month = divmod(index, 12)
+    return date(year, month + 1, 1)
+
+
+def format_month_index(index: int) -> str:
+    """
+    Render a month index in MM-YYYY format
+
+    Args:
+        index: Month index as returned by month_index()
+
+    Returns:
+        MM-YYYY string
+    """
+    year, month = divmod(index, 12)
+    return f"{month + 1:02d}-{year}"
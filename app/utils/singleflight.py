@@ -0,0 +1,112 @@
+"""
+Request coalescing for identical concurrent reads
+
+Identical calls arriving together share one execution of the query: they wait
+for it and get its result (or its exception) instead of running their own.
+A caller only ever joins a call whose query has not started yet; callers
+arriving while a query for their key runs wait for it to finish and then
+share the next one. Every result therefore comes from a query that started
+after its caller arrived, so a read never misses a write committed before it
+was sent (read-your-writes holds), and at most one query per key runs at a
+time. Nothing is cached: once a call finishes, the next caller runs it again.
+
+Waiting callers keep their own request deadline (app.utils.deadline), and a
+call that ran out of its caller's deadline is run again by a waiting caller
+rather than failing it too.
+"""
+import os
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from dotenv import load_dotenv
+
+from app.utils.deadline import DeadlineExceeded, current_deadline
+from app.utils.metrics import metrics
+
+# Load environment variables
+load_dotenv()
+
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "True").lower() == "true"
+
+executions = metrics.counter(
+    "singleflight_executions_total", "Calls that ran their own query", ("group",)
+)
+coalesced = metrics.counter(
+    "singleflight_coalesced_total", "Calls that shared the result of an identical in-flight call", ("group",)
+)
+
+
+def flight_key(*parts, **params) -> tuple:
+    """Normalized key: positional parts plus the parameters that are set, in name order"""
+    return parts + tuple(sorted((name, value) for name, value in params.items() if value is not None))
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = False
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with equal keys into one execution"""
+
+    def __init__(self, group: str, enabled: bool = SINGLE_FLIGHT_ENABLED):
+        self.group = group
+        self.enabled = enabled
+        # Calls whose query runs, and calls gathering callers until it is their turn
+        self._running: Dict[Hashable, _Call] = {}
+        self._waiting: Dict[Hashable, _Call] = {}
+        self._changed = threading.Condition()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Run fn, or share the not yet started call with the same key
+
+        Args:
+            key: Hashable key of the normalized query parameters
+            fn: Zero-argument callable running the query
+        """
+        if not self.enabled:
+            return fn()
+
+        deadline = current_deadline()
+        with self._changed:
+            call = self._waiting.get(key)
+            if call is None:
+                call = self._waiting[key] = _Call()
+
+            def turn():
+                # Done by another caller, or free to start: nothing runs for the key
+                return call.done or (key not in self._running and self._waiting.get(key) is call)
+
+            if not self._changed.wait_for(turn, deadline.remaining() if deadline is not None else None):
+                raise DeadlineExceeded()
+            leader = not call.done
+            if leader:
+                del self._waiting[key]
+                self._running[key] = call
+
+        if not leader:
+            coalesced.inc(group=self.group)
+            if isinstance(call.error, DeadlineExceeded):
+                # The other caller's deadline, not ours
+                return self.do(key, fn)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        executions.inc(group=self.group)
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._changed:
+                del self._running[key]
+                call.done = True
+                self._changed.notify_all()
+        return call.result
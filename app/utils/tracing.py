@@ -0,0 +1,281 @@
+"""
+Request tracing with an OpenTelemetry-compatible span model
+
+Spans carry W3C trace and span ids, a parent id, a kind, nanosecond start and
+end times, attributes and a status, and are written one JSON object per line
+with OTLP/JSON field names (attributes as a flat object), to stdout or to a
+local file. No collector is needed; the file can be shipped or converted
+later.
+
+The current span lives in a context variable, which FastAPI copies into the
+threadpool running sync routes. Child spans are only recorded below a sampled
+root span: without one, span() and start_span() do nothing beyond a context
+variable lookup, so unsampled requests cost next to nothing.
+
+Finished spans are queued and written by a background thread. When the queue
+is full, spans are dropped and counted rather than slowing requests down.
+"""
+import json
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.utils.logger import get_logger
+from app.utils.metrics import metrics
+
+# Load environment variables
+load_dotenv()
+
+# Tracing configuration
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "False").lower() == "true"
+TRACING_SAMPLE_RATE = float(os.getenv("TRACING_SAMPLE_RATE", "0.01"))
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "file")
+TRACING_FILE = os.getenv("TRACING_FILE", "traces.jsonl")
+TRACING_QUEUE_SIZE = int(os.getenv("TRACING_QUEUE_SIZE", "10000"))
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "subscription-aggregator")
+
+logger = get_logger(__name__)
+
+exported = metrics.counter("tracing_spans_exported_total", "Spans written by the trace exporter")
+dropped = metrics.counter("tracing_spans_dropped_total", "Spans dropped because the export queue was full")
+
+_TRACEPARENT = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_INVALID_TRACE_ID = "0" * 32
+_INVALID_SPAN_ID = "0" * 16
+
+
+def new_trace_id() -> str:
+    return f"{random.getrandbits(128):032x}"
+
+
+def new_span_id() -> str:
+    return f"{random.getrandbits(64):016x}"
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """
+    Parse a W3C traceparent header
+
+    Returns:
+        (trace id, parent span id, sampled flag), or None if the header is
+        missing or invalid
+    """
+    if not value:
+        return None
+    match = _TRACEPARENT.match(value.strip().lower())
+    if match is None:
+        return None
+    version, trace_id, span_id, flags = match.groups()
+    if version == "ff" or trace_id == _INVALID_TRACE_ID or span_id == _INVALID_SPAN_ID:
+        return None
+    return trace_id, span_id, bool(int(flags, 16) & 1)
+
+
+def format_traceparent(trace_id: str, span_id: str, sampled: bool) -> str:
+    return f"00-{trace_id}-{span_id}-{'01' if sampled else '00'}"
+
+
+class Span:
+    """One timed operation of a trace"""
+
+    __slots__ = ("trace_id", "span_id", "parent_span_id", "name", "kind", "attributes",
+                 "start_ns", "end_ns", "status", "status_message", "exporter")
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: Optional[str] = None,
+                 kind: str = "INTERNAL", attributes: Optional[Dict[str, Any]] = None,
+                 exporter: Optional["SpanExporter"] = None):
+        self.exporter = exporter or span_exporter
+        self.trace_id = trace_id
+        self.span_id = new_span_id()
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = "UNSET"
+        self.status_message = ""
+
+    @property
+    def traceparent(self) -> str:
+        return format_traceparent(self.trace_id, self.span_id, True)
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_error(self, error):
+        self.status = "ERROR"
+        self.status_message = f"{type(error).__name__}: {error}" if isinstance(error, BaseException) else str(error)
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.exporter.export(self)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id or "",
+            "name": self.name,
+            "kind": f"SPAN_KIND_{self.kind}",
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "attributes": self.attributes,
+            "status": {"code": f"STATUS_CODE_{self.status}", "message": self.status_message},
+            "resource": {"service.name": TRACING_SERVICE_NAME},
+        }
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def start_root_span(name: str, traceparent: Optional[str] = None, sample_rate: float = TRACING_SAMPLE_RATE,
+                    attributes: Optional[Dict[str, Any]] = None,
+                    exporter: Optional["SpanExporter"] = None) -> Tuple[Optional[Span], str]:
+    """
+    Start the root span of a request, continuing the caller's trace if any
+
+    An incoming traceparent decides sampling (its sampled flag is honored);
+    otherwise the request is sampled with probability sample_rate.
+
+    Returns:
+        (span or None when not sampled, traceparent to hand back to the caller)
+    """
+    parent = parse_traceparent(traceparent)
+    if parent is not None:
+        trace_id, parent_span_id, sampled = parent
+    else:
+        trace_id, parent_span_id = new_trace_id(), None
+        sampled = sample_rate >= 1 or random.random() < sample_rate
+    if not sampled:
+        return None, format_traceparent(trace_id, parent_span_id or new_span_id(), False)
+    span = Span(name, trace_id, parent_span_id, kind="SERVER", attributes=attributes, exporter=exporter)
+    return span, span.traceparent
+
+
+def activate(span: Optional[Span]):
+    """Make span the current span; returns a token for deactivate()"""
+    return _current_span.set(span)
+
+
+def deactivate(token):
+    _current_span.reset(token)
+
+
+def start_span(name: str, kind: str = "INTERNAL", attributes: Optional[Dict[str, Any]] = None) -> Optional[Span]:
+    """
+    Start a child of the current span without making it current
+
+    For event hooks that start and end a span in different callbacks. Returns
+    None outside a sampled trace.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    return Span(name, parent.trace_id, parent.span_id, kind, attributes, parent.exporter)
+
+
+@contextmanager
+def span(name: str, kind: str = "INTERNAL", **attributes):
+    """
+    Record the block as a child of the current span (a no-op outside a sampled trace)
+
+    Usage:
+        with span("license.validate"):
+            ...
+    """
+    child = start_span(name, kind, attributes)
+    if child is None:
+        yield None
+        return
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.set_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+
+class SpanExporter:
+    """Writes finished spans as JSON lines from a background thread"""
+
+    def __init__(self, destination: str = TRACING_EXPORTER, path: str = TRACING_FILE,
+                 queue_size: int = TRACING_QUEUE_SIZE):
+        self.destination = destination
+        self.path = path
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            dropped.inc()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        stream = sys.stdout if self.destination == "stdout" else open(self.path, "a", encoding="utf-8")
+        while True:
+            span = self._queue.get()
+            if span is None:
+                break
+            batch = [span]
+            # Write whatever else is already waiting in one go
+            while len(batch) < 512:
+                try:
+                    span = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if span is None:
+                    self._queue.put(None)
+                    break
+                batch.append(span)
+            try:
+                stream.write("".join(json.dumps(s.to_dict(), default=str) + "\n" for s in batch))
+                stream.flush()
+                exported.inc(len(batch))
+            except Exception as e:
+                logger.error(f"Writing {len(batch)} spans failed: {e}")
+        if stream is not sys.stdout:
+            stream.close()
+
+    def close(self):
+        """Write the queued spans and stop the writer thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout=5)
+
+
+# Shared exporter
+span_exporter = SpanExporter()
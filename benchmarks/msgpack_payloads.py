@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Payload size and encode/decode time of JSON versus compact MessagePack
+
+Encodes a page of subscription responses the way the list route does for
+each format and decodes it the way a Python client would, into uuid.UUID and
+datetime values: json.loads plus parsing UUID and ISO timestamp strings, or
+msgpack.unpackb plus converting binary UUIDs and epoch microseconds.
+
+Usage:
+    python benchmarks/msgpack_payloads.py [--rows N] [--number N]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+import uuid
+from datetime import date, datetime, timedelta
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import msgpack  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+
+from app.api.negotiation import packb  # noqa: E402
+from app.schemas.subscription import SubscriptionResponse  # noqa: E402
+
+SERVICES = ["Yandex Plus", "Netflix Standard", "Spotify Premium", "Apple Music", "Kinopoisk"]
+
+
+def make_responses(count: int) -> List[SubscriptionResponse]:
+    rng = random.Random(1)
+    users = [uuid.UUID(int=rng.getrandbits(128)) for _ in range(max(1, count // 5))]
+    responses = []
+    for i in range(count):
+        start = date(rng.randint(2020, 2025), rng.randint(1, 12), 1)
+        created = datetime(2025, 1, 1) + timedelta(seconds=rng.randint(0, 10 ** 7), microseconds=rng.randint(0, 999999))
+        responses.append(SubscriptionResponse.model_validate({
+            "id": uuid.UUID(int=rng.getrandbits(128)),
+            "service_name": rng.choice(SERVICES),
+            "price": rng.randint(100, 1000),
+            "user_id": rng.choice(users),
+            "start_date": start,
+            "end_date": None if i % 3 == 0 else date(start.year + 1, start.month, 1),
+            "created_at": created,
+            "updated_at": created,
+            "version": 1
+        }))
+    return responses
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def decode_json(data: bytes) -> list:
+    rows = json.loads(data)
+    for row in rows:
+        row["id"] = uuid.UUID(row["id"])
+        row["user_id"] = uuid.UUID(row["user_id"])
+        row["created_at"] = datetime.fromisoformat(row["created_at"])
+        row["updated_at"] = datetime.fromisoformat(row["updated_at"])
+    return rows
+
+
+def decode_msgpack(data: bytes) -> list:
+    rows = msgpack.unpackb(data)
+    for row in rows:
+        row["id"] = uuid.UUID(bytes=row["id"])
+        row["user_id"] = uuid.UUID(bytes=row["user_id"])
+        row["created_at"] = EPOCH + timedelta(microseconds=row["created_at"])
+        row["updated_at"] = EPOCH + timedelta(microseconds=row["updated_at"])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000, help="Subscriptions per payload")
+    parser.add_argument("--number", type=int, default=200, help="Encodes/decodes per measurement")
+    args = parser.parse_args()
+
+    responses = make_responses(args.rows)
+    adapter = TypeAdapter(List[SubscriptionResponse])
+    formats = {
+        "json": (lambda: adapter.dump_json(responses), decode_json),
+        "msgpack": (lambda: packb(responses), decode_msgpack),
+    }
+
+    print(f"{args.rows} subscriptions per payload")
+    print(f"{'format':8s} {'bytes':>10s} {'encode ms':>10s} {'decode ms':>10s}")
+    for name, (encode, decode) in formats.items():
+        payload = encode()
+        encode_s = min(timeit.repeat(encode, number=args.number, repeat=3)) / args.number
+        decode_s = min(timeit.repeat(lambda: decode(payload), number=args.number, repeat=3)) / args.number
+        print(f"{name:8s} {len(payload):>10,d} {encode_s * 1000:>10.3f} {decode_s * 1000:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
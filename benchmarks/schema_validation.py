@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Validation throughput of the request and response schemas
+
+Usage:
+    python benchmarks/schema_validation.py [--number N]
+"""
+import argparse
+import os
+import sys
+import timeit
+import uuid
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.schemas.subscription import (  # noqa: E402
+    SubscriptionCostRequest,
+    SubscriptionCreate,
+    SubscriptionResponse
+)
+
+CREATE_PAYLOAD = {
+    "service_name": "Yandex Plus",
+    "price": 400,
+    "user_id": str(uuid.uuid4()),
+    "start_date": "07-2025",
+    "end_date": "12-2025"
+}
+COST_PAYLOAD = {
+    "start_period": "01-2025",
+    "end_period": "12-2025",
+    "user_id": str(uuid.uuid4()),
+    "service_name": "Netflix"
+}
+RESPONSE_ROW = {
+    "id": uuid.uuid4(),
+    "service_name": "Yandex Plus",
+    "price": 400,
+    "user_id": uuid.uuid4(),
+    "start_date": date(2025, 7, 1),
+    "end_date": None,
+    "created_at": datetime(2025, 7, 1),
+    "updated_at": datetime(2025, 7, 1)
+}
+
+CASES = {
+    "create": lambda: SubscriptionCreate.model_validate(CREATE_PAYLOAD),
+    "cost": lambda: SubscriptionCostRequest.model_validate(COST_PAYLOAD),
+    "response": lambda: SubscriptionResponse.model_validate(RESPONSE_ROW).model_dump(mode="json"),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=50000, help="Validations per case")
+    args = parser.parse_args()
+
+    for name, case in CASES.items():
+        seconds = min(timeit.repeat(case, number=args.number, repeat=3))
+        print(f"{name:10s} {args.number / seconds:>12,.0f} ops/s  {seconds / args.number * 1e6:8.2f} us/op")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Storage and query latency of inline service names versus the services dimension
+
+Builds both layouts side by side in temporary tables of the configured
+database and compares their size and the latency of a service name filter
+and a per-service cost aggregation.
+
+Usage:
+    python benchmarks/services_dimension.py [--rows N] [--services N] [--repeat N]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text  # noqa: E402
+
+from app.database.session import engine  # noqa: E402
+
+SETUP = [
+    """
+    CREATE TEMP TABLE bench_services AS
+    SELECT i AS id, 'Streaming Service Premium Family ' || i AS name
+    FROM generate_series(1, :services) i
+    """,
+    "ALTER TABLE bench_services ADD PRIMARY KEY (id)",
+    "CREATE UNIQUE INDEX ON bench_services (name)",
+    """
+    CREATE TEMP TABLE bench_normalized AS
+    SELECT gen_random_uuid() AS id, 1 + (i % :services) AS service_id, 100 + i % 900 AS price,
+           gen_random_uuid() AS user_id, DATE '2020-01-01' + (i % 1500) AS start_date
+    FROM generate_series(1, :rows) i
+    """,
+    "CREATE INDEX ON bench_normalized (service_id)",
+    """
+    CREATE TEMP TABLE bench_inline AS
+    SELECT n.id, s.name AS service_name, n.price, n.user_id, n.start_date
+    FROM bench_normalized n JOIN bench_services s ON s.id = n.service_id
+    """,
+    "CREATE INDEX ON bench_inline (service_name)",
+    "ANALYZE bench_services",
+    "ANALYZE bench_normalized",
+    "ANALYZE bench_inline",
+]
+
+QUERIES = {
+    "filter": (
+        "SELECT count(*), sum(price) FROM bench_inline WHERE service_name ILIKE '%Family 7%'",
+        "SELECT count(*), sum(price) FROM bench_normalized WHERE service_id IN "
+        "(SELECT id FROM bench_services WHERE name ILIKE '%Family 7%')",
+    ),
+    "group_by": (
+        "SELECT service_name, sum(price) FROM bench_inline GROUP BY service_name",
+        "SELECT s.name, t.total FROM (SELECT service_id, sum(price) AS total FROM bench_normalized "
+        "GROUP BY service_id) t JOIN bench_services s ON s.id = t.service_id",
+    ),
+}
+
+
+def best_of(conn, sql: str, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(text(sql)).all()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=500000, help="Subscriptions generated")
+    parser.add_argument("--services", type=int, default=1000, help="Distinct services")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per query (best is reported)")
+    args = parser.parse_args()
+
+    with engine.connect() as conn:
+        for statement in SETUP:
+            conn.execute(text(statement), {"rows": args.rows, "services": args.services})
+
+        inline, normalized, dimension = (
+            conn.execute(text(f"SELECT pg_total_relation_size('{table}')")).scalar()
+            for table in ("bench_inline", "bench_normalized", "bench_services")
+        )
+        print(f"{'inline':12s} {inline / 2**20:10.1f} MiB")
+        print(f"{'normalized':12s} {(normalized + dimension) / 2**20:10.1f} MiB  (services {dimension / 2**20:.1f} MiB)")
+
+        for name, (inline_sql, normalized_sql) in QUERIES.items():
+            before = best_of(conn, inline_sql, args.repeat)
+            after = best_of(conn, normalized_sql, args.repeat)
+            print(f"{name:12s} {before * 1e3:8.1f} ms -> {after * 1e3:8.1f} ms  ({before / after:.1f}x)")
+        conn.rollback()
+
+
+if __name__ == "__main__":
+    main()
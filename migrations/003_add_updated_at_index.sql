@@ -0,0 +1,2 @@
+-- Index for incremental refreshes of the analytics snapshot (rows changed since a point in time)
+CREATE INDEX IF NOT EXISTS idx_subscriptions_updated_at ON subscriptions(updated_at);
@@ -0,0 +1,35 @@
+-- Change log feeding GET /subscriptions/changes (requires PostgreSQL 13+)
+CREATE TABLE IF NOT EXISTS subscription_changes (
+    seq BIGSERIAL PRIMARY KEY,
+    txid BIGINT NOT NULL,
+    subscription_id UUID NOT NULL,
+    operation VARCHAR(6) NOT NULL,
+    changed_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_subscription_changes_cursor ON subscription_changes(txid, seq);
+
+-- Record every insert and update as an upsert and every delete as a tombstone
+CREATE OR REPLACE FUNCTION record_subscription_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO subscription_changes (txid, subscription_id, operation)
+        VALUES (pg_current_xact_id()::text::bigint, OLD.id, 'delete');
+    ELSE
+        INSERT INTO subscription_changes (txid, subscription_id, operation)
+        VALUES (pg_current_xact_id()::text::bigint, NEW.id, 'upsert');
+    END IF;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS subscriptions_change_feed ON subscriptions;
+CREATE TRIGGER subscriptions_change_feed
+    AFTER INSERT OR UPDATE OR DELETE ON subscriptions
+    FOR EACH ROW
+    EXECUTE FUNCTION record_subscription_change();
+
+-- Existing rows become the initial upserts of the feed
+INSERT INTO subscription_changes (txid, subscription_id, operation)
+SELECT pg_current_xact_id()::text::bigint, id, 'upsert' FROM subscriptions;
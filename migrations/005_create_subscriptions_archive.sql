@@ -0,0 +1,40 @@
+-- Cold storage for subscriptions that ended before the retention window
+CREATE TABLE IF NOT EXISTS subscriptions_archive (
+    id UUID PRIMARY KEY,
+    service_name VARCHAR(255) NOT NULL,
+    price INTEGER NOT NULL,
+    user_id UUID NOT NULL,
+    start_date DATE NOT NULL,
+    end_date DATE NOT NULL,
+    created_at TIMESTAMP WITHOUT TIME ZONE,
+    updated_at TIMESTAMP WITHOUT TIME ZONE,
+    archived_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_subscriptions_archive_user_id ON subscriptions_archive(user_id);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_archive_end_date ON subscriptions_archive(end_date);
+
+-- Moving rows to the archive (app.skip_change_feed = 'on') is not a change
+CREATE OR REPLACE FUNCTION record_subscription_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF current_setting('app.skip_change_feed', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO subscription_changes (txid, subscription_id, operation)
+        VALUES (pg_current_xact_id()::text::bigint, OLD.id, 'delete');
+    ELSE
+        INSERT INTO subscription_changes (txid, subscription_id, operation)
+        VALUES (pg_current_xact_id()::text::bigint, NEW.id, 'upsert');
+    END IF;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+-- Deleting an archived subscription leaves a tombstone like a live one
+DROP TRIGGER IF EXISTS subscriptions_archive_change_feed ON subscriptions_archive;
+CREATE TRIGGER subscriptions_archive_change_feed
+    AFTER DELETE ON subscriptions_archive
+    FOR EACH ROW
+    EXECUTE FUNCTION record_subscription_change();
@@ -0,0 +1,40 @@
+-- Service names move into a dimension table; subscriptions keep an integer key
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS services (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL UNIQUE
+);
+
+INSERT INTO services (name)
+SELECT service_name FROM subscriptions
+UNION
+SELECT service_name FROM subscriptions_archive
+ON CONFLICT (name) DO NOTHING;
+
+-- Rewriting the key is neither a change for the feed nor an update of the row
+SET LOCAL app.skip_change_feed = 'on';
+ALTER TABLE subscriptions DISABLE TRIGGER update_subscriptions_updated_at;
+
+ALTER TABLE subscriptions ADD COLUMN service_id INTEGER;
+UPDATE subscriptions s SET service_id = sv.id FROM services sv WHERE sv.name = s.service_name;
+ALTER TABLE subscriptions
+    ALTER COLUMN service_id SET NOT NULL,
+    ADD CONSTRAINT subscriptions_service_id_fkey FOREIGN KEY (service_id) REFERENCES services(id);
+
+ALTER TABLE subscriptions_archive ADD COLUMN service_id INTEGER;
+UPDATE subscriptions_archive a SET service_id = sv.id FROM services sv WHERE sv.name = a.service_name;
+ALTER TABLE subscriptions_archive
+    ALTER COLUMN service_id SET NOT NULL,
+    ADD CONSTRAINT subscriptions_archive_service_id_fkey FOREIGN KEY (service_id) REFERENCES services(id);
+
+ALTER TABLE subscriptions ENABLE TRIGGER update_subscriptions_updated_at;
+
+DROP INDEX IF EXISTS idx_subscriptions_service_name;
+DROP INDEX IF EXISTS ix_subscriptions_service_name;
+ALTER TABLE subscriptions DROP COLUMN service_name;
+ALTER TABLE subscriptions_archive DROP COLUMN service_name;
+
+CREATE INDEX IF NOT EXISTS idx_subscriptions_service_id ON subscriptions(service_id);
+
+COMMIT;
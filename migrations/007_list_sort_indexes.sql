@@ -0,0 +1,14 @@
+-- Indexes serving every filter and sort of the subscription list in index order
+-- (run outside a transaction: CONCURRENTLY keeps the table writable meanwhile)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_subscriptions_user_created_at ON subscriptions(user_id, created_at, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_subscriptions_user_start_date ON subscriptions(user_id, start_date, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_subscriptions_user_end_date ON subscriptions(user_id, end_date, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_subscriptions_created_at ON subscriptions(created_at, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_subscriptions_start_date_id ON subscriptions(start_date, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_subscriptions_end_date_id ON subscriptions(end_date, id);
+
+-- Prefixes of the indexes above
+DROP INDEX CONCURRENTLY IF EXISTS idx_subscriptions_user_id;
+DROP INDEX CONCURRENTLY IF EXISTS ix_subscriptions_user_id;
+DROP INDEX CONCURRENTLY IF EXISTS idx_subscriptions_start_date;
+DROP INDEX CONCURRENTLY IF EXISTS idx_subscriptions_end_date;
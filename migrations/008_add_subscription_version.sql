@@ -0,0 +1,5 @@
+-- Row version for optimistic concurrency: every update increments it, and
+-- conditional writes (If-Match) only apply while it is unchanged. A constant
+-- default makes ADD COLUMN a catalog-only change, without rewriting the tables.
+ALTER TABLE subscriptions ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE subscriptions_archive ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
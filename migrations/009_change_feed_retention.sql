@@ -0,0 +1,13 @@
+-- Change feed retention (see app/jobs/change_feed.py)
+-- (run outside a transaction: CONCURRENTLY keeps the feed writable meanwhile)
+
+-- Later entries of a subscription, looked up when superseded ones are deleted
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_subscription_changes_subscription
+    ON subscription_changes(subscription_id, txid, seq);
+
+-- Newest deleted tombstone: cursors before it have expired
+CREATE TABLE IF NOT EXISTS subscription_changes_horizon (
+    id INTEGER PRIMARY KEY,
+    txid BIGINT NOT NULL,
+    seq BIGINT NOT NULL
+);
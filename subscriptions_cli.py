@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Maintenance CLI for the subscriptions table
+
+Examples:
+    python subscriptions_cli.py dump ./dump --parts 8
+    python subscriptions_cli.py dump ./dump --format parquet --active-from 01-2025
+    python subscriptions_cli.py restore ./dump --jobs 8 --truncate
+    python subscriptions_cli.py archive --retention-months 24
+    SHARD_URLS=postgresql://...,postgresql://... python subscriptions_cli.py rebalance
+"""
+import argparse
+import sys
+import uuid
+from datetime import date, datetime
+
+
+def month_period(value: str) -> date:
+    """argparse type for MM-YYYY periods"""
+    try:
+        return datetime.strptime(value, "%m-%Y").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected MM-YYYY, got {value!r}")
+
+
+def shard_engine(index: int):
+    from app.database.sharding import shard_router
+
+    if not 0 <= index < shard_router.count:
+        raise ValueError(f"shard {index} does not exist ({shard_router.count} configured)")
+    return shard_router.engines[index]
+
+
+def cmd_dump(args):
+    from app.database import bulk
+
+    filters = {
+        "user_id": args.user_id,
+        "service_name": args.service_name,
+        "active_from": args.active_from,
+        "active_to": args.active_to,
+        "updated_since": args.updated_since,
+    }
+    manifest = bulk.dump(
+        args.directory,
+        fmt=args.format,
+        parts=args.parts,
+        filters={key: value for key, value in filters.items() if value is not None},
+        bind=shard_engine(args.shard)
+    )
+    print(f"✅ Dumped {manifest['rows']} subscriptions into {len(manifest['parts'])} {manifest['format']} parts")
+
+
+def cmd_restore(args):
+    from app.database import bulk
+
+    summary = bulk.restore(
+        args.directory,
+        jobs=args.jobs,
+        truncate=args.truncate,
+        rebuild_indexes=not args.keep_indexes,
+        disable_triggers=not args.keep_triggers,
+        maintenance_work_mem=args.maintenance_work_mem,
+        bind=shard_engine(args.shard)
+    )
+    print(
+        f"✅ Restored {summary['rows']} subscriptions "
+        f"(load {summary['load_seconds']}s, indexes {summary['index_seconds']}s)"
+    )
+    if not args.keep_triggers:
+        print("⚠️  Change feed triggers were disabled during the load: change feed consumers must resync")
+
+
+def cmd_archive(args):
+    from app.jobs.archive import Archiver, archive_cutoff
+
+    archiver = Archiver(retention_months=args.retention_months, batch_rows=args.batch_rows)
+    moved = archiver.run_once()
+    print(f"✅ Archived {moved} subscriptions ended before {archive_cutoff(args.retention_months)}")
+
+
+def cmd_rebalance(args):
+    from app.database.sharding import rebalance, shard_router
+
+    moved = rebalance(shard_router, batch_rows=args.batch_rows)
+    print(f"✅ Moved {moved} subscriptions, {shard_router.count} shards balanced")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Subscriptions table maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    dump = commands.add_parser("dump", help="Dump subscriptions to binary COPY or Parquet files")
+    dump.add_argument("directory", help="Output directory")
+    dump.add_argument("--format", choices=("binary", "parquet"), default="binary", help="File format")
+    dump.add_argument("--parts", type=int, default=4, help="Number of part files written in parallel")
+    dump.add_argument("--user-id", type=uuid.UUID, help="Only this user's subscriptions")
+    dump.add_argument("--service-name", help="Service name substring filter")
+    dump.add_argument("--active-from", type=month_period, help="Only subscriptions active at or after MM-YYYY")
+    dump.add_argument("--active-to", type=month_period, help="Only subscriptions active at or before MM-YYYY")
+    dump.add_argument("--updated-since", type=datetime.fromisoformat, help="Only rows updated since an ISO timestamp")
+    dump.add_argument("--shard", type=int, default=0, help="Shard to dump (index in SHARD_URLS)")
+    dump.set_defaults(func=cmd_dump)
+
+    restore = commands.add_parser("restore", help="Load a dump with parallel COPY workers")
+    restore.add_argument("directory", help="Dump directory")
+    restore.add_argument("--jobs", type=int, default=4, help="Parallel COPY and index build workers")
+    restore.add_argument("--truncate", action="store_true", help="Empty the table before loading")
+    restore.add_argument("--keep-indexes", action="store_true", help="Load with secondary indexes in place")
+    restore.add_argument("--keep-triggers", action="store_true", help="Keep the change feed trigger enabled")
+    restore.add_argument("--maintenance-work-mem", help="maintenance_work_mem for index builds, e.g. 1GB")
+    restore.add_argument("--shard", type=int, default=0, help="Shard to load into (index in SHARD_URLS)")
+    restore.set_defaults(func=cmd_restore)
+
+    from app.jobs.archive import ARCHIVE_BATCH_ROWS, ARCHIVE_RETENTION_MONTHS
+
+    archive = commands.add_parser("archive", help="Move expired subscriptions into the archive table now")
+    archive.add_argument("--retention-months", type=int, default=ARCHIVE_RETENTION_MONTHS, help="Months of ended subscriptions kept hot")
+    archive.add_argument("--batch-rows", type=int, default=ARCHIVE_BATCH_ROWS, help="Rows moved per transaction")
+    archive.set_defaults(func=cmd_archive)
+
+    from app.database.sharding import SHARD_REBALANCE_BATCH_ROWS
+
+    rebalance = commands.add_parser("rebalance", help="Move subscriptions to their user's shard after SHARD_URLS changed")
+    rebalance.add_argument("--batch-rows", type=int, default=SHARD_REBALANCE_BATCH_ROWS, help="Rows scanned per transaction")
+    rebalance.set_defaults(func=cmd_rebalance)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        args.func(args)
+    except Exception as e:
+        print(f"❌ {args.command} failed: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Micro-benchmark harness with regression gates
+
+Each benchmark is stored relative to a calibration workload of its category,
+so the baselines committed in baselines.json carry over between machines of
+similar architecture: pure-Python code is compared with a pure-Python loop,
+NumPy-bound code with a NumPy workload (the two do not speed up or slow down
+together). Benchmark and calibration are timed in alternation and each keeps
+its best repeat, so drifting machine speed affects both alike.
+
+Baselines are the median of BENCHMARK_UPDATE_RUNS such measurements. A check
+over the threshold is measured again, up to BENCHMARK_ATTEMPTS times, and
+fails only if every attempt is over it. NumPy-bound timings are noisier and
+get a wider threshold.
+
+    RUN_BENCHMARKS=true pytest tests/benchmarks           check against the baselines
+    BENCHMARK_UPDATE=true pytest tests/benchmarks         measure and rewrite the baselines
+    BENCHMARK_UPDATE_RUNS=9                               measurements per baseline
+    BENCHMARK_ATTEMPTS=3                                  measurements before a check fails
+    BENCHMARK_THRESHOLD=0.5                               allowed slowdown of pure-Python code (default 0.4)
+    BENCHMARK_NUMPY_THRESHOLD=1.0                         allowed slowdown of NumPy-bound code (default 0.6)
+
+Benchmarks need neither Postgres nor the network.
+"""
+import json
+import os
+import random
+import statistics
+import timeit
+from pathlib import Path
+from typing import Callable, Tuple
+
+import pytest
+
+BASELINES = Path(__file__).with_name("baselines.json")
+BENCHMARK_UPDATE = os.getenv("BENCHMARK_UPDATE", "False").lower() == "true"
+RUN_BENCHMARKS = BENCHMARK_UPDATE or os.getenv("RUN_BENCHMARKS", "False").lower() == "true"
+BENCHMARK_UPDATE_RUNS = int(os.getenv("BENCHMARK_UPDATE_RUNS", "9"))
+BENCHMARK_ATTEMPTS = int(os.getenv("BENCHMARK_ATTEMPTS", "3"))
+BENCHMARK_THRESHOLDS = {
+    "python": float(os.getenv("BENCHMARK_THRESHOLD", "0.4")),
+    "numpy": float(os.getenv("BENCHMARK_NUMPY_THRESHOLD", "0.6")),
+}
+
+MIN_RUN_SECONDS = 0.02
+REPEATS = 7
+
+_results = {}
+
+
+def _python_workload(data=tuple(random.Random(0).randrange(10 ** 6) for _ in range(2000))):
+    counts = {}
+    for value in sorted(data):
+        counts[value % 97] = counts.get(value % 97, 0) + 1
+    return counts
+
+
+def _numpy_workload(_data={}):
+    """Masks, scatter-adds and prefix sums over 100k rows, like the analytics engine"""
+    import numpy as np
+
+    if not _data:
+        rng = np.random.default_rng(0)
+        _data["starts"] = rng.integers(0, 72, 100_000)
+        _data["prices"] = rng.integers(100, 1000, 100_000)
+    starts, prices = _data["starts"], _data["prices"]
+    selected = (starts >= 12) & (starts < 60)
+    cost = np.zeros(73, dtype=np.int64)
+    np.add.at(cost, starts[selected], prices[selected])
+    return np.cumsum(cost)
+
+
+CALIBRATIONS = {"python": _python_workload, "numpy": _numpy_workload}
+
+
+def _calls_per_repeat(timer: timeit.Timer) -> int:
+    number, elapsed = timer.autorange()
+    return max(1, int(number * MIN_RUN_SECONDS / max(elapsed, 1e-9)))
+
+
+def measure(fn: Callable, workload: Callable) -> Tuple[float, float]:
+    """
+    Best time per call of fn and of a calibration workload, timed in alternation
+
+    Returns:
+        (seconds per call of fn, seconds per call of the workload)
+    """
+    timers = [timeit.Timer(fn), timeit.Timer(workload)]
+    numbers = [_calls_per_repeat(timer) for timer in timers]
+    best = [float("inf"), float("inf")]
+    for _ in range(REPEATS):
+        for i, timer in enumerate(timers):
+            best[i] = min(best[i], timer.timeit(numbers[i]) / numbers[i])
+    return best[0], best[1]
+
+
+@pytest.fixture(scope="session", autouse=True)
+def benchmarks_enabled():
+    if not RUN_BENCHMARKS:
+        pytest.skip("benchmarks run with RUN_BENCHMARKS=true")
+
+
+@pytest.fixture
+def benchmark(request, benchmarks_enabled):
+    """
+    Time a callable and fail if it is slower than its baseline allows
+
+    The returned function takes the callable and its category ("python" or
+    "numpy"), which picks the calibration workload and the threshold.
+    """
+    def run(fn, category: str = "python"):
+        workload = CALIBRATIONS[category]
+        name = request.node.name
+        if BENCHMARK_UPDATE:
+            samples = [measure(fn, workload) for _ in range(BENCHMARK_UPDATE_RUNS)]
+            _results[name] = statistics.median(seconds / calibration for seconds, calibration in samples)
+            return statistics.median(seconds for seconds, _ in samples)
+
+        baselines = json.loads(BASELINES.read_text()) if BASELINES.exists() else {}
+        if name not in baselines:
+            pytest.fail(f"No baseline for {name}, record one with BENCHMARK_UPDATE=true")
+        threshold = BENCHMARK_THRESHOLDS[category]
+        limit = baselines[name] * (1 + threshold)
+        # A slowdown only counts when it shows up in every attempt
+        for _ in range(BENCHMARK_ATTEMPTS):
+            seconds, calibration = measure(fn, workload)
+            relative = seconds / calibration
+            if relative <= limit:
+                break
+        assert relative <= limit, (
+            f"{name} regressed: {relative:.4g} {category} calibration units per call, "
+            f"baseline {baselines[name]:.4g} (+{threshold:.0%} allowed), {seconds * 1e6:.1f}us per call"
+        )
+        return seconds
+
+    return run
+
+
+def pytest_sessionfinish(session):
+    if BENCHMARK_UPDATE and _results:
+        baselines = json.loads(BASELINES.read_text()) if BASELINES.exists() else {}
+        baselines.update({name: float(f"{value:.4g}") for name, value in _results.items()})
+        BASELINES.write_text(json.dumps(dict(sorted(baselines.items())), indent=2) + "\n")
@@ -0,0 +1,109 @@
+import logging
+import io
+import random
+import uuid
+from datetime import date, datetime
+from types import SimpleNamespace
+from typing import List
+
+import pytest
+from pydantic import TypeAdapter
+
+from app.jobs.reports import _merge
+from app.schemas.subscription import (
+    SubscriptionCostRequest,
+    SubscriptionCreate,
+    SubscriptionResponse,
+    parse_month_period
+)
+from app.utils.logger import setup_logger
+from app.utils.periods import format_month_index, month_index, month_index_to_date
+
+SERVICES = ["Yandex Plus", "Netflix Standard", "Spotify Premium", "Apple Music", "Kinopoisk"]
+
+def make_rows(count, seed=1):
+    rng = random.Random(seed)
+    users = [uuid.UUID(int=rng.getrandbits(128)) for _ in range(max(1, count // 5))]
+    rows = []
+    for i in range(count):
+        start = date(rng.randint(2020, 2025), rng.randint(1, 12), 1)
+        end = None if i % 3 == 0 else date(start.year + rng.randint(0, 3), rng.randint(1, 12), 1)
+        rows.append(SimpleNamespace(
+            id=uuid.UUID(int=rng.getrandbits(128)),
+            service_name=rng.choice(SERVICES),
+            price=rng.randint(100, 1000),
+            user_id=rng.choice(users),
+            start_date=start,
+            end_date=end if end is None or end >= start else None,
+            created_at=datetime(2025, 1, 1),
+            updated_at=datetime(2025, 1, 1)
+        ))
+    return rows
+
+def test_parse_month_period(benchmark):
+    benchmark(lambda: parse_month_period("07-2025"))
+
+def test_period_round_trip(benchmark):
+    benchmark(lambda: format_month_index(month_index(month_index_to_date(24306))))
+
+def test_validate_create(benchmark):
+    payload = {"service_name": " Yandex Plus ", "price": 400, "user_id": str(uuid.uuid4()),
+               "start_date": "07-2025", "end_date": "12-2025"}
+    benchmark(lambda: SubscriptionCreate.model_validate(payload))
+
+def test_validate_cost_request(benchmark):
+    payload = {"start_period": "01-2025", "end_period": "12-2025", "user_id": str(uuid.uuid4())}
+    benchmark(lambda: SubscriptionCostRequest.model_validate(payload))
+
+@pytest.mark.parametrize("count", [1, 100, 1000])
+def test_serialize_responses(benchmark, count):
+    """Rows to JSON the way the list route does: validate from attributes, then dump"""
+    rows = make_rows(count)
+    adapter = TypeAdapter(List[SubscriptionResponse])
+    benchmark(lambda: adapter.dump_json([SubscriptionResponse.model_validate(row) for row in rows]))
+
+@pytest.fixture(scope="module")
+def analytics():
+    pytest.importorskip("numpy")
+    from app.analytics.columnar import AnalyticsEngine, Segment, _encode_row
+
+    rows = make_rows(100_000, seed=2)
+    engine = AnalyticsEngine()
+    engine._adopt_main(Segment.build([[_encode_row(row) for row in rows]]), (0, 0))
+    return engine, rows[0].user_id
+
+def test_total_cost_all_users(benchmark, analytics):
+    engine, _ = analytics
+    benchmark(lambda: engine.total_cost(month_index(date(2024, 1, 1)), month_index(date(2024, 12, 1))), "numpy")
+
+def test_monthly_cost_all_users(benchmark, analytics):
+    engine, _ = analytics
+    benchmark(lambda: engine.monthly_cost(month_index(date(2024, 1, 1)), month_index(date(2024, 12, 1))), "numpy")
+
+def test_total_cost_one_user(benchmark, analytics):
+    engine, user_id = analytics
+    benchmark(lambda: engine.total_cost(month_index(date(2024, 1, 1)), month_index(date(2024, 12, 1)), user_id=user_id), "numpy")
+
+def test_merge_report_partials(benchmark):
+    """Coordinator side of a report job: summing 64 shard results"""
+    months = {date(2024, m, 1).isoformat(): [1000 * m, m] for m in range(1, 13)}
+    partials = [{"total_cost": 12000, "count": 12, "months": months} for _ in range(64)]
+    benchmark(lambda: _merge("cost", partials))
+
+@pytest.fixture
+def bench_logger():
+    """A logger set up like the application's, writing to memory"""
+    logger = setup_logger("benchmarks.hot_paths")
+    for handler in logger.handlers:
+        handler.setStream(io.StringIO())
+    yield logger
+    for handler in logger.handlers:
+        handler.setStream(io.StringIO())
+
+def test_log_info(benchmark, bench_logger):
+    subscription_id = uuid.uuid4()
+    benchmark(lambda: bench_logger.info(f"Subscription {subscription_id} retrieved successfully"))
+
+def test_log_below_level(benchmark, bench_logger):
+    """Messages under the configured level must stay close to free"""
+    benchmark(lambda: bench_logger.debug("Filtered out"))
@@ -0,0 +1,247 @@
+"""
+Query-plan regression suite
+
+Seeds the test database with a statistically realistic dataset, calls the
+subscription endpoints, captures the SQL each call issues and runs
+EXPLAIN (ANALYZE, BUFFERS) on every statement touching the subscription
+tables. A case fails when a plan scans one of them sequentially, when an
+index it is expected to use does not appear in its plans, or when its
+statements touch more shared buffers than its budget. Every run writes a
+report of the plans.
+
+    RUN_PLAN_CHECKS=true pytest tests/plans       seed, explain and check
+    PLAN_ROWS=200000                              subscriptions to seed
+    PLAN_REPORT=query_plans.md                    plan report file
+
+The dataset skews like production data: a long tail of services behind a few
+popular ones, most users with a handful of subscriptions and some with many,
+start dates weighted towards recent years, about 40% open-ended. Statistics
+are gathered (VACUUM ANALYZE) before any plan is taken, and again around
+every update or delete case: the buffers such a statement touches grow with
+the dead tuples and dirtied index pages left by earlier writes, so each one is
+measured against tables without them. Needs Postgres; the tables are dropped
+afterwards.
+"""
+import json
+import os
+import uuid
+from pathlib import Path
+
+import pytest
+from sqlalchemy import text
+
+from app.database.session import engine, Base
+
+RUN_PLAN_CHECKS = os.getenv("RUN_PLAN_CHECKS", "False").lower() == "true"
+PLAN_ROWS = int(os.getenv("PLAN_ROWS", "200000"))
+PLAN_REPORT = Path(os.getenv("PLAN_REPORT", "query_plans.md"))
+
+PLAN_SERVICES = 300
+PLAN_USERS = PLAN_ROWS // 4
+
+# Tables that must never be read with a sequential scan
+INDEXED_TABLES = {"subscriptions", "subscriptions_archive", "subscription_changes"}
+
+_SEED = [
+    """
+    INSERT INTO services (name)
+    SELECT 'Service ' || i FROM generate_series(1, :services) AS i
+    """,
+    # Service popularity ~ 1/rank-ish (power of a uniform), users likewise,
+    # start months weighted towards the end of 2019-2025
+    """
+    INSERT INTO subscriptions (id, service_id, price, user_id, start_date, end_date, created_at, updated_at)
+    SELECT
+        gen_random_uuid(),
+        1 + floor(:services * power(random(), 3))::int,
+        (100 + 50 * floor(random() * 40))::int,
+        md5('user-' || floor(:users * power(random(), 1.5))::int)::uuid,
+        s.start_date,
+        CASE WHEN random() < 0.4 THEN NULL
+             ELSE (s.start_date + (1 + floor(random() * 36)::int) * interval '1 month')::date END,
+        s.start_date + random() * interval '20 days',
+        s.start_date + random() * interval '20 days'
+    FROM generate_series(1, :rows) AS i
+    CROSS JOIN LATERAL (
+        SELECT (date '2019-01-01' + floor(84 * sqrt(random() + i * 0)) * interval '1 month')::date AS start_date
+    ) AS s
+    """,
+    # Subscriptions that ended before 2019 live in the archive
+    """
+    INSERT INTO subscriptions_archive (id, service_id, price, user_id, start_date, end_date, created_at, updated_at)
+    SELECT
+        gen_random_uuid(),
+        1 + floor(:services * power(random(), 3))::int,
+        (100 + 50 * floor(random() * 40))::int,
+        md5('user-' || floor(:users * power(random(), 1.5))::int)::uuid,
+        s.start_date,
+        (s.start_date + (1 + floor(random() * 12)::int) * interval '1 month')::date,
+        s.start_date,
+        s.start_date
+    FROM generate_series(1, :rows / 10) AS i
+    CROSS JOIN LATERAL (
+        SELECT (date '2015-01-01' + floor(36 * random() + i * 0) * interval '1 month')::date AS start_date
+    ) AS s
+    """,
+]
+
+
+def _node_label(node: dict) -> str:
+    label = node["Node Type"]
+    if "Index Name" in node:
+        label += f" using {node['Index Name']}"
+    if "Relation Name" in node:
+        label += f" on {node['Relation Name']}"
+    return label
+
+
+def walk(node: dict):
+    """Every node of a JSON plan tree, depth first"""
+    yield node
+    for child in node.get("Plans", []):
+        yield from walk(child)
+
+
+def render(node: dict, depth: int = 0) -> list:
+    """Plan tree as indented text lines with actual rows and buffers"""
+    buffers = node.get("Shared Hit Blocks", 0) + node.get("Shared Read Blocks", 0)
+    line = (
+        f"{'  ' * depth}-> {_node_label(node)} "
+        f"(rows={node.get('Actual Rows', 0)} loops={node.get('Actual Loops', 0)} buffers={buffers})"
+    )
+    lines = [line]
+    for key in ("Index Cond", "Recheck Cond", "Filter", "Hash Cond", "Join Filter"):
+        if key in node:
+            lines.append(f"{'  ' * depth}     {key}: {node[key]}")
+    for child in node.get("Plans", []):
+        lines.extend(render(child, depth + 1))
+    return lines
+
+
+class StatementPlan:
+    """EXPLAIN (ANALYZE, BUFFERS) output of one captured statement"""
+
+    def __init__(self, statement: str, plan: dict):
+        self.statement = statement
+        self.root = plan["Plan"]
+        self.execution_ms = plan.get("Execution Time", 0.0)
+        self.buffers = self.root.get("Shared Hit Blocks", 0) + self.root.get("Shared Read Blocks", 0)
+        nodes = list(walk(self.root))
+        self.indexes = {node["Index Name"] for node in nodes if "Index Name" in node}
+        self.seq_scans = {
+            node["Relation Name"] for node in nodes
+            if node["Node Type"] == "Seq Scan" and node.get("Relation Name") in INDEXED_TABLES
+        }
+
+
+def touches_indexed_tables(statement: str) -> bool:
+    lowered = statement.lower()
+    return not lowered.lstrip().startswith("explain") and any(table in lowered for table in INDEXED_TABLES)
+
+
+def explain(statement: str, parameters) -> StatementPlan:
+    """
+    Run a captured statement under EXPLAIN (ANALYZE, BUFFERS) and roll it back
+
+    Inserts are replayed with a fresh id, since the endpoint already
+    inserted the row under the original one.
+    """
+    if isinstance(parameters, dict) and statement.lstrip().upper().startswith("INSERT") and "id" in parameters:
+        parameters = {**parameters, "id": str(uuid.uuid4())}
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement}", parameters or None)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return StatementPlan(statement, plan[0])
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+_report = []
+
+
+def report(case: str, plans: list, failures: list):
+    """Add a case to the plan report"""
+    lines = [f"## {case}", "", f"Status: {'FAIL' if failures else 'ok'}"]
+    lines += [f"- {failure}" for failure in failures]
+    for plan in plans:
+        lines += [
+            "",
+            f"Buffers: {plan.buffers}, execution: {plan.execution_ms:.2f}ms",
+            "",
+            "```sql",
+            plan.statement.strip(),
+            "```",
+            "```",
+            *render(plan.root),
+            "```",
+        ]
+    _report.append("\n".join(lines))
+
+
+def vacuum():
+    """Remove dead tuples from the indexed tables and refresh their statistics"""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"VACUUM ANALYZE {', '.join(sorted(INDEXED_TABLES))}"))
+
+
+@pytest.fixture(scope="session", autouse=True)
+def plan_checks_enabled():
+    if not RUN_PLAN_CHECKS:
+        pytest.skip("plan checks run with RUN_PLAN_CHECKS=true")
+
+
+@pytest.fixture(scope="session")
+def dataset(plan_checks_enabled):
+    """Seed the tables and return identifiers the cases query by"""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for statement in _SEED:
+            conn.execute(text(statement), {"services": PLAN_SERVICES, "users": PLAN_USERS, "rows": PLAN_ROWS})
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM ANALYZE"))
+        # A typical user: a few subscriptions, some of them archived
+        user_id = conn.execute(text(
+            """
+            SELECT user_id FROM subscriptions
+            WHERE user_id IN (SELECT user_id FROM subscriptions_archive)
+            GROUP BY user_id HAVING count(*) BETWEEN 3 AND 8
+            ORDER BY user_id LIMIT 1
+            """
+        )).scalar()
+        user_rows = conn.execute(
+            text("SELECT count(*) FROM subscriptions WHERE user_id = :user_id"), {"user_id": user_id}
+        ).scalar()
+        heavy_user_id = conn.execute(
+            text("SELECT user_id FROM subscriptions GROUP BY user_id ORDER BY count(*) DESC LIMIT 1")
+        ).scalar()
+        subscription_id = conn.execute(
+            text("SELECT id FROM subscriptions WHERE user_id = :user_id ORDER BY id LIMIT 1"), {"user_id": user_id}
+        ).scalar()
+        other_ids = conn.execute(
+            text("SELECT id FROM subscriptions WHERE user_id <> :user_id ORDER BY id LIMIT 2"), {"user_id": user_id}
+        ).scalars().all()
+    yield {
+        "user_id": str(user_id),
+        # Its subscriptions in the hot table
+        "user_rows": user_rows,
+        # The user with the most subscriptions (over a hundred)
+        "heavy_user_id": str(heavy_user_id),
+        "subscription_id": str(subscription_id),
+        "other_ids": [str(other_id) for other_id in other_ids],
+        # Mid-popularity service, a name matching no other
+        "service_name": "Service 97",
+    }
+    Base.metadata.drop_all(bind=engine)
+
+
+def pytest_sessionfinish(session):
+    if _report:
+        PLAN_REPORT.write_text(
+            f"# Query plans ({PLAN_ROWS} subscriptions)\n\n" + "\n\n".join(_report) + "\n"
+        )
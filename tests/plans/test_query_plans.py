@@ -0,0 +1,165 @@
+"""
+Plans of the SQL behind each subscription endpoint (see conftest.py)
+
+Each case names the indexes its statements must use between them (as glob
+patterns) and a budget of shared buffers (hit + read, 8kB pages) for all its statements.
+Updates and deletes get what finding their rows takes plus ROW_WRITE_BUFFERS
+per changed row. Cases cover the shapes an index is meant to serve; reports
+over a wide period for all users legitimately read most of the table and are
+left out.
+"""
+import fnmatch
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.database.instrumentation import capture_queries
+from app.main import app
+from app.models.subscription import Subscription
+
+from tests.plans.conftest import explain, report, touches_indexed_tables, vacuum
+
+client = TestClient(app)
+
+# Any of a user's indexes serves a user with a few subscriptions (the page is
+# sorted in memory); a user with many must be read in the sort's index order
+USER_INDEX = "idx_subscriptions_user_*"
+
+# Methods of the cases changing existing rows
+UPDATE_METHODS = {"PUT", "PATCH", "DELETE"}
+
+# Buffers one changed row may touch: its heap page and the one its new version
+# goes to, a descent of every index (pkey included) when the new version does
+# not fit on the old page, and the change feed row with its indexes
+ROW_WRITE_BUFFERS = 2 + 4 * (len(Subscription.__table__.indexes) + 1) + 8
+
+
+def per_user_row(base: int = 20):
+    """Budget of a write over all of the user's subscriptions: finding them, then changing each"""
+    return lambda names: base + ROW_WRITE_BUFFERS * names["user_rows"]
+
+
+CASES = [
+    # (case, method, path, request arguments, index patterns each matching a used index,
+    #  buffer budget, or a function of the dataset giving it)
+    ("create", "POST", "/subscriptions/",
+     {"json": {"service_name": "Service 97", "price": 500, "user_id": "{user_id}", "start_date": "01-2025"}},
+     [], 60),
+    ("get", "GET", "/subscriptions/{subscription_id}", {},
+     ["subscriptions_pkey"], 20),
+    ("batch get", "POST", "/subscriptions/batch-get",
+     {"json": {"ids": ["{subscription_id}", "{other_id}", "{missing_id}"]}},
+     ["subscriptions_pkey", "subscriptions_archive_pkey"], 40),
+    ("update", "PUT", "/subscriptions/{subscription_id}", {"json": {"price": 900}},
+     ["subscriptions_pkey"], 10 + ROW_WRITE_BUFFERS),
+    ("delete", "DELETE", "/subscriptions/{other_id}", {},
+     ["subscriptions_pkey"], 40),
+    ("list by user", "GET", "/subscriptions/", {"params": {"user_id": "{user_id}"}},
+     [USER_INDEX], 30),
+    ("list by heavy user", "GET", "/subscriptions/", {"params": {"user_id": "{heavy_user_id}", "limit": 20}},
+     ["idx_subscriptions_user_created_at"], 100),
+    ("list by heavy user, by start date", "GET", "/subscriptions/",
+     {"params": {"user_id": "{heavy_user_id}", "sort": "-start_date", "limit": 20}},
+     ["idx_subscriptions_user_start_date"], 100),
+    ("list by heavy user, by end date", "GET", "/subscriptions/",
+     {"params": {"user_id": "{heavy_user_id}", "sort": "end_date", "limit": 20}},
+     ["idx_subscriptions_user_end_date"], 100),
+    ("list newest", "GET", "/subscriptions/", {"params": {"sort": "-created_at"}},
+     ["idx_subscriptions_created_at"], 400),
+    ("list by start date", "GET", "/subscriptions/", {"params": {"sort": "start_date"}},
+     ["idx_subscriptions_start_date_id"], 400),
+    ("list by end date", "GET", "/subscriptions/", {"params": {"sort": "-end_date"}},
+     ["idx_subscriptions_end_date_id"], 400),
+    ("list active in an old month", "GET", "/subscriptions/", {"params": {"active_at": "03-2019", "sort": "start_date"}},
+     ["idx_subscriptions_start_date_id"], 500),
+    ("list by service", "GET", "/subscriptions/", {"params": {"service_name": "{service_name}"}},
+     ["idx_subscriptions_service_id"], 700),
+    ("list by user with total", "GET", "/subscriptions/", {"params": {"user_id": "{user_id}", "with_total": "true"}},
+     [USER_INDEX], 30),
+    ("list by user with archive", "GET", "/subscriptions/", {"params": {"user_id": "{user_id}", "include_archived": "true"}},
+     [USER_INDEX, "idx_subscriptions_archive_user_id"], 30),
+    ("cost by user", "GET", "/subscriptions/cost/",
+     {"params": {"start_period": "01-2024", "end_period": "12-2024", "user_id": "{user_id}"}},
+     [USER_INDEX], 30),
+    ("cost by user reaching into the archive", "GET", "/subscriptions/cost/",
+     {"params": {"start_period": "01-2017", "end_period": "12-2024", "user_id": "{user_id}"}},
+     [USER_INDEX, "idx_subscriptions_archive_user_id"], 30),
+    ("cost by service", "GET", "/subscriptions/cost/",
+     {"params": {"start_period": "01-2024", "end_period": "03-2024", "service_name": "{service_name}"}},
+     ["idx_subscriptions_service_id"], 700),
+    ("cost in an old month", "GET", "/subscriptions/cost/",
+     {"params": {"start_period": "02-2019", "end_period": "02-2019"}},
+     ["idx_subscriptions_start_date_id"], 200),
+    ("monthly cost by user", "GET", "/subscriptions/cost/monthly/",
+     {"params": {"start_period": "01-2024", "end_period": "12-2024", "user_id": "{user_id}"}},
+     [USER_INDEX], 30),
+    ("changes since a cursor", "GET", "/subscriptions/changes", {"params": {"since": "{cursor}", "limit": 100}},
+     ["idx_subscription_changes_cursor", "subscriptions_pkey"], 1200),
+    ("bulk update dry run by user", "PATCH", "/subscriptions/bulk",
+     {"params": {"user_id": "{user_id}", "dry_run": "true"}, "json": {"price": 700}},
+     [USER_INDEX], 30),
+    ("bulk update by user", "PATCH", "/subscriptions/bulk",
+     {"params": {"user_id": "{user_id}"}, "json": {"price": 700}},
+     [USER_INDEX], per_user_row()),
+    ("bulk delete by user", "DELETE", "/subscriptions/bulk", {"params": {"user_id": "{user_id}"}},
+     [USER_INDEX], per_user_row()),
+]
+
+
+def fill(value, names: dict):
+    """Substitute dataset identifiers into a request template"""
+    if isinstance(value, str):
+        return value.format(**names)
+    if isinstance(value, dict):
+        return {key: fill(item, names) for key, item in value.items()}
+    if isinstance(value, list):
+        return [fill(item, names) for item in value]
+    return value
+
+
+@pytest.fixture(scope="module")
+def names(dataset):
+    # A cursor inside the seeded change feed
+    cursor = client.get("/subscriptions/changes", params={"limit": 1}).json()["next_cursor"]
+    return {**dataset, "other_id": dataset["other_ids"][0], "missing_id": str(uuid.uuid4()), "cursor": cursor}
+
+
+@pytest.mark.parametrize(
+    "case, method, path, request_args, index_patterns, buffer_budget", CASES, ids=[case[0] for case in CASES]
+)
+def test_endpoint_plan(names, case, method, path, request_args, index_patterns, buffer_budget):
+    # Updates and deletes are measured against a table without the dead
+    # tuples of earlier cases (inserts just append)
+    writes = method in UPDATE_METHODS
+    if writes:
+        vacuum()
+    with capture_queries() as captured:
+        response = client.request(method, fill(path, names), **fill(request_args, names))
+    assert response.status_code < 400, response.text
+    if writes:
+        # The plans replay the write; clear the tuples the request itself left
+        vacuum()
+
+    plans = [
+        explain(statement, parameters)
+        for statement, parameters in captured.statements
+        if touches_indexed_tables(statement)
+    ]
+    failures = []
+    for plan in plans:
+        if plan.seq_scans:
+            failures.append(f"sequential scan on {', '.join(sorted(plan.seq_scans))}")
+    used = set().union(*(plan.indexes for plan in plans))
+    missing = [pattern for pattern in index_patterns if not fnmatch.filter(used, pattern)]
+    if missing:
+        failures.append(f"no index used matching {', '.join(missing)} (used: {', '.join(sorted(used)) or 'none'})")
+    buffers = sum(plan.buffers for plan in plans)
+    if callable(buffer_budget):
+        buffer_budget = buffer_budget(names)
+    if buffers > buffer_budget:
+        failures.append(f"{buffers} buffers, budget {buffer_budget}")
+    report(case, plans, failures)
+
+    assert plans, "no statement touched the subscription tables"
+    assert not failures, f"{case}: " + "; ".join(failures)
@@ -0,0 +1,74 @@
+import asyncio
+import httpx
+from fastapi import FastAPI
+from app.middleware.admission import AdmissionControlMiddleware, ConcurrencyLimiter, rejected_requests, route_class
+
+def make_app(release):
+    app = FastAPI()
+    app.add_middleware(AdmissionControlMiddleware, limits="analytics=1:1,read=2:2", queue_timeout_ms=5000)
+
+    @app.get("/subscriptions/cost/")
+    async def cost():
+        await release.wait()
+        return {"total_cost": 0}
+
+    @app.get("/subscriptions/{subscription_id}")
+    async def get_subscription(subscription_id: str):
+        return {"id": subscription_id}
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy"}
+
+    return app
+
+def test_route_classes():
+    """Requests are split into analytics, read, write and unlimited classes"""
+    assert route_class("GET", "/subscriptions/cost/monthly/") == "analytics"
+    assert route_class("GET", "/subscriptions/123") == "read"
+    assert route_class("POST", "/subscriptions/") == "write"
+    assert route_class("POST", "/subscriptions/batch-get") == "read"
+    assert route_class("GET", "/health") == "unlimited"
+
+def test_cost_storm_is_shed_while_point_reads_pass():
+    """Excess cost queries get a fast 503 and point reads are not affected"""
+    async def scenario():
+        release = asyncio.Event()
+        transport = httpx.ASGITransport(app=make_app(release))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            rejected_before = rejected_requests.value(route_class="analytics", reason="queue_full")
+            storm = [asyncio.create_task(client.get("/subscriptions/cost/")) for _ in range(5)]
+            await asyncio.sleep(0.1)
+
+            read = await client.get("/subscriptions/abc")
+            health = await client.get("/health")
+            release.set()
+            responses = await asyncio.gather(*storm)
+            rejected = rejected_requests.value(route_class="analytics", reason="queue_full") - rejected_before
+            return read, health, responses, rejected
+
+    read, health, responses, rejected = asyncio.run(scenario())
+
+    assert read.status_code == 200
+    assert health.status_code == 200
+    statuses = sorted(r.status_code for r in responses)
+    # One request running, one queued, the rest shed
+    assert statuses == [200, 200, 503, 503, 503]
+    assert all(r.headers["retry-after"] == "1" for r in responses if r.status_code == 503)
+    assert rejected == 3
+
+def test_cancelled_waiter_gives_up_its_place():
+    """A request cancelled while queued does not keep the slot released after it"""
+    async def scenario():
+        limiter = ConcurrencyLimiter("test", limit=1, queue_size=1, timeout=0.2)
+        await limiter.acquire()
+        queued = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        limiter.release()
+        assert limiter.active == 0 and not limiter._waiters
+        await limiter.acquire()
+        assert limiter.active == 1
+
+    asyncio.run(scenario())
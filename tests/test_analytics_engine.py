@@ -0,0 +1,79 @@
+import pytest
+import random
+import uuid
+from datetime import date
+from sqlalchemy.orm import sessionmaker
+from app.database.session import engine, Base
+from app.repositories import subscription_repository
+from app.utils.periods import month_index, month_index_to_date
+
+pytest.importorskip("numpy")
+
+from app.analytics.columnar import AnalyticsEngine
+
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+USERS = [uuid.uuid4() for _ in range(5)]
+SERVICES = ["Yandex Plus", "Netflix Standard", "Spotify Premium", "Apple Music"]
+
+@pytest.fixture(scope="module")
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = TestingSessionLocal()
+    rng = random.Random(42)
+    rows = []
+    for _ in range(300):
+        start = date(rng.randint(2023, 2025), rng.randint(1, 12), rng.choice([1, 1, 15]))
+        end = None if rng.random() < 0.3 else date(start.year + rng.randint(0, 2), rng.randint(1, 12), rng.choice([1, 28]))
+        if end is not None and end < start:
+            end = None
+        rows.append({
+            "service_name": rng.choice(SERVICES),
+            "price": rng.randint(100, 1000),
+            "user_id": rng.choice(USERS),
+            "start_date": start,
+            "end_date": end
+        })
+    subscription_repository.create_many(session, rows)
+    yield session
+    session.close()
+    Base.metadata.drop_all(bind=engine)
+
+@pytest.mark.parametrize("user_index,service_name", [(None, None), (0, None), (None, "music"), (2, "net")])
+def test_engine_matches_sql(db, user_index, service_name):
+    """The columnar snapshot answers cost queries exactly like SQL"""
+    analytics = AnalyticsEngine(bind=engine)
+    analytics.refresh()
+    user_id = USERS[user_index] if user_index is not None else None
+
+    start, end = date(2024, 3, 1), date(2025, 6, 1)
+    assert analytics.total_cost(month_index(start), month_index(end), user_id, service_name) == \
+        subscription_repository.total_cost(db, start, end, user_id, service_name)
+
+    monthly = analytics.monthly_cost(month_index(start), month_index(end), user_id, service_name)
+    assert [(month_index_to_date(m), total, count) for m, total, count in monthly] == \
+        subscription_repository.monthly_cost(db, start, end, user_id, service_name)
+
+def test_engine_applies_updates(db):
+    """Rows changed after the snapshot was built are picked up by the next refresh"""
+    analytics = AnalyticsEngine(bind=engine)
+    analytics.refresh()
+    period = (month_index(date(2025, 1, 1)), month_index(date(2025, 1, 1)))
+    before = analytics.total_cost(*period, USERS[4])
+
+    row = subscription_repository.create(db, {
+        "service_name": "Yandex Plus",
+        "price": 777,
+        "user_id": USERS[4],
+        "start_date": date(2024, 1, 1)
+    })
+    analytics.refresh()
+    assert analytics.total_cost(*period, USERS[4]) == (before[0] + 777, before[1] + 1)
+
+    subscription_repository.update_fields(db, row.id, {"price": 100})
+    analytics.refresh()
+    assert analytics.total_cost(*period, USERS[4]) == (before[0] + 100, before[1] + 1)
+
+    subscription_repository.delete_by_id(db, row.id)
+    analytics.refresh()
+    assert analytics.total_cost(*period, USERS[4]) == before
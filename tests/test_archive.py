@@ -0,0 +1,119 @@
+import pytest
+import uuid
+from datetime import date
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+from fastapi.testclient import TestClient
+from app.database.session import engine, Base
+from app.jobs.archive import Archiver, archive_cutoff, archiver
+from app.main import app
+from app.repositories import subscription_repository
+
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = TestingSessionLocal()
+    yield session
+    session.close()
+    Base.metadata.drop_all(bind=engine)
+
+def seed(db):
+    expired = subscription_repository.create_many(db, [
+        {"id": uuid.uuid4(), "service_name": "Old", "price": 100 + i, "user_id": uuid.uuid4(),
+         "start_date": date(2018, 1, 1), "end_date": date(2019, 1 + i, 1)}
+        for i in range(5)
+    ])
+    live = subscription_repository.create_many(db, [
+        {"id": uuid.uuid4(), "service_name": "New", "price": 500, "user_id": uuid.uuid4(),
+         "start_date": date(2018, 6, 1), "end_date": None}
+    ])
+    return expired, live
+
+def feed_size(db):
+    return db.execute(select(func.count()).select_from(subscription_repository.changes)).scalar()
+
+def test_archive_cutoff():
+    """The cutoff is the first day of the month retention_months ago"""
+    assert archive_cutoff(24, today=date(2025, 3, 17)) == date(2023, 3, 1)
+
+def test_archive_moves_expired_rows(db):
+    """Expired rows move in batches, stay readable and reappear in old periods"""
+    expired, live = seed(db)
+    period = (date(2019, 1, 1), date(2019, 12, 1))
+    before = subscription_repository.total_cost(db, *period)
+    changes_before = feed_size(db)
+    db.commit()
+
+    archiver = Archiver(enabled=True, retention_months=24, batch_rows=2, batch_pause_ms=0, boundary_ttl_seconds=0)
+    assert archiver.run_once() == 5
+
+    assert [row.id for row in subscription_repository.list_filtered(db, 0, 100)] == [live[0].id]
+    assert len(subscription_repository.list_filtered(db, 0, 100, include_archive=True)) == 6
+    assert subscription_repository.get(db, expired[0].id).price == expired[0].price
+    batch = subscription_repository.get_many(db, [expired[0].id, live[0].id, uuid.uuid4()])
+    assert {row.id for row in batch} == {expired[0].id, live[0].id}
+    assert feed_size(db) == changes_before
+
+    assert archiver.includes_period(db, date(2019, 6, 1))
+    assert not archiver.includes_period(db, date.today().replace(day=1))
+    assert subscription_repository.total_cost(db, *period, include_archive=True) == before
+    assert subscription_repository.total_cost(db, *period) == (500, 1)
+
+def test_period_lists_reach_into_the_archive(db, monkeypatch):
+    """Lists for a period before the archive's boundary include archived rows by themselves"""
+    expired, live = seed(db)
+    db.commit()
+    Archiver(retention_months=24, batch_pause_ms=0).run_once()
+    monkeypatch.setattr(archiver, "_boundaries", {})
+    client = TestClient(app)
+
+    def listed(**params):
+        response = client.get("/subscriptions/", params={"sort": "start_date", **params})
+        assert response.status_code == 200
+        return sorted(row["id"] for row in response.json())
+
+    archived_ids = sorted(str(row.id) for row in expired)
+    assert listed(active_to="01-2020", service_name="Old") == archived_ids
+    assert listed(active_at="05-2019", service_name="Old") == [str(expired[4].id)]
+    assert listed(active_from="01-2025") == [str(live[0].id)]
+    # Without a period only the hot table is listed, as before
+    assert listed() == [str(live[0].id)]
+
+def test_writes_reach_archived_rows(db):
+    """Updating an archived row brings it back, deleting it leaves a tombstone"""
+    expired, _ = seed(db)
+    db.commit()
+    Archiver(retention_months=24, batch_pause_ms=0).run_once()
+
+    updated = subscription_repository.update_fields(db, expired[0].id, {"end_date": None})
+    assert updated.end_date is None
+    assert [row.id for row in subscription_repository.list_filtered(db, 0, 100, service_name="Old")] == [expired[0].id]
+
+    assert subscription_repository.delete_by_id(db, expired[1].id)
+    assert subscription_repository.get(db, expired[1].id) is None
+    _, deletes, _, _ = subscription_repository.changes_since(db, (0, 0), 1000)
+    assert deletes == [expired[1].id]
+
+def test_conditional_writes_reach_archived_rows(db):
+    """If-Match versions are checked on archived rows before they are brought back"""
+    expired, _ = seed(db)
+    db.commit()
+    Archiver(retention_months=24, batch_pause_ms=0).run_once()
+
+    # A stale conditional write leaves the row where it was
+    with pytest.raises(subscription_repository.VersionConflict):
+        subscription_repository.update_fields(db, expired[0].id, {"end_date": None}, versions=[2])
+    db.rollback()
+    assert subscription_repository.list_filtered(db, 0, 100, service_name="Old") == []
+
+    updated = subscription_repository.update_fields(db, expired[0].id, {"end_date": None}, versions=[1])
+    assert (updated.end_date, updated.version) == (None, 2)
+    assert [row.id for row in subscription_repository.list_filtered(db, 0, 100, service_name="Old")] == [expired[0].id]
+
+    with pytest.raises(subscription_repository.VersionConflict):
+        subscription_repository.delete_by_id(db, expired[1].id, versions=[5])
+    db.rollback()
+    assert subscription_repository.delete_by_id(db, expired[1].id, versions=[1])
+    assert subscription_repository.get(db, expired[1].id) is None
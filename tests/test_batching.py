@@ -0,0 +1,65 @@
+import pytest
+import uuid
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.orm import sessionmaker
+from app.database.session import engine, Base
+from app.database.batching import GroupCommitter
+
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@pytest.fixture(scope="module")
+def test_db():
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+def make_row(price=500):
+    return {
+        "service_name": "Batched Service",
+        "price": price,
+        "user_id": uuid.uuid4(),
+        "start_date": date(2025, 1, 1),
+        "end_date": None
+    }
+
+def test_group_commit_returns_each_row(test_db):
+    """Concurrent submits are flushed together and each caller gets its own row"""
+    committer = GroupCommitter(session_factory=TestingSessionLocal, max_delay_ms=50, max_rows=10)
+    rows = [make_row(price=100 + i) for i in range(10)]
+
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        results = list(pool.map(committer.submit, rows))
+    committer.close()
+
+    assert [r.price for r in results] == [row["price"] for row in rows]
+    assert len({r.id for r in results}) == len(rows)
+
+def test_group_commit_isolates_errors(test_db):
+    """A failing row does not fail the other rows of its batch"""
+    committer = GroupCommitter(session_factory=TestingSessionLocal, max_delay_ms=50, max_rows=10)
+    good, bad = make_row(), make_row()
+    bad["service_name"] = None  # violates NOT NULL
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        good_future = pool.submit(committer.submit, good)
+        bad_future = pool.submit(committer.submit, bad)
+        assert good_future.result().service_name == "Batched Service"
+        with pytest.raises(Exception):
+            bad_future.result()
+    committer.close()
+
+def test_group_commit_survives_session_failures(test_db):
+    """A batch that cannot get a session fails its callers, and later batches still go through"""
+    failures = [RuntimeError("database is down")]
+
+    def flaky_session():
+        if failures:
+            raise failures.pop()
+        return TestingSessionLocal()
+
+    committer = GroupCommitter(session_factory=flaky_session, max_delay_ms=1, max_rows=10, result_timeout_ms=5000)
+    with pytest.raises(RuntimeError):
+        committer.submit(make_row())
+    assert committer.submit(make_row(price=700)).price == 700
+    committer.close()
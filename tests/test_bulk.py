@@ -0,0 +1,107 @@
+import pytest
+import uuid
+from datetime import date
+from sqlalchemy import select, text
+from sqlalchemy.orm import sessionmaker
+from app.database import bulk
+from app.database.session import engine, Base
+from app.repositories import subscription_repository
+
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@pytest.fixture
+def seeded():
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    subscription_repository.create_many(db, [
+        {
+            "id": uuid.uuid4(),
+            "service_name": f"Bulk Service {i % 4}",
+            "price": 100 + i,
+            "user_id": uuid.uuid4(),
+            "start_date": date(2024, 1 + i % 12, 1),
+            "end_date": date(2025, 6, 1) if i % 3 else None
+        }
+        for i in range(60)
+    ])
+    yield db
+    db.close()
+    Base.metadata.drop_all(bind=engine)
+
+def table_rows(db):
+    columns = subscription_repository.subscriptions.c
+    return sorted(db.execute(select(*columns)).all())
+
+@pytest.mark.parametrize("fmt", ["binary", "parquet"])
+def test_dump_restore_round_trip(seeded, tmp_path, fmt):
+    """A restored dump reproduces the table, its indexes and triggers"""
+    if fmt == "parquet":
+        pytest.importorskip("pyarrow")
+    before = table_rows(seeded)
+    seeded.commit()
+
+    manifest = bulk.dump(str(tmp_path), fmt=fmt, parts=3)
+    assert manifest["rows"] == len(before) == sum(part["rows"] for part in manifest["parts"])
+
+    summary = bulk.restore(str(tmp_path), jobs=2, truncate=True)
+    assert "idx_subscriptions_user_created_at" in summary["indexes"]
+    assert table_rows(seeded) == before
+
+    indexes = seeded.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = 'subscriptions'")).scalars().all()
+    assert set(summary["indexes"]) <= set(indexes)
+    trigger = seeded.execute(text("SELECT tgenabled FROM pg_trigger WHERE tgname = 'subscriptions_change_feed'")).scalar()
+    assert trigger == "O"
+
+def test_dump_filters(seeded, tmp_path):
+    """Only rows matching the filters are dumped"""
+    manifest = bulk.dump(str(tmp_path), parts=2, filters={"service_name": "Service 1", "active_to": date(2024, 3, 1)})
+    expected = sum(
+        1 for row in subscription_repository.list_filtered(seeded, 0, 10000)
+        if row.service_name == "Bulk Service 1" and row.start_date <= date(2024, 3, 1)
+    )
+    assert manifest["rows"] == expected > 0
+
+def test_restore_maps_service_ids(seeded, tmp_path):
+    """Rows keep their service names when the target numbers services differently"""
+    def named(db):
+        return sorted((row.id, row.service_name) for row in subscription_repository.list_filtered(db, 0, 10000))
+
+    before = named(seeded)
+    seeded.commit()
+    bulk.dump(str(tmp_path), parts=2)
+
+    seeded.execute(text("TRUNCATE subscriptions, subscriptions_archive, services RESTART IDENTITY"))
+    seeded.execute(text("INSERT INTO services (name) VALUES ('Unrelated'), ('Bulk Service 3')"))
+    seeded.commit()
+
+    summary = bulk.restore(str(tmp_path), jobs=2)
+    assert summary["remapped_services"]
+    assert named(seeded) == before
+
+def test_parquet_dump_keeps_multiline_names(seeded, tmp_path):
+    """Service names with newlines, quotes and commas survive a Parquet dump"""
+    pytest.importorskip("pyarrow")
+    subscription_repository.create_many(seeded, [
+        {
+            "id": uuid.uuid4(),
+            "service_name": name,
+            "price": 500,
+            "user_id": uuid.uuid4(),
+            "start_date": date(2024, 1, 1),
+            "end_date": None
+        }
+        for name in ["Multi\nline", 'Quoted "name", with comma', "Windows\r\nline"]
+    ])
+    def named(db):
+        return sorted((row.id, row.service_name) for row in subscription_repository.list_filtered(db, 0, 10000))
+
+    before = named(seeded)
+    seeded.commit()
+
+    manifest = bulk.dump(str(tmp_path), fmt="parquet", parts=2)
+    assert manifest["rows"] == len(before)
+
+    seeded.execute(text("TRUNCATE subscriptions, subscriptions_archive, services RESTART IDENTITY"))
+    seeded.commit()
+    bulk.restore(str(tmp_path), jobs=2)
+    assert named(seeded) == before
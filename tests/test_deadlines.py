@@ -0,0 +1,160 @@
+import asyncio
+import threading
+import time
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import text
+
+from app.database.session import SessionLocal
+from app.middleware.admission import AdmissionControlMiddleware
+from app.middleware.deadline import DeadlineMiddleware
+from app.utils.deadline import Deadline, DeadlineExceeded, cancelled_statements, set_deadline, reset_deadline, timed_out_requests
+from app.utils.singleflight import SingleFlight
+
+def make_app(deadlines="read=300,write=10000"):
+    app = FastAPI()
+    app.add_middleware(DeadlineMiddleware, deadlines=deadlines)
+
+    @app.get("/subscriptions/slow")
+    def slow():
+        db = SessionLocal()
+        try:
+            db.execute(text("SELECT pg_sleep(5)"))
+            return {"done": True}
+        finally:
+            db.close()
+
+    @app.post("/subscriptions/timeout")
+    def statement_timeout():
+        db = SessionLocal()
+        try:
+            return {"statement_timeout": db.execute(text("SHOW statement_timeout")).scalar()}
+        finally:
+            db.close()
+
+    return app
+
+def request(app, method, path, **kwargs):
+    async def call():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.request(method, path, **kwargs)
+    return asyncio.run(call())
+
+def test_slow_query_is_cancelled_at_the_deadline():
+    """A statement running past the route's deadline is cancelled and the request gets 504"""
+    app = make_app()
+    before = timed_out_requests.value(route_class="read", reason="deadline")
+
+    started = time.perf_counter()
+    response = request(app, "GET", "/subscriptions/slow")
+    assert response.status_code == 504
+    assert time.perf_counter() - started < 2
+    assert timed_out_requests.value(route_class="read", reason="deadline") == before + 1
+
+    # The client may shorten the deadline, not extend it; each transaction
+    # gets the time left as its statement_timeout
+    response = request(app, "POST", "/subscriptions/timeout", headers={"X-Request-Timeout": "2.5"})
+    timeout = response.json()["statement_timeout"]
+    assert timeout.endswith("ms") and 2000 < int(timeout[:-2]) <= 2500
+    response = request(app, "GET", "/subscriptions/slow", headers={"X-Request-Timeout": "60"})
+    assert response.status_code == 504
+
+    # Pooled connections do not keep the timeout
+    db = SessionLocal()
+    assert db.execute(text("SHOW statement_timeout")).scalar() == "0"
+    db.close()
+
+def test_client_disconnect_cancels_the_query():
+    """A client that goes away gets its running statement cancelled instead of left to finish"""
+    app = make_app(deadlines="read=30000")
+    before = cancelled_statements.value(reason="client_disconnect")
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.sleep(0.3)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": "/subscriptions/slow", "raw_path": b"/subscriptions/slow", "root_path": "", "query_string": b"",
+        "headers": [], "client": ("test", 1), "server": ("test", 80),
+    }
+    started = time.perf_counter()
+    asyncio.run(app(scope, receive, send))
+
+    assert time.perf_counter() - started < 2
+    assert cancelled_statements.value(reason="client_disconnect") == before + 1
+    assert timed_out_requests.value(route_class="read", reason="client_disconnect") >= 1
+
+def test_admission_wait_ends_at_the_deadline():
+    """A request queued behind a full class gets 504 at its deadline, not after the queue timeout"""
+    app = FastAPI()
+    app.add_middleware(AdmissionControlMiddleware, limits="read=1:4", queue_timeout_ms=5000)
+    app.add_middleware(DeadlineMiddleware, deadlines="read=300")
+
+    @app.get("/subscriptions/busy")
+    async def busy():
+        await asyncio.sleep(1)
+        return {"done": True}
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            holder = asyncio.create_task(client.get("/subscriptions/busy"))
+            await asyncio.sleep(0.05)
+            started = time.perf_counter()
+            queued = await client.get("/subscriptions/busy")
+            return queued, time.perf_counter() - started, await holder
+
+    queued, waited, holder = asyncio.run(scenario())
+    assert queued.status_code == 504
+    assert waited < 0.6
+    assert holder.status_code == 200
+
+def test_waiting_callers_keep_their_own_deadline():
+    """A shared call that ran out of its caller's deadline is run again for the others; waits end at their own"""
+    flight = SingleFlight("test_deadlines")
+    started = threading.Event()
+    results = []
+
+    def expired_query():
+        started.set()
+        time.sleep(0.2)
+        raise DeadlineExceeded()
+
+    def leader():
+        try:
+            flight.do("key", expired_query)
+        except DeadlineExceeded as e:
+            results.append(e.reason)
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+    started.wait()
+    results.append(flight.do("key", lambda: "done"))
+    thread.join()
+    assert sorted(results) == ["deadline", "done"]
+
+    started.clear()
+    thread = threading.Thread(target=lambda: flight.do("key", lambda: started.set() or time.sleep(0.5)))
+    thread.start()
+    started.wait()
+    token = set_deadline(Deadline(0.1))
+    try:
+        waited = time.perf_counter()
+        try:
+            flight.do("key", lambda: "done")
+            assert False, "waited past the deadline"
+        except DeadlineExceeded:
+            assert time.perf_counter() - waited < 0.3
+    finally:
+        reset_deadline(token)
+    thread.join()
@@ -0,0 +1,45 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.middleware.profiling import ProfileStore, ProfilingMiddleware
+
+def make_client(store, **kwargs):
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware, store=store, **kwargs)
+
+    @app.get("/work")
+    def work():
+        return {"total": sum(i * i for i in range(200000))}
+
+    return TestClient(app)
+
+def test_profile_requested_by_header(tmp_path):
+    """A request with the secret header is profiled and stored"""
+    store = ProfileStore(directory=str(tmp_path), max_files=5)
+    client = make_client(store, secret="s3cret", sample_rate=0)
+
+    assert "x-profile-id" not in client.get("/work").headers
+    assert "x-profile-id" not in client.get("/work", headers={"X-Profile": "s3cre"}).headers
+
+    response = client.get("/work", headers={"X-Profile": "s3cret"})
+    assert response.status_code == 200
+    name = response.headers["x-profile-id"]
+    assert [p["name"] for p in store.list()] == [name]
+    assert store.path("../" + name) is None
+
+def test_profile_store_is_bounded(tmp_path):
+    """Only the newest max_files profiles are kept"""
+    store = ProfileStore(directory=str(tmp_path), max_files=3)
+    for i in range(5):
+        store.save(f"{1000 + i}-get-work.json", {"i": i})
+
+    assert [p["name"] for p in store.list()] == [
+        "1004-get-work.json", "1003-get-work.json", "1002-get-work.json"
+    ]
+
+def test_profile_names_are_unique(tmp_path, monkeypatch):
+    """Profiles of the same path in the same millisecond get different names"""
+    store = ProfileStore(directory=str(tmp_path), max_files=5)
+    monkeypatch.setattr("app.middleware.profiling.time.time", lambda: 1000.0)
+    names = {store.new_name("GET", "/work") for _ in range(3)}
+    assert len(names) == 3
+    assert all(name.startswith("1000000-") for name in names)
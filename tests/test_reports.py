@@ -0,0 +1,108 @@
+import json
+import os
+import pytest
+import time
+import uuid
+from datetime import date
+from sqlalchemy.orm import sessionmaker
+from app.database.session import engine, Base
+from app.jobs.reports import ReportJobManager, _period_dates
+from app.repositories import subscription_repository
+
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@pytest.fixture(scope="module")
+def seeded():
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    subscription_repository.create_many(db, [
+        {
+            "id": uuid.uuid4(),
+            "service_name": f"Report Service {i % 3}",
+            "price": 100 + i,
+            "user_id": uuid.uuid4(),
+            "start_date": date(2025, 1 + i % 6, 1),
+            "end_date": date(2025, 9, 1) if i % 2 else None
+        }
+        for i in range(40)
+    ])
+    yield db
+    db.close()
+    Base.metadata.drop_all(bind=engine)
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = ReportJobManager(directory=str(tmp_path), workers=2, shards_per_worker=2)
+    yield manager
+    manager.close()
+
+def wait_for(manager, job_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if job["status"] in ("completed", "failed", "cancelled"):
+            return job
+        time.sleep(0.1)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+def test_user_ranges_cover_uuid_space():
+    """Shards are contiguous half-open ranges over the whole UUID space"""
+    ranges = subscription_repository.user_ranges(4)
+    assert ranges[0][0] is None and ranges[-1][1] is None
+    assert all(high == low for (_, high), (low, _) in zip(ranges, ranges[1:]))
+
+def test_period_dates_use_the_period_parser():
+    """Job periods are parsed and checked like request periods"""
+    assert _period_dates({"start_period": "02-2025", "end_period": "10-2025"}) == (date(2025, 2, 1), date(2025, 10, 1))
+    with pytest.raises(ValueError):
+        _period_dates({"start_period": "13-2025", "end_period": "10-2025"})
+
+def test_sharded_cost_report_matches_sql(seeded, manager):
+    """Merging per-shard results gives the same report as a single query"""
+    job = manager.submit("cost", {"start_period": "02-2025", "end_period": "10-2025"})
+    job = wait_for(manager, job["id"])
+    assert job["status"] == "completed", job["error"]
+
+    with open(manager.result_path(job["id"])) as f:
+        report = json.load(f)
+
+    total, count = subscription_repository.total_cost(seeded, date(2025, 2, 1), date(2025, 10, 1))
+    months = subscription_repository.monthly_cost(seeded, date(2025, 2, 1), date(2025, 10, 1))
+    assert (report["total_cost"], report["count"]) == (total, count)
+    assert [(m["total_cost"], m["count"]) for m in report["months"]] == [(t, c) for _, t, c in months]
+
+def test_cancelled_job_does_not_run(seeded, manager):
+    """A job cancelled while queued finishes as cancelled without a result"""
+    manager.max_running = 1
+    first = manager.submit("services", {"start_period": "01-2025", "end_period": "12-2025"})
+    second = manager.submit("services", {"start_period": "01-2025", "end_period": "12-2025"})
+    assert manager.cancel(second["id"])["status"] == "cancelling"
+
+    assert wait_for(manager, first["id"])["status"] == "completed"
+    assert wait_for(manager, second["id"])["status"] == "cancelled"
+    assert manager.result_path(second["id"]) is None
+
+def test_failed_submit_frees_its_queue_place(tmp_path):
+    """A job that cannot be written does not count against the queue limit"""
+    blocker = tmp_path / "not-a-directory"
+    blocker.write_text("")
+    manager = ReportJobManager(directory=str(blocker), workers=1, max_queued=1)
+    for _ in range(3):
+        with pytest.raises(OSError):
+            manager.submit("cost", {"start_period": "01-2025", "end_period": "02-2025"})
+    manager.close()
+
+def test_sweep_deletes_old_finished_jobs(tmp_path):
+    """Finished jobs past the retention period are deleted with their results; others stay"""
+    manager = ReportJobManager(directory=str(tmp_path), retention_hours=1)
+    old = time.time() - 7200
+    for job_id, status, age in (("oldDone", "completed", old), ("oldQueued", "queued", old), ("newDone", "completed", time.time())):
+        for suffix in (".json", ".result.json"):
+            path = tmp_path / f"{job_id}{suffix}"
+            path.write_text(json.dumps({"id": job_id, "status": status}))
+            os.utime(path, (age, age))
+
+    assert manager.sweep() == 1
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "newDone.json", "newDone.result.json", "oldQueued.json", "oldQueued.result.json"
+    ]
@@ -0,0 +1,167 @@
+import itertools
+import pytest
+import uuid
+from datetime import date
+from sqlalchemy import select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+from app.database.instrumentation import capture_queries
+from app.database.session import engine, Base
+from app.repositories import subscription_repository
+
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@pytest.fixture(scope="module")
+def test_db():
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+@pytest.fixture
+def db(test_db):
+    session = TestingSessionLocal()
+    yield session
+    session.close()
+
+def test_update_returns_new_row(db):
+    """UPDATE ... RETURNING hands back the changed row and bumps updated_at"""
+    row = subscription_repository.create(db, {
+        "service_name": "Repo Service",
+        "price": 100,
+        "user_id": uuid.uuid4(),
+        "start_date": date(2025, 1, 1)
+    })
+
+    updated = subscription_repository.update_fields(db, row.id, {"price": 250})
+    assert updated.price == 250
+    assert updated.service_name == "Repo Service"
+    assert updated.updated_at >= row.updated_at
+
+def test_missing_rows(db):
+    """Writes against an unknown id report it instead of raising"""
+    missing = uuid.uuid4()
+    assert subscription_repository.update_fields(db, missing, {"price": 1}) is None
+    assert subscription_repository.delete_by_id(db, missing) is False
+
+def test_change_feed(db):
+    """Changes since a cursor come back as current rows and delete tombstones"""
+    cursor = subscription_repository.change_cursor(db)
+    db.rollback()
+    values = {"service_name": "Feed Service", "price": 100, "user_id": uuid.uuid4(), "start_date": date(2025, 1, 1)}
+    kept = subscription_repository.create(db, values)
+    removed = subscription_repository.create(db, values)
+    subscription_repository.update_fields(db, kept.id, {"price": 300})
+    subscription_repository.delete_by_id(db, removed.id)
+
+    upserts, deletes, next_cursor, has_more = subscription_repository.changes_since(db, cursor, 100)
+    assert [(row.id, row.price) for row in upserts] == [(kept.id, 300)]
+    assert deletes == [removed.id]
+    assert next_cursor > cursor and not has_more
+
+    assert subscription_repository.changes_since(db, next_cursor, 100)[:2] == ([], [])
+
+def test_change_feed_compaction(db):
+    """Old superseded entries and tombstones are dropped; cursors before a dropped tombstone expire"""
+    from app.jobs.change_feed import ChangeFeedCompactor
+
+    cursor = subscription_repository.change_cursor(db)
+    db.rollback()
+    values = {"service_name": "Compacted Service", "price": 100, "user_id": uuid.uuid4(), "start_date": date(2025, 1, 1)}
+    kept = subscription_repository.create(db, values)
+    removed = subscription_repository.create(db, values)
+    subscription_repository.update_fields(db, kept.id, {"price": 300})
+    subscription_repository.delete_by_id(db, removed.id)
+    ids = [kept.id, removed.id]
+    entries = select(subscription_repository.changes.c.operation).where(
+        subscription_repository.changes.c.subscription_id.in_(ids)
+    ).order_by(subscription_repository.changes.c.seq)
+
+    # Recent entries are kept
+    assert ChangeFeedCompactor(binds=[engine], batch_rows=2, batch_pause_ms=0).run_once() == 0
+    db.execute(subscription_repository.changes.update().values(changed_at=text("now() - interval '40 days'")))
+    db.commit()
+    assert ChangeFeedCompactor(binds=[engine], batch_rows=2, batch_pause_ms=0).run_once() >= 4
+    assert db.execute(entries).scalars().all() == ["upsert"]
+
+    with pytest.raises(subscription_repository.CursorExpired):
+        subscription_repository.changes_since(db, cursor, 100)
+    upserts, deletes, _, _ = subscription_repository.changes_since(db, (0, 0), 1000)
+    assert (kept.id, 300) in [(row.id, row.price) for row in upserts] and removed.id not in deletes
+
+def test_service_names_map_to_ids(db):
+    """Names are stored once in services and read back transparently"""
+    values = {"price": 100, "user_id": uuid.uuid4(), "start_date": date(2025, 1, 1)}
+    first = subscription_repository.create(db, {**values, "service_name": "Mapped Alpha"})
+    second = subscription_repository.create(db, {**values, "service_name": "Mapped Alpha"})
+    renamed = subscription_repository.update_fields(db, second.id, {"service_name": "Mapped Beta"})
+    assert (first.service_name, renamed.service_name) == ("Mapped Alpha", "Mapped Beta")
+    assert subscription_repository.get(db, second.id).service_name == "Mapped Beta"
+
+    names = db.execute(
+        select(subscription_repository.services.c.name).where(subscription_repository.services.c.name.like("Mapped %"))
+    ).scalars().all()
+    assert sorted(names) == ["Mapped Alpha", "Mapped Beta"]
+
+    costs = subscription_repository.service_cost(db, date(2025, 1, 1), date(2025, 1, 1), service_name="mapped")
+    assert [(name, total) for name, total, _, _ in costs] == [("Mapped Alpha", 100), ("Mapped Beta", 100)]
+
+def test_only_missing_services_are_retried(db, monkeypatch):
+    """A write naming a service wrongly believed to exist is retried; other integrity errors are not"""
+    values = {"price": 100, "user_id": uuid.uuid4(), "start_date": date(2025, 1, 1), "service_name": "Retried"}
+    known = subscription_repository._known_services.setdefault(str(engine.url), set())
+    known.add("Retried")
+    row = subscription_repository.create(db, values)
+    assert row.service_name == "Retried"
+
+    # A duplicate id fails once, without adding services or forgetting known ones
+    executed = []
+    execute = db.execute
+    monkeypatch.setattr(db, "execute", lambda statement, *args: executed.append(statement) or execute(statement, *args))
+    with pytest.raises(IntegrityError):
+        subscription_repository.create(db, {**values, "id": row.id})
+    db.rollback()
+    assert executed == [subscription_repository._INSERT]
+    assert "Retried" in known
+
+def test_count_filtered(db):
+    """A user's total is exact; broad filters fall back to the planner estimate past the threshold"""
+    user_id = uuid.uuid4()
+    for month in (1, 2, 3):
+        subscription_repository.create(db, {
+            "service_name": "Counted", "price": 100, "user_id": user_id, "start_date": date(2025, month, 1)
+        })
+
+    assert subscription_repository.count_filtered(db, user_id) == (3, True)
+    assert subscription_repository.count_filtered(db, user_id, active_to=date(2025, 1, 1)) == (1, True)
+    assert subscription_repository.count_filtered(db, service_name="Counted") == (3, True)
+    estimate, exact = subscription_repository.count_filtered(db, exact_max_rows=0)
+    assert not exact and estimate > 0
+    db.rollback()
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+@pytest.mark.parametrize("sort", [prefix + column for column in subscription_repository.LIST_SORTS for prefix in ("", "-")])
+def test_list_is_read_in_index_order(db, sort):
+    """Every filter combination of a sorted list is an ordered index scan, never a sort or a table scan"""
+    # Make any sort or sequential scan prohibitively expensive, so only plans
+    # an index can serve come out without one
+    db.execute(text("SET LOCAL enable_seqscan = off"))
+    db.execute(text("SET LOCAL enable_sort = off"))
+    periods = [(None, None), (date(2025, 1, 1), date(2025, 6, 1)), (date(2025, 3, 1), date(2025, 3, 1)),
+               (date(2025, 1, 1), None), (None, date(2025, 6, 1))]
+    for user_id, service_name, (active_from, active_to) in itertools.product((None, uuid.uuid4()), (None, "flix"), periods):
+        with capture_queries() as stats:
+            subscription_repository.list_filtered(
+                db, 20, 10, user_id, service_name, active_from=active_from, active_to=active_to, sort=sort
+            )
+        statement, parameters = stats.statements[-1]
+        plan = db.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters).scalar()[0]["Plan"]
+        nodes = list(plan_nodes(plan))
+        combination = f"user_id={user_id}, service_name={service_name}, period={active_from}..{active_to}"
+        assert not [node for node in nodes if node["Node Type"] in ("Sort", "Incremental Sort")], combination
+        scans = [node for node in nodes if node.get("Relation Name") == "subscriptions"]
+        assert [node["Node Type"] for node in scans] == ["Index Scan"], combination
+    db.rollback()
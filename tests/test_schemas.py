@@ -0,0 +1,42 @@
+import pytest
+import uuid
+from datetime import date
+from pydantic import ValidationError
+from app.schemas.subscription import MonthIndex, SubscriptionCostRequest, SubscriptionCreate, SubscriptionResponse
+
+def test_month_period_parses_to_index():
+    """MM-YYYY is parsed once into a month index and rendered back on output"""
+    subscription = SubscriptionCreate(
+        service_name=" Test ", price=100, user_id=uuid.uuid4(), start_date="03-2025", end_date="12-2025"
+    )
+    assert subscription.start_date == 2025 * 12 + 2
+    assert subscription.service_name == "Test"
+    assert subscription.model_dump(mode="json")["end_date"] == "12-2025"
+
+@pytest.mark.parametrize("value", ["3-2025", "13-2025", "01-1800", "01-2025x", 202501, 2025 * 12 + 2])
+def test_invalid_month_period(value):
+    """Malformed or out of range periods are rejected"""
+    with pytest.raises(ValidationError):
+        SubscriptionCreate(service_name="Test", price=100, user_id=uuid.uuid4(), start_date=value)
+
+def test_month_index_only_from_msgpack():
+    """Month indexes are only taken as marked by MsgPackRoute, and range checked"""
+    subscription = SubscriptionCreate(service_name="Test", price=100, user_id=uuid.uuid4(), start_date=MonthIndex(2025 * 12 + 2))
+    assert subscription.start_date == 2025 * 12 + 2 and type(subscription.start_date) is int
+    with pytest.raises(ValidationError):
+        SubscriptionCreate(service_name="Test", price=100, user_id=uuid.uuid4(), start_date=MonthIndex(1800 * 12))
+
+def test_cost_period_order():
+    """The end period may not be before the start period"""
+    assert SubscriptionCostRequest(start_period="01-2025", end_period="01-2025")
+    with pytest.raises(ValidationError):
+        SubscriptionCostRequest(start_period="02-2025", end_period="01-2025")
+
+def test_response_from_dates():
+    """Responses accept database dates and render them as MM-YYYY"""
+    response = SubscriptionResponse(
+        id=uuid.uuid4(), service_name="Test", price=100, user_id=uuid.uuid4(),
+        start_date=date(2025, 1, 1), end_date=None,
+        created_at="2025-01-01T00:00:00", updated_at="2025-01-01T00:00:00"
+    )
+    assert response.model_dump(mode="json")["start_date"] == "01-2025"
@@ -0,0 +1,177 @@
+import pytest
+import uuid
+from datetime import date
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, func, select, text
+from app.main import app
+from app.database.session import engine, Base
+from app.database.sharding import (
+    ShardRouter,
+    get_shards,
+    id_routing_key,
+    jump_hash,
+    new_subscription_id,
+    rebalance,
+    user_routing_key
+)
+from app.repositories import subscription_repository
+
+SHARD_DATABASES = ["test_db_shard1", "test_db_shard2"]
+
+client = TestClient(app)
+
+@pytest.fixture(scope="module")
+def shard_urls():
+    # Extra shards are extra databases on the test server
+    admin = create_engine(engine.url, isolation_level="AUTOCOMMIT")
+    with admin.connect() as conn:
+        for name in SHARD_DATABASES:
+            conn.execute(text(f"DROP DATABASE IF EXISTS {name}"))
+            conn.execute(text(f"CREATE DATABASE {name}"))
+    yield [engine.url.set(database=name).render_as_string(hide_password=False)
+           for name in [engine.url.database] + SHARD_DATABASES]
+    with admin.connect() as conn:
+        for name in SHARD_DATABASES:
+            conn.execute(text(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)"))
+    admin.dispose()
+
+@pytest.fixture
+def make_router(shard_urls):
+    routers = []
+
+    def make(count):
+        router = ShardRouter(urls=shard_urls[:count])
+        for shard_engine in router.engines:
+            Base.metadata.create_all(bind=shard_engine)
+        routers.append(router)
+        return router
+
+    yield make
+    app.dependency_overrides.pop(get_shards, None)
+    for router in routers:
+        for shard_engine in router.engines:
+            Base.metadata.drop_all(bind=shard_engine)
+        router.dispose()
+
+def serve(router):
+    def override_get_shards():
+        shards = router.sessions()
+        try:
+            yield shards
+        finally:
+            shards.close()
+    app.dependency_overrides[get_shards] = override_get_shards
+
+def shard_count(router, shard):
+    with router.engines[shard].connect() as conn:
+        return conn.execute(select(func.count()).select_from(subscription_repository.subscriptions)).scalar()
+
+def test_jump_hash_moves_only_keys_of_the_new_shard():
+    """Going from 4 to 5 shards moves about a fifth of the keys, all to the new shard"""
+    moved = [key for key in range(10000) if jump_hash(key, 4) != jump_hash(key, 5)]
+    assert all(jump_hash(key, 5) == 4 for key in moved)
+    assert 0.17 < len(moved) / 10000 < 0.23
+
+def test_new_ids_carry_the_user_routing_key():
+    user_id = uuid.uuid4()
+    subscription_id = new_subscription_id(user_id)
+    assert subscription_id.version == 4
+    assert id_routing_key(subscription_id) == user_routing_key(user_id)
+
+def test_point_requests_go_to_one_shard_and_lists_merge(make_router):
+    """Rows land on their user's shard; unfiltered lists and costs cover all shards"""
+    router = make_router(3)
+    serve(router)
+    users = [uuid.uuid4() for _ in range(12)]
+    created = [
+        client.post("/subscriptions/", json={
+            "service_name": f"Service {i % 3}", "price": 100, "user_id": str(users[i % 12]), "start_date": "01-2025"
+        }).json()
+        for i in range(24)
+    ]
+
+    for shard in range(3):
+        expected = sum(1 for row in created if router.shard_for_user(uuid.UUID(row["user_id"])) == shard)
+        assert shard_count(router, shard) == expected
+    assert router.shard_for_id(uuid.UUID(created[0]["id"])) == router.shard_for_user(users[0])
+
+    assert client.get(f"/subscriptions/{created[5]['id']}").json()["id"] == created[5]["id"]
+    assert client.put(f"/subscriptions/{created[5]['id']}", json={"price": 300}).json()["price"] == 300
+
+    listed = client.get("/subscriptions/?limit=1000").json()
+    assert sorted(row["id"] for row in listed) == sorted(row["id"] for row in created)
+    pages = [client.get(f"/subscriptions/?skip={skip}&limit=10").json() for skip in (0, 10, 20)]
+    assert [len(page) for page in pages] == [10, 10, 4]
+    assert len({row["id"] for page in pages for row in page}) == 24
+
+    by_user = client.get(f"/subscriptions/?user_id={users[1]}").json()
+    assert len(by_user) == 2 and all(row["user_id"] == str(users[1]) for row in by_user)
+
+    cost = client.get("/subscriptions/cost/?start_period=01-2025&end_period=02-2025").json()
+    assert cost == {"total_cost": 24 * 100 + 200, "period_start": "01-2025", "period_end": "02-2025", "count": 24}
+    monthly = client.get("/subscriptions/cost/monthly/?start_period=01-2025&end_period=02-2025").json()
+    assert [month["total_cost"] for month in monthly["months"]] == [2600, 2600]
+    user_cost = client.get(f"/subscriptions/cost/?start_period=01-2025&end_period=01-2025&user_id={users[5]}").json()
+    assert user_cost["total_cost"] == 300 + 100
+
+    feed = client.get("/subscriptions/changes").json()
+    assert len(feed["next_cursor"].split("_")) == 3
+    assert len(feed["upserts"]) == 24
+    assert client.get("/subscriptions/changes?since=1.0").status_code == 400
+
+    assert client.delete(f"/subscriptions/{created[5]['id']}").status_code == 204
+    assert client.get(f"/subscriptions/{created[5]['id']}").status_code == 404
+
+def test_ids_without_routing_key_are_found_on_other_shards(make_router):
+    """Subscriptions created before sharding are still found by id"""
+    router = make_router(2)
+    serve(router)
+    user_id = uuid.uuid4()
+    home = router.shard_for_user(user_id)
+    # A random id routed to the other shard
+    subscription_id = next(i for i in iter(uuid.uuid4, None) if router.shard_for_id(i) != home)
+    db = router.session_factories[home]()
+    subscription_repository.create(db, {
+        "id": subscription_id, "service_name": "Legacy", "price": 100, "user_id": user_id,
+        "start_date": date(2024, 1, 1), "end_date": None
+    })
+    db.close()
+
+    response = client.get(f"/subscriptions/{subscription_id}")
+    assert response.status_code == 200
+    assert response.json()["service_name"] == "Legacy"
+
+    missing = uuid.uuid4()
+    response = client.post("/subscriptions/batch-get", json={"ids": [str(missing), str(subscription_id)]})
+    assert [row and row["service_name"] for row in response.json()["subscriptions"]] == [None, "Legacy"]
+    assert response.json()["not_found"] == [str(missing)]
+
+def test_rebalance_moves_users_to_the_new_shard(make_router):
+    """Adding a shard moves only the users now routed to it, without tombstones"""
+    before = make_router(2)
+    rows = [
+        {"id": uuid.uuid4(), "service_name": "S", "price": 10, "user_id": uuid.uuid4(),
+         "start_date": date(2024, 1, 1), "end_date": None}
+        for _ in range(300)
+    ]
+    for shard in range(2):
+        db = before.session_factories[shard]()
+        subscription_repository.create_many(db, [row for row in rows if before.shard_for_user(row["user_id"]) == shard])
+        db.close()
+
+    after = make_router(3)
+    moved = rebalance(after, batch_rows=50)
+
+    expected_moves = sum(1 for row in rows if after.shard_for_user(row["user_id"]) == 2)
+    assert moved == expected_moves > 0
+    for shard in range(3):
+        assert shard_count(after, shard) == sum(1 for row in rows if after.shard_for_user(row["user_id"]) == shard)
+    for shard in range(2):
+        db = after.session_factories[shard]()
+        upserts, deletes, _, _ = subscription_repository.changes_since(db, (0, 0), 1000)
+        db.close()
+        assert deletes == []
+        assert len(upserts) == shard_count(after, shard)
+
+    # Nothing left to move
+    assert rebalance(after, batch_rows=50) == 0
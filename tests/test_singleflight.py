@@ -0,0 +1,83 @@
+import threading
+import time
+import pytest
+from app.utils.singleflight import SingleFlight, coalesced, executions, flight_key
+
+def test_flight_key_ignores_unset_params_and_order():
+    assert flight_key(1, 2, user_id=None, service_name="a") == flight_key(1, 2, service_name="a")
+    assert flight_key(1, b=2, a=1) == flight_key(1, a=1, b=2)
+    assert flight_key(1, a=1) != flight_key(2, a=1)
+
+def test_callers_arriving_during_a_query_share_the_next_one():
+    """Callers arriving while a query runs wait for it and share one execution started after they arrived"""
+    flight = SingleFlight("test_threads")
+    calls = []
+    running = threading.Event()
+    release = threading.Event()
+    value = {"total_cost": 1}
+
+    def query():
+        calls.append(1)
+        result = dict(value)
+        running.set()
+        release.wait()
+        return result
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do(("cost", 1), query)))
+    leader.start()
+    running.wait()
+
+    # A write committed after the running query started must be seen by later callers
+    value["total_cost"] = 42
+    followers = [threading.Thread(target=lambda: results.append(flight.do(("cost", 1), query))) for _ in range(9)]
+    for thread in followers:
+        thread.start()
+    time.sleep(0.1)
+    assert len(calls) == 1
+    release.set()
+    for thread in [leader] + followers:
+        thread.join()
+
+    assert len(calls) == 2
+    assert sorted(result["total_cost"] for result in results) == [1] + [42] * 9
+    assert executions.value(group="test_threads") == 2
+    assert coalesced.value(group="test_threads") == 8
+
+    # Nothing is cached once the call is over
+    flight.do(("cost", 1), query)
+    assert len(calls) == 3
+
+def test_errors_are_shared_with_waiting_callers():
+    flight = SingleFlight("test_errors")
+    running = threading.Event()
+    release = threading.Event()
+    failures = []
+
+    def blocking():
+        running.set()
+        release.wait()
+
+    def failing():
+        failures.append(1)
+        raise RuntimeError("db down")
+
+    errors = []
+    def follower():
+        try:
+            flight.do("key", failing)
+        except RuntimeError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=lambda: flight.do("key", blocking))
+    leader.start()
+    running.wait()
+    threads = [threading.Thread(target=follower) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in [leader] + threads:
+        thread.join()
+    assert [str(e) for e in errors] == ["db down"] * 2
+    assert len(failures) == 1
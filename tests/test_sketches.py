@@ -0,0 +1,122 @@
+import random
+import time
+import uuid
+from datetime import date
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import sessionmaker
+
+from app.analytics import HyperLogLog, QuantileSketch, SketchStore, sketch_store
+from app.database.session import engine, Base
+from app.main import app
+from app.repositories import subscription_repository
+
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+client = TestClient(app)
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = TestingSessionLocal()
+    yield session
+    session.close()
+    Base.metadata.drop_all(bind=engine)
+
+def test_hyperloglog_estimates_and_merges():
+    """Sequential ids are counted within the error bound, and merging is a union"""
+    users = [uuid.UUID(int=i) for i in range(30000)]
+    first, second, union = HyperLogLog(12), HyperLogLog(12), HyperLogLog(12)
+    for user in users[:20000]:
+        first.add(user)
+        union.add(user)
+    for user in users[10000:]:
+        second.add(user)
+        union.add(user)
+
+    assert abs(union.estimate() - 30000) < 30000 * 3 * union.relative_error
+    first.merge(second)
+    assert first.estimate() == union.estimate()
+
+    small = HyperLogLog(12)
+    for user in users[:5] * 3:
+        small.add(user)
+    assert round(small.estimate()) == 5
+
+def test_quantile_sketch_relative_accuracy():
+    """Quantiles come back within the relative accuracy, also after merging"""
+    rng = random.Random(1)
+    values = [rng.randint(100, 5000) for _ in range(20000)]
+    halves = QuantileSketch(0.01), QuantileSketch(0.01)
+    for i, value in enumerate(values):
+        halves[i % 2].add(value)
+    sketch = halves[0]
+    sketch.merge(halves[1])
+
+    values.sort()
+    qs = [0, 0.5, 0.9, 1]
+    for q, estimate in zip(qs, sketch.quantiles(qs)):
+        exact = values[int(q * (len(values) - 1))]
+        assert abs(estimate - exact) <= 0.01 * exact
+    assert QuantileSketch().quantiles([0.5]) == [None]
+
+def test_sketch_store_endpoints(db):
+    """Sketches rebuilt from the table answer per month, take new subscriptions and mark changes stale"""
+    users = [uuid.uuid4() for _ in range(3)]
+    subscription_repository.create_many(db, [
+        {"id": uuid.uuid4(), "service_name": "Sketched Music", "price": 300, "user_id": users[0],
+         "start_date": date(2025, 1, 1), "end_date": date(2025, 3, 1)},
+        # Two subscriptions of one user to one service are one spend
+        {"id": uuid.uuid4(), "service_name": "Sketched Music", "price": 200, "user_id": users[0],
+         "start_date": date(2025, 3, 1), "end_date": None},
+        {"id": uuid.uuid4(), "service_name": "Sketched Music", "price": 400, "user_id": users[1],
+         "start_date": date(2025, 2, 15), "end_date": None},
+        {"id": uuid.uuid4(), "service_name": "Sketched Video", "price": 900, "user_id": users[2],
+         "start_date": date(2024, 1, 1), "end_date": None},
+    ])
+    sketch_store.rebuild(today=date(2025, 4, 10))
+    params = {"start_period": "01-2025", "end_period": "04-2025", "service_name": "music"}
+
+    data = client.get("/analytics/distinct-users", params=params).json()
+    assert [month["users"]["estimate"] for month in data["months"]] == [1, 1, 2, 2]
+    assert data["users"]["estimate"] == 2 and data["stale"] is False
+
+    data = client.get("/analytics/spend-quantiles", params={**params, "q": [0, 1]}).json()
+    march = data["months"][2]
+    assert march["samples"] == 2
+    assert [round(q["value"], -1) for q in march["quantiles"]] == [400, 500]
+    assert march["quantiles"][0]["lower"] < march["quantiles"][0]["value"] < march["quantiles"][0]["upper"]
+
+    row = subscription_repository.create(db, {
+        "service_name": "Sketched Music", "price": 100, "user_id": uuid.uuid4(), "start_date": date(2025, 4, 1)
+    })
+    sketch_store.record(row)
+    data = client.get("/analytics/distinct-users", params=params).json()
+    assert data["months"][3]["users"]["estimate"] == 3
+    assert client.get("/analytics/distinct-users", params={**params, "service_name": None}).json()["users"]["estimate"] == 4
+
+    # An update adds the new values right away; the old ones make answers stale
+    assert client.put(f"/subscriptions/{row.id}", json={"price": 5000}).status_code == 200
+    data = client.get("/analytics/spend-quantiles", params={**params, "q": [1]}).json()
+    assert round(data["months"][3]["quantiles"][0]["value"], -2) == 5000
+    assert data["stale"] is True
+    assert client.get("/analytics/distinct-users", params=params).json()["stale"] is True
+    response = client.get("/analytics/distinct-users", params={**params, "end_period": "05-2025"})
+    assert response.status_code == 400
+
+def test_writes_do_not_trigger_rebuilds(db):
+    """Only a due full refresh rebuilds the store, however many writes mark it stale"""
+    store = SketchStore(binds=[engine], refresh_seconds=0.01, full_refresh_seconds=3600)
+    store.start()
+    try:
+        for _ in range(200):
+            if store.ready:
+                break
+            time.sleep(0.01)
+        built_at = store.built_at
+        store.mark_stale()
+        time.sleep(0.1)
+        assert store.built_at == built_at and store.stale
+    finally:
+        store.stop()
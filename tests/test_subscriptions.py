@@ -5,6 +5,7 @@ from fastapi.testclient import TestClient
 from app.main import app
 from app.database.session import get_db, engine, Base
 from app.models.subscription import Subscription
+from app.database.instrumentation import assert_query_count
 from sqlalchemy.orm import sessionmaker
 
 # Create test database session
@@ -65,6 +66,16 @@ def test_get_subscription(test_db, sample_subscription_data):
     assert data["id"] == subscription_id
     assert data["service_name"] == sample_subscription_data["service_name"]
 
+def test_get_subscription_query_budget(test_db, sample_subscription_data):
+    """Test that getting a subscription issues exactly one statement"""
+    create_response = client.post("/subscriptions/", json=sample_subscription_data)
+    subscription_id = create_response.json()["id"]
+    
+    with assert_query_count(1):
+        response = client.get(f"/subscriptions/{subscription_id}")
+    assert response.status_code == 200
+    assert response.headers["x-db-query-count"] == "1"
+
 def test_get_nonexistent_subscription(test_db):
     """Test getting a non-existent subscription"""
     fake_id = str(uuid.uuid4())
@@ -104,6 +115,33 @@ def test_delete_subscription(test_db, sample_subscription_data):
     get_response = client.get(f"/subscriptions/{subscription_id}")
     assert get_response.status_code == 404
 
+def test_conditional_update_and_delete(test_db, sample_subscription_data):
+    """Writes with a stale If-Match get 412 and the current ETag"""
+    create_response = client.post("/subscriptions/", json=sample_subscription_data)
+    subscription_id = create_response.json()["id"]
+    etag = client.get(f"/subscriptions/{subscription_id}").headers["etag"]
+    assert etag == create_response.headers["etag"] == '"1"'
+
+    # Two writers read version 1; the first one wins
+    response = client.put(f"/subscriptions/{subscription_id}", json={"price": 600}, headers={"If-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] == '"2"'
+    assert response.json()["version"] == 2
+
+    response = client.put(f"/subscriptions/{subscription_id}", json={"price": 800}, headers={"If-Match": etag})
+    assert response.status_code == 412
+    assert response.headers["etag"] == '"2"'
+    assert client.get(f"/subscriptions/{subscription_id}").json()["price"] == 600
+
+    for stale in ('W/"2"', '"abc"'):
+        response = client.delete(f"/subscriptions/{subscription_id}", headers={"If-Match": stale})
+        assert response.status_code == 412
+    response = client.delete(f"/subscriptions/{subscription_id}", headers={"If-Match": '"1", "2"'})
+    assert response.status_code == 204
+
+    response = client.put(f"/subscriptions/{subscription_id}", json={"price": 1}, headers={"If-Match": '"2"'})
+    assert response.status_code == 404
+
 def test_list_subscriptions(test_db):
     """Test listing subscriptions"""
     response = client.get("/subscriptions/")
@@ -126,6 +164,68 @@ def test_calculate_subscription_cost(test_db):
     assert data["period_start"] == "01-2025"
     assert data["period_end"] == "12-2025"
 
+def test_msgpack_round_trip(test_db):
+    """MessagePack bodies and responses use binary UUIDs, month indexes and epoch timestamps"""
+    msgpack = pytest.importorskip("msgpack")
+    user_id = uuid.uuid4()
+    headers = {"Content-Type": "application/msgpack", "Accept": "application/msgpack"}
+    body = {"service_name": "Packed", "price": 300, "user_id": user_id.bytes, "start_date": 2025 * 12 + 2}
+
+    response = client.post("/subscriptions/", content=msgpack.packb(body), headers=headers)
+    assert response.status_code == 201
+    assert response.headers["content-type"] == "application/msgpack"
+    created = msgpack.unpackb(response.content)
+    assert created["user_id"] == user_id.bytes
+    assert created["start_date"] == 2025 * 12 + 2
+    assert isinstance(created["created_at"], int)
+
+    subscription_id = uuid.UUID(bytes=created["id"])
+    assert client.get(f"/subscriptions/{subscription_id}").json()["start_date"] == "03-2025"
+    response = client.get("/subscriptions/", params={"user_id": str(user_id)}, headers={"Accept": "application/msgpack"})
+    assert [row["id"] for row in msgpack.unpackb(response.content)] == [created["id"]]
+
+    params = {"start_period": "03-2025", "end_period": "04-2025", "user_id": str(user_id)}
+    response = client.get("/subscriptions/cost/monthly/", params=params, headers={"Accept": "application/msgpack"})
+    assert [month["month"] for month in msgpack.unpackb(response.content)["months"]] == [2025 * 12 + 2, 2025 * 12 + 3]
+    # JSON stays the default
+    response = client.get("/subscriptions/cost/", params=params, headers={"Accept": "application/json, application/msgpack;q=0.5"})
+    assert response.json()["count"] == 1
+
+    response = client.post("/subscriptions/", content=b"\xc1", headers=headers)
+    assert response.status_code == 400
+    # Month indexes are a MessagePack encoding only; JSON bodies still need MM-YYYY
+    response = client.post("/subscriptions/", json={**body, "user_id": str(user_id)})
+    assert response.status_code == 422
+
+def test_batch_get(test_db):
+    """Batch lookup answers in request order with nulls for misses, in one statement"""
+    user_id = str(uuid.uuid4())
+    created = [
+        client.post("/subscriptions/", json={"service_name": "Batch", "price": price, "user_id": user_id, "start_date": "01-2025"}).json()
+        for price in (100, 200)
+    ]
+    missing = str(uuid.uuid4())
+    ids = [created[1]["id"], missing, created[0]["id"], created[1]["id"]]
+
+    with assert_query_count(2):
+        response = client.post("/subscriptions/batch-get", json={"ids": ids})
+    assert response.status_code == 200
+    data = response.json()
+    assert [row and row["price"] for row in data["subscriptions"]] == [200, None, 100, 200]
+    assert data["not_found"] == [missing]
+
+    # Found everywhere: the archive is not queried
+    with assert_query_count(1):
+        client.post("/subscriptions/batch-get", json={"ids": [row["id"] for row in created]})
+
+    msgpack = pytest.importorskip("msgpack")
+    response = client.post("/subscriptions/batch-get", json={"ids": ids}, headers={"Accept": "application/msgpack"})
+    packed = msgpack.unpackb(response.content)
+    assert [row and row["id"] for row in packed["subscriptions"]] == [uuid.UUID(i).bytes if i != missing else None for i in ids]
+
+    assert client.post("/subscriptions/batch-get", json={"ids": []}).status_code == 422
+    assert client.post("/subscriptions/batch-get", json={"ids": [missing] * 5001}).status_code == 422
+
 def test_invalid_date_format():
     """Test invalid date format validation"""
     invalid_data = {
@@ -150,5 +250,93 @@ def test_negative_price():
     response = client.post("/subscriptions/", json=invalid_data)
     assert response.status_code == 422  # Validation error
 
+def test_bulk_update_and_delete(test_db, monkeypatch):
+    """Bulk changes touch exactly the rows matching the filters, chunk by chunk"""
+    from app.api.routes import subscriptions as routes
+    monkeypatch.setattr(routes, "BULK_WRITE_CHUNK_ROWS", 2)
+    user_id = str(uuid.uuid4())
+    for i in range(5):
+        client.post("/subscriptions/", json={
+            "service_name": "Bulk Discontinued", "price": 100, "user_id": user_id, "start_date": f"0{i + 1}-2025"
+        })
+    client.post("/subscriptions/", json={
+        "service_name": "Bulk Kept", "price": 100, "user_id": user_id, "start_date": "01-2025"
+    })
+
+    assert client.delete("/subscriptions/bulk").status_code == 422
+    assert client.patch("/subscriptions/bulk?service_name=Bulk Discontinued", json={}).status_code == 400
+    # LIKE wildcards in the name are matched literally, not as "any name"
+    for wildcard in ("%", "_", "Bulk%Kept"):
+        response = client.delete("/subscriptions/bulk", params={"service_name": wildcard})
+        assert response.json() == {"affected": 0, "dry_run": False}
+
+    dry = client.patch("/subscriptions/bulk?service_name=Bulk Discontinued&dry_run=true", json={"price": 250})
+    assert dry.json() == {"affected": 5, "dry_run": True}
+
+    response = client.patch(
+        "/subscriptions/bulk?service_name=Bulk Discontinued&active_to=03-2025", json={"end_date": "06-2025", "price": 250}
+    )
+    assert response.json() == {"affected": 3, "dry_run": False}
+    rows = client.get(f"/subscriptions/?user_id={user_id}").json()
+    changed = [row for row in rows if row["price"] == 250]
+    assert len(changed) == 3 and all(row["end_date"] == "06-2025" for row in changed)
+
+    response = client.delete(f"/subscriptions/bulk?service_name=Bulk Discontinued&user_id={user_id}")
+    assert response.json() == {"affected": 5, "dry_run": False}
+    assert [row["service_name"] for row in client.get(f"/subscriptions/?user_id={user_id}").json()] == ["Bulk Kept"]
+
+def test_cost_reads_its_own_writes(test_db, monkeypatch):
+    """Cost answers reflect a single-row write right away, even with a warm snapshot"""
+    pytest.importorskip("numpy")
+    from app.analytics import analytics_engine
+    for name in ("_snapshot", "_delta_rows", "_cursor", "_main_built_at"):
+        monkeypatch.setattr(analytics_engine, name, getattr(analytics_engine, name))
+    user_id = str(uuid.uuid4())
+    params = {"start_period": "01-2025", "end_period": "01-2025", "user_id": user_id}
+    analytics_engine.refresh()
+    assert client.get("/subscriptions/cost/", params=params).json()["total_cost"] == 0
+
+    created = client.post("/subscriptions/", json={
+        "service_name": "Fresh", "price": 300, "user_id": user_id, "start_date": "01-2025"
+    }).json()
+    assert client.get("/subscriptions/cost/", params=params).json()["total_cost"] == 300
+
+    analytics_engine.refresh()
+    client.put(f"/subscriptions/{created['id']}", json={"price": 400})
+    assert client.get("/subscriptions/cost/", params=params).json()["total_cost"] == 400
+
+    analytics_engine.refresh()
+    client.delete(f"/subscriptions/{created['id']}")
+    assert client.get("/subscriptions/cost/monthly/", params=params).json()["months"][0]["total_cost"] == 0
+
+def test_list_period_filters_and_sort(test_db):
+    """Lists can be limited to an active period and sorted by whitelisted columns"""
+    user_id = str(uuid.uuid4())
+    for start, end in (("01-2025", "03-2025"), ("02-2025", None), ("05-2025", "06-2025")):
+        client.post("/subscriptions/", json={
+            "service_name": "Period Service", "price": 100, "user_id": user_id, "start_date": start, "end_date": end
+        })
+
+    def starts(query):
+        response = client.get(f"/subscriptions/?user_id={user_id}&{query}")
+        assert response.status_code == 200
+        return [row["start_date"] for row in response.json()]
+
+    assert starts("sort=start_date") == ["01-2025", "02-2025", "05-2025"]
+    assert starts("sort=-start_date") == ["05-2025", "02-2025", "01-2025"]
+    assert starts("active_at=03-2025&sort=start_date") == ["01-2025", "02-2025"]
+    assert starts("active_at=04-2025") == ["02-2025"]
+    assert starts("active_from=06-2025&sort=start_date") == ["02-2025", "05-2025"]
+    assert starts("active_from=01-2025&active_to=01-2025") == ["01-2025"]
+    assert starts("sort=-end_date") == ["02-2025", "05-2025", "01-2025"]
+
+    response = client.get(f"/subscriptions/?user_id={user_id}&active_at=03-2025&limit=1&with_total=true")
+    assert (response.headers["x-total-count"], response.headers["x-total-count-type"]) == ("2", "exact")
+    assert "x-total-count" not in client.get(f"/subscriptions/?user_id={user_id}").headers
+
+    assert client.get("/subscriptions/?sort=price").status_code == 422
+    assert client.get("/subscriptions/?active_at=03-2025&active_from=01-2025").status_code == 422
+    assert client.get("/subscriptions/?active_from=05-2025&active_to=01-2025").status_code == 422
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
\ No newline at end of file
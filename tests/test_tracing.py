@@ -0,0 +1,71 @@
+import json
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+from sqlalchemy import text
+from app.database.session import engine
+from app.middleware.tracing import TracingMiddleware
+from app.utils.tracing import SpanExporter, parse_traceparent
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+class Item(BaseModel):
+    name: str
+
+def make_client(exporter, **kwargs):
+    app = FastAPI()
+    app.add_middleware(TracingMiddleware, exporter=exporter, **kwargs)
+
+    @app.post("/items/{item_id}")
+    def create_item(item_id: int, item: Item):
+        with engine.connect() as conn:
+            count = conn.execute(text("SELECT :n"), {"n": item_id}).scalar()
+        return {"name": item.name, "count": count}
+
+    return TestClient(app)
+
+def read_spans(exporter):
+    exporter.close()
+    with open(exporter.path) as f:
+        return [json.loads(line) for line in f]
+
+def test_sampled_request_spans(tmp_path):
+    """A sampled caller's trace is continued with spans for each request phase"""
+    exporter = SpanExporter(destination="file", path=str(tmp_path / "traces.jsonl"))
+    client = make_client(exporter, sample_rate=0)
+
+    response = client.post("/items/7", json={"name": "a"}, headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-01"})
+    assert response.status_code == 200
+    trace_id, span_id, sampled = parse_traceparent(response.headers["traceparent"])
+    assert trace_id == TRACE_ID and sampled
+
+    spans = {span["name"]: span for span in read_spans(exporter)}
+    root = spans["POST /items/{item_id}"]
+    assert (root["spanId"], root["parentSpanId"], root["kind"]) == (span_id, PARENT_ID, "SPAN_KIND_SERVER")
+    assert root["attributes"]["http.status_code"] == 200
+    for phase in ("validate request", "handler", "serialize response"):
+        assert spans[phase]["parentSpanId"] == span_id
+    query = spans["SELECT"]
+    assert query["parentSpanId"] == spans["handler"]["spanId"]
+    assert query["attributes"]["db.statement"] == "SELECT %(n)s"
+    assert all(span["traceId"] == TRACE_ID for span in spans.values())
+
+def test_unsampled_requests_record_nothing(tmp_path):
+    """Unsampled requests only get a traceparent back"""
+    exporter = SpanExporter(destination="file", path=str(tmp_path / "traces.jsonl"))
+    client = make_client(exporter, sample_rate=0)
+
+    response = client.post("/items/1", json={"name": "a"})
+    assert response.status_code == 200
+    assert parse_traceparent(response.headers["traceparent"])[2] is False
+    response = client.post("/items/1", json={"name": "a"}, headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-00"})
+    assert parse_traceparent(response.headers["traceparent"])[0] == TRACE_ID
+
+    exporter.close()
+    assert not (tmp_path / "traces.jsonl").exists()
+
+def test_parse_traceparent():
+    assert parse_traceparent(f"00-{TRACE_ID}-{PARENT_ID}-01") == (TRACE_ID, PARENT_ID, True)
+    for invalid in (None, "", "garbage", f"ff-{TRACE_ID}-{PARENT_ID}-01", f"00-{'0' * 32}-{PARENT_ID}-01"):
+        assert parse_traceparent(invalid) is None